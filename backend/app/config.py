@@ -1,6 +1,6 @@
 import secrets
 from functools import lru_cache
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import PostgresDsn, validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -9,9 +9,16 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 class Settings(BaseSettings):
     """Settings for the API."""
 
+    api_url: str = ""
     api_key: str = secrets.token_urlsafe(32)
 
     db_echo: bool = False
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_pgbouncer: bool = False
     postgres_server: str = ""
     postgres_user: str = ""
     postgres_password: str = ""
@@ -24,7 +31,7 @@ class Settings(BaseSettings):
             return v
         return str(
             PostgresDsn.build(
-                scheme="postgresql+psycopg2",
+                scheme="postgresql+asyncpg",
                 username=values.get("postgres_user"),
                 password=values.get("postgres_password"),
                 host=values.get("postgres_server"),
@@ -37,17 +44,85 @@ class Settings(BaseSettings):
     refresh_token_expire_minutes: int = 0
     verify_code_expire_minutes: int = 0
     recovery_code_expire_minutes: int = 0
+    password_workers: int = 2
+    password_max_pending: int = 64
+    password_bcrypt_rounds: int = 12
+    # A user disabled by another worker or outside the ORM stays signed in for up to principal_cache_ttl seconds
+    principal_cache_size: int = 1024
+    principal_cache_ttl: float = 30
+    revocation_capacity: int = 100_000
+    revocation_error_rate: float = 0.001
+    revocation_refresh_seconds: float = 5
+
+    auth_code_store: str = "sql"
+    auth_code_redis_url: str = "redis://localhost:6379/0"
+
+    # Token bucket budgets per route and per client IP, account and API key, as "<requests>/<second|minute|hour|day>".
+    # The frontend calls from its server with one API key, so that budget is only a cap on the whole site's traffic
+    rate_limit_backend: str = "memory"
+    rate_limit_redis_url: str = "redis://localhost:6379/0"
+    rate_limits: Dict[str, Dict[str, str]] = {
+        "login": {"ip": "30/minute", "account": "10/minute", "api_key": "6000/minute"},
+        "signup": {"ip": "10/hour", "account": "5/hour", "api_key": "1200/minute"},
+        "verify-email": {"ip": "10/hour", "account": "3/hour", "api_key": "1200/minute"},
+        "forgot-password": {"ip": "10/hour", "account": "3/hour", "api_key": "1200/minute"},
+        "check-code": {"ip": "30/hour", "account": "10/hour", "api_key": "3000/minute"},
+    }
+    # Addresses or networks of proxies, such as the frontend's server, whose X-Forwarded-For names the client
+    trusted_proxies: List[str] = ["127.0.0.1/32", "::1/128"]
 
     smtp_ssl_host: str = ""
     smtp_ssl_port: int = 0
     smtp_ssl_sender: str = ""
     smtp_ssl_login: str = ""
     smtp_ssl_password: str = ""
+    smtp_starttls: bool = True
+    smtp_timeout: float = 10
+    smtp_pool_size: int = 4
+    smtp_pool_idle_timeout: float = 60
+    smtp_pool_check_seconds: float = 10
+    outbox_batch_size: int = 50
+    outbox_poll_seconds: float = 1
+    outbox_max_attempts: int = 8
+    outbox_retry_backoff: float = 30
+    outbox_retry_max_backoff: float = 3600
+    outbox_retention_hours: float = 168
+    outbox_prune_seconds: float = 3600
+
+    picture_storage: str = "local"
+    picture_storage_path: str = "data/pictures"
+    picture_max_bytes: int = 3 * 1024 * 1024
+    picture_max_pixels: int = 40_000_000
+    picture_sizes: List[int] = [48, 96, 192]
+    picture_default_size: int = 96
+    picture_formats: List[str] = ["webp", "avif"]
+    picture_workers: int = 2
+    picture_max_pending: int = 32
+    picture_max_waiting: int = 64
+
+    http_timeout: float = 5
+    http_max_connections: int = 20
+    http_max_keepalive: int = 10
+    http_retries: int = 2
+    http_retry_backoff: float = 0.2
+
+    page_size: int = 100
+    max_page_size: int = 500
+    max_bulk_size: int = 100
+    friend_suggestions_size: int = 20
+    friend_suggestions_cache_size: int = 1024
+    friend_suggestions_cache_ttl: float = 300
+
+    user_search_backend: str = "sql"
+    search_page_size: int = 10
+    search_fuzzy_min_length: int = 3
+    search_max_length: int = 64
 
     frontend_url: str = ""
     google_client_id: str = ""
     google_client_secret: str = ""
     google_redirect_uri: str = ""
+    google_jwks_url: str = "https://www.googleapis.com/oauth2/v3/certs"
 
     model_config = SettingsConfigDict(env_file=".env")
 
@@ -1,16 +1,119 @@
 """Database engine and helper functions."""
 
-from sqlmodel import Session, create_engine
+import time
+from uuid import uuid4
+
+from sqlalchemy import exc
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util.queue import AsyncAdaptedQueue
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.config import get_settings
+from app.models.metrics import PoolMetrics
 
 SETTINGS = get_settings()
-engine = create_engine(
+
+
+class MeteredQueue(AsyncAdaptedQueue):
+    """Async pool queue that records how long checkouts wait for a connection to be returned."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def get(self, block: bool = True, timeout: float | None = None):
+        # Only blocking gets wait, once the pool and its overflow are all checked out
+        if not block:
+            return super().get(block, timeout)
+        start = time.perf_counter()
+        try:
+            return super().get(block, timeout)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.wait_seconds += elapsed
+            self.max_wait_seconds = max(self.max_wait_seconds, elapsed)
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    """Async queue pool that counts checkouts and timeouts, and records their wait in its queue.
+
+    The wait excludes opening overflow connections and pre-pinging, which are part of a checkout but not of waiting
+    for a connection to be free.
+    """
+
+    _queue_class = MeteredQueue
+
+    checkouts: int = 0
+    timeouts: int = 0
+
+    def connect(self):
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.checkouts += 1
+
+    @property
+    def wait_seconds(self) -> float:
+        return self._pool.wait_seconds
+
+    @property
+    def max_wait_seconds(self) -> float:
+        return self._pool.max_wait_seconds
+
+
+connect_args = {}
+if SETTINGS.db_pgbouncer:
+    # PgBouncer in transaction mode hands each transaction a different server connection,
+    # so prepared statements must be disabled or given names that cannot collide.
+    connect_args = {
+        "statement_cache_size": 0,
+        "prepared_statement_cache_size": 0,
+        "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+    }
+
+engine = create_async_engine(
     url=SETTINGS.database_uri,
     echo=SETTINGS.db_echo,
+    poolclass=MeteredQueuePool,
+    pool_size=SETTINGS.db_pool_size,
+    max_overflow=SETTINGS.db_max_overflow,
+    pool_timeout=SETTINGS.db_pool_timeout,
+    pool_recycle=SETTINGS.db_pool_recycle,
+    pool_pre_ping=SETTINGS.db_pool_pre_ping,
+    connect_args=connect_args,
 )
 
 
-def get_session():
-    with Session(engine) as session:
+async def get_session():
+    async with AsyncSession(engine, expire_on_commit=False) as session:
         yield session
+
+
+def get_pool_metrics() -> PoolMetrics:
+    """
+    Get connection pool metrics for this worker.
+
+    Returns
+    -------
+    PoolMetrics
+        Pool metrics
+    """
+    pool = engine.pool
+    return PoolMetrics(
+        size=pool.size(),
+        max_overflow=SETTINGS.db_max_overflow,
+        # A negative max_overflow lets the pool open connections without bound
+        max_connections=pool.size() + SETTINGS.db_max_overflow if SETTINGS.db_max_overflow >= 0 else None,
+        checked_in=pool.checkedin(),
+        checked_out=pool.checkedout(),
+        overflow=max(pool.overflow(), 0),
+        checkouts=pool.checkouts,
+        timeouts=pool.timeouts,
+        avg_wait_ms=pool.wait_seconds / pool.checkouts * 1000 if pool.checkouts else 0.0,
+        max_wait_ms=pool.max_wait_seconds * 1000,
+    )
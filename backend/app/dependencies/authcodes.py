@@ -0,0 +1,277 @@
+"""Stores for short-lived email verification and recovery codes."""
+
+import hashlib
+import heapq
+import secrets
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Callable
+
+from fastapi import HTTPException
+from sqlmodel import delete, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.config import get_settings
+from app.models.users import AuthCode
+
+SETTINGS = get_settings()
+
+AUTH_CODE_STORE = SETTINGS.auth_code_store
+AUTH_CODE_REDIS_URL = SETTINGS.auth_code_redis_url
+
+# Outcomes of checking a code against a TTL-native store
+CODE_MISSING, CODE_INVALID, CODE_VERIFIED = 0, 1, 2
+
+# Deletes the code only if it matches, so concurrent requests cannot both use it
+VERIFY_SCRIPT = """
+local code = redis.call("GET", KEYS[1])
+if not code then
+    return 0
+end
+if code ~= ARGV[1] then
+    return 1
+end
+redis.call("DEL", KEYS[1])
+return 2
+"""
+
+NOT_FOUND_EXCEPTION = HTTPException(status_code=404, detail="Previous code not found, request new code")
+INVALID_EXCEPTION = HTTPException(status_code=400, detail="Code is invalid")
+EXPIRED_EXCEPTION = HTTPException(status_code=400, detail="Code is expired, request new code")
+
+
+def generate_code() -> str:
+    return secrets.token_hex(3)
+
+
+class AuthCodeStore(ABC):
+    """Store holding the latest code per email and request type.
+
+    Issuing a code replaces the previous one, and verifying a code uses it up.
+    """
+
+    @abstractmethod
+    async def issue(self, session: AsyncSession, email: str, request_type: str, expires: timedelta) -> str:
+        """
+        Issue a new code. Needs a commit with the SQL store, so it can share a transaction with the email it is sent in.
+
+        Parameters
+        ----------
+        session : AsyncSession
+            Session, used only by the SQL store
+        email : str
+            Email
+        request_type : str
+            Request type
+        expires : timedelta
+            Time until the code expires
+
+        Returns
+        -------
+        str
+            Code
+        """
+
+    @abstractmethod
+    async def verify(self, session: AsyncSession, email: str, request_type: str, code: str) -> None:
+        """
+        Verify and use up a code.
+
+        Parameters
+        ----------
+        session : AsyncSession
+            Session, used only by the SQL store
+        email : str
+            Email
+        request_type : str
+            Request type
+        code : str
+            Code
+
+        Raises
+        ------
+        HTTPException
+            If code is not found, invalid or expired
+        """
+
+    @abstractmethod
+    async def close(self) -> None:
+        """Release codes and connections."""
+
+
+class SQLAuthCodeStore(AuthCodeStore):
+    """Codes as rows in the database, kept until they are replaced."""
+
+    async def get_latest(self, session: AsyncSession, email: str, request_type: str) -> AuthCode | None:
+        return (
+            await session.exec(
+                select(AuthCode)
+                .where(AuthCode.email == email)
+                .where(AuthCode.request_type == request_type)
+                .where(AuthCode.status == "pending")
+                .order_by(AuthCode.request_date.desc(), AuthCode.id.desc())
+                .limit(1)
+            )
+        ).first()
+
+    async def issue(self, session: AsyncSession, email: str, request_type: str, expires: timedelta) -> str:
+        # Only the latest code can be verified, so earlier ones are dead weight
+        await session.exec(delete(AuthCode).where(AuthCode.email == email).where(AuthCode.request_type == request_type))
+        auth_code = AuthCode(
+            email=email, code=generate_code(), request_type=request_type, expire_date=datetime.utcnow() + expires
+        )
+        session.add(auth_code)
+        return auth_code.code
+
+    async def verify(self, session: AsyncSession, email: str, request_type: str, code: str) -> None:
+        now = datetime.utcnow()
+        latest = (
+            select(AuthCode.id)
+            .where(AuthCode.email == email)
+            .where(AuthCode.request_type == request_type)
+            .where(AuthCode.status == "pending")
+            .order_by(AuthCode.request_date.desc(), AuthCode.id.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        # Checking and using the code in one statement means concurrent requests cannot both verify it,
+        # since the row lock makes the second recheck the status after the first commits
+        verified = await session.exec(
+            update(AuthCode)
+            .where(AuthCode.id == latest)
+            .where(AuthCode.status == "pending")
+            .where(AuthCode.code == code)
+            .where(AuthCode.expire_date >= now)
+            .values(status="verified", usage_date=now)
+            .returning(AuthCode.id)
+        )
+        if verified.first() is not None:
+            await session.commit()
+            return
+
+        # Only failed attempts read the code back, to report why
+        db_verify_code = await self.get_latest(session, email, request_type)
+        if not db_verify_code or not db_verify_code.code:
+            raise NOT_FOUND_EXCEPTION
+        if code != db_verify_code.code:
+            raise INVALID_EXCEPTION
+        if db_verify_code.expire_date < now:
+            db_verify_code.status = "expired"
+            session.add(db_verify_code)
+            await session.commit()
+            raise EXPIRED_EXCEPTION
+        # Verified by a concurrent request in the meantime
+        raise INVALID_EXCEPTION
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryAuthCodeStore(AuthCodeStore):
+    """Codes in this worker that disappear when they expire, for a single worker only.
+
+    An expired code is indistinguishable from one never issued.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.codes: dict[tuple[str, str], tuple[str, float]] = {}
+        self.expiries: list[tuple[float, tuple[str, str]]] = []
+
+    def prune(self):
+        now = self.clock()
+        while self.expiries and self.expiries[0][0] <= now:
+            expires, key = heapq.heappop(self.expiries)
+            # Skip codes that were replaced after this expiry was scheduled
+            if key in self.codes and self.codes[key][1] == expires:
+                del self.codes[key]
+
+    async def issue(self, session: AsyncSession, email: str, request_type: str, expires: timedelta) -> str:
+        self.prune()
+        code = generate_code()
+        expires_at = self.clock() + expires.total_seconds()
+        self.codes[(email, request_type)] = (code, expires_at)
+        heapq.heappush(self.expiries, (expires_at, (email, request_type)))
+        return code
+
+    async def verify(self, session: AsyncSession, email: str, request_type: str, code: str) -> None:
+        self.prune()
+        stored = self.codes.get((email, request_type))
+        if stored is None:
+            raise NOT_FOUND_EXCEPTION
+        if code != stored[0]:
+            raise INVALID_EXCEPTION
+        del self.codes[(email, request_type)]
+
+    async def close(self) -> None:
+        self.codes.clear()
+        self.expiries.clear()
+
+
+class RedisAuthCodeStore(AuthCodeStore):
+    """Codes in Redis, or anything speaking its protocol and Lua scripting, expired by the server.
+
+    An expired code is indistinguishable from one never issued.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.script = client.register_script(VERIFY_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisAuthCodeStore":
+        import redis.asyncio  # Only needed with the redis store
+
+        return cls(redis.asyncio.from_url(url))
+
+    def get_key(self, email: str, request_type: str) -> str:
+        # Hashed, so the store never holds emails
+        return f"authcode:{request_type}:{hashlib.sha256(email.encode()).hexdigest()[:32]}"
+
+    async def issue(self, session: AsyncSession, email: str, request_type: str, expires: timedelta) -> str:
+        code = generate_code()
+        await self.client.set(self.get_key(email, request_type), code, px=max(int(expires.total_seconds() * 1000), 1))
+        return code
+
+    async def verify(self, session: AsyncSession, email: str, request_type: str, code: str) -> None:
+        result = int(await self.script(keys=[self.get_key(email, request_type)], args=[code]))
+        if result == CODE_MISSING:
+            raise NOT_FOUND_EXCEPTION
+        if result == CODE_INVALID:
+            raise INVALID_EXCEPTION
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+AUTH_CODE_STORES: dict[str, Callable[[], AuthCodeStore]] = {
+    "sql": SQLAuthCodeStore,
+    "memory": MemoryAuthCodeStore,
+    "redis": lambda: RedisAuthCodeStore.from_url(AUTH_CODE_REDIS_URL),
+}
+
+STORE: AuthCodeStore | None = None
+
+
+def get_auth_code_store() -> AuthCodeStore:
+    """
+    Get the configured auth code store, creating it if needed.
+
+    Returns
+    -------
+    AuthCodeStore
+        Auth code store
+    """
+    global STORE
+    if STORE is None:
+        STORE = AUTH_CODE_STORES[AUTH_CODE_STORE]()
+    return STORE
+
+
+async def close_auth_code_store() -> None:
+    """Close the auth code store."""
+    global STORE
+    if STORE is not None:
+        await STORE.close()
+        STORE = None
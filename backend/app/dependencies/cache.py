@@ -0,0 +1,149 @@
+"""In-process caches."""
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable
+
+from app.models.metrics import CacheMetrics
+
+# Every cache by name, for metrics
+CACHES = {}
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after a fixed time to live.
+
+    Entries can be tagged, e.g. with a user id, so every entry for a tag can be invalidated at once.
+    Caches are per process, so other workers only see an invalidation once their own entries expire.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries: OrderedDict[Hashable, tuple[float, Any, tuple]] = OrderedDict()
+        self.tags: dict[Hashable, set] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        CACHES[name] = self
+
+    def get(self, key: Hashable) -> Any | None:
+        """
+        Get value, counting a hit or a miss.
+
+        Parameters
+        ----------
+        key : Hashable
+            Key
+
+        Returns
+        -------
+        Any | None
+            Value if cached and not expired, else None
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= self.clock():
+            if entry is not None:
+                self.delete(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, tags: Iterable[Hashable] = (), ttl: float | None = None):
+        """
+        Set value, evicting the least recently used entry if full.
+
+        Parameters
+        ----------
+        key : Hashable
+            Key
+        value : Any
+            Value
+        tags : Iterable[Hashable]
+            Tags to invalidate the entry by
+        ttl : float | None
+            Time to live, capped at the cache's, by default the cache's
+        """
+        if self.maxsize <= 0:
+            return
+        self.delete(key)
+        while len(self.entries) >= self.maxsize:
+            self.delete(next(iter(self.entries)))
+            self.evictions += 1
+        tags = tuple(tags)
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self.entries[key] = (self.clock() + ttl, value, tags)
+        for tag in tags:
+            self.tags.setdefault(tag, set()).add(key)
+
+    def delete(self, key: Hashable):
+        """
+        Delete value if cached.
+
+        Parameters
+        ----------
+        key : Hashable
+            Key
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self.tags.get(tag)
+            keys.discard(key)
+            if not keys:
+                del self.tags[tag]
+
+    def invalidate(self, tag: Hashable):
+        """
+        Delete every value with a tag.
+
+        Parameters
+        ----------
+        tag : Hashable
+            Tag
+        """
+        for key in list(self.tags.get(tag, ())):
+            self.delete(key)
+
+    def clear(self):
+        """Delete every value and reset counters."""
+        self.entries.clear()
+        self.tags.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def get_metrics(self) -> CacheMetrics:
+        """
+        Get cache metrics.
+
+        Returns
+        -------
+        CacheMetrics
+            Cache metrics
+        """
+        lookups = self.hits + self.misses
+        return CacheMetrics(
+            size=len(self.entries),
+            maxsize=self.maxsize,
+            ttl=self.ttl,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            hit_rate=self.hits / lookups if lookups else 0.0,
+        )
+
+
+def get_cache_metrics() -> dict[str, CacheMetrics]:
+    """
+    Get metrics for every cache in this worker.
+
+    Returns
+    -------
+    dict[str, CacheMetrics]
+        Cache metrics by name
+    """
+    return {name: cache.get_metrics() for name, cache in CACHES.items()}
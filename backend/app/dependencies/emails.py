@@ -0,0 +1,48 @@
+"""Email templates, rendered once at import so sending only substitutes the code."""
+
+from markdown import markdown
+
+CODE_PLACEHOLDER = "{code}"
+
+BODY = """
+**{heading}**
+
+Head back to the website and enter the following code to continue:
+
+**{code}**
+
+If you did not request this code, please ignore this email.
+"""
+
+
+class EmailTemplate:
+    """Email with plain text and HTML skeletons, split around the code."""
+
+    def __init__(self, subject: str, body: str):
+        self.subject = subject
+        # Markdown leaves the placeholder as is, so both skeletons split on it
+        self.text = body.split(CODE_PLACEHOLDER)
+        self.html = markdown(body).split(CODE_PLACEHOLDER)
+
+    def render(self, code: str) -> tuple[str, str]:
+        """
+        Render the email for a code.
+
+        Parameters
+        ----------
+        code : str
+            Code, hex so it needs no escaping in HTML
+
+        Returns
+        -------
+        tuple[str, str]
+            Plain text and HTML bodies
+        """
+        return code.join(self.text), code.join(self.html)
+
+
+TEMPLATES = {
+    "welcome": EmailTemplate("Verify Email", BODY.replace("{heading}", "Welcome!")),
+    "recovery": EmailTemplate("Password Recovery", BODY.replace("{heading}", "You've requested a password reset.")),
+    "email-change": EmailTemplate("Verify Email", BODY.replace("{heading}", "You've requested to update your email.")),
+}
@@ -0,0 +1,91 @@
+"""Shared HTTP client for calls to OAuth providers and other external services."""
+
+import asyncio
+import random
+
+import httpx
+
+from app.config import get_settings
+
+SETTINGS = get_settings()
+
+HTTP_TIMEOUT = SETTINGS.http_timeout
+HTTP_MAX_CONNECTIONS = SETTINGS.http_max_connections
+HTTP_MAX_KEEPALIVE = SETTINGS.http_max_keepalive
+HTTP_RETRIES = SETTINGS.http_retries
+HTTP_RETRY_BACKOFF = SETTINGS.http_retry_backoff
+
+# Responses worth retrying, since the provider did not act on the request
+RETRY_STATUSES = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+# Errors raised before a request reached the provider, so retrying cannot repeat it
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+HTTP_CLIENT = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Get the shared HTTP client, creating it if needed.
+
+    Connections are kept alive and reused across requests. `HTTP_MAX_CONNECTIONS` caps concurrent calls, and
+    callers past the cap wait up to `HTTP_TIMEOUT` for a connection.
+
+    Returns
+    -------
+    httpx.AsyncClient
+        HTTP client
+    """
+    global HTTP_CLIENT
+    if HTTP_CLIENT is None:
+        HTTP_CLIENT = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_TIMEOUT),
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+        )
+    return HTTP_CLIENT
+
+
+async def close_http_client() -> None:
+    """Close the shared HTTP client and its connections."""
+    global HTTP_CLIENT
+    if HTTP_CLIENT is not None:
+        await HTTP_CLIENT.aclose()
+        HTTP_CLIENT = None
+
+
+async def http_request(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Send a request with the shared client, retrying transient failures with jittered exponential backoff.
+
+    Non-idempotent requests are only retried when they never reached the provider, or it rejected them unprocessed.
+
+    Parameters
+    ----------
+    method : str
+        HTTP method
+    url : str
+        URL
+    **kwargs
+        Arguments for `httpx.AsyncClient.request`
+
+    Returns
+    -------
+    httpx.Response
+        Response, which may have a retryable status if retries ran out
+
+    Raises
+    ------
+    httpx.HTTPError
+        If the request failed after every retry
+    """
+    retry_errors = httpx.TransportError if method.upper() in IDEMPOTENT_METHODS else UNSENT_ERRORS
+    for attempt in range(HTTP_RETRIES + 1):
+        try:
+            response = await get_http_client().request(method, url, **kwargs)
+            if response.status_code not in RETRY_STATUSES or attempt == HTTP_RETRIES:
+                return response
+        except retry_errors:
+            if attempt == HTTP_RETRIES:
+                raise
+        # Full jitter keeps workers that failed together from retrying together
+        await asyncio.sleep(random.uniform(0, HTTP_RETRY_BACKOFF * 2**attempt))
@@ -0,0 +1,87 @@
+"""Cached JSON Web Key Sets for verifying provider-signed tokens locally."""
+
+import asyncio
+import logging
+import re
+import time
+
+import httpx
+
+from app.dependencies.http import http_request
+
+LOGGER = logging.getLogger(__name__)
+
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+
+class JWKSCache:
+    """Signing keys by key id, fetched from a JWKS URL and refreshed in the background.
+
+    Keys are refreshed before the Cache-Control max-age the provider sends runs out. A token signed with an unknown
+    key id triggers an early refresh, at most once per `min_refresh_seconds`, to pick up rotated keys.
+    """
+
+    def __init__(self, url: str, refresh_seconds: float = 3600, min_refresh_seconds: float = 60):
+        self.url = url
+        self.refresh_seconds = refresh_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self.keys: dict[str, dict] = {}
+        self.expires = 0.0
+        self.refreshed = float("-inf")
+        self.lock = asyncio.Lock()
+
+    async def fetch(self) -> tuple[dict[str, dict], float]:
+        """
+        Fetch keys.
+
+        Returns
+        -------
+        tuple[dict[str, dict], float]
+            Keys by key id and seconds until they should be refreshed
+        """
+        response = await http_request("GET", self.url)
+        response.raise_for_status()
+        keys = {key["kid"]: key for key in response.json()["keys"]}
+        max_age = MAX_AGE_PATTERN.search(response.headers.get("Cache-Control", ""))
+        return keys, int(max_age.group(1)) if max_age else self.refresh_seconds
+
+    async def refresh(self) -> None:
+        """Refresh keys, unless another caller just did."""
+        async with self.lock:
+            if time.monotonic() - self.refreshed < self.min_refresh_seconds:
+                return
+            self.refreshed = time.monotonic()
+            self.keys, max_age = await self.fetch()
+            self.expires = self.refreshed + min(max_age, self.refresh_seconds)
+
+    async def get_key(self, kid: str) -> dict | None:
+        """
+        Get a signing key.
+
+        Parameters
+        ----------
+        kid : str
+            Key id
+
+        Returns
+        -------
+        dict | None
+            JWK if known, else None
+        """
+        if kid not in self.keys or time.monotonic() >= self.expires:
+            try:
+                await self.refresh()
+            except (httpx.HTTPError, KeyError, ValueError):
+                LOGGER.exception("Unable to refresh JWKS from %s", self.url)
+        return self.keys.get(kid)
+
+    async def run(self) -> None:
+        """Keep keys fresh until cancelled, so requests never wait on a fetch."""
+        while True:
+            try:
+                await self.refresh()
+                delay = max(self.expires - time.monotonic() - self.min_refresh_seconds, self.min_refresh_seconds)
+            except (httpx.HTTPError, KeyError, ValueError):
+                LOGGER.exception("Unable to refresh JWKS from %s", self.url)
+                delay = self.min_refresh_seconds
+            await asyncio.sleep(delay)
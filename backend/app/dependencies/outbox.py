@@ -0,0 +1,448 @@
+"""Transactional email outbox, and the worker that drains it over a pool of persistent SMTP connections.
+
+Requests only queue emails, in the same transaction as the codes they carry. Run the worker as its own process with
+`python -m app.dependencies.outbox`.
+"""
+
+import asyncio
+import logging
+import random
+import smtplib
+import threading
+import time
+from collections import deque
+from contextlib import suppress
+from datetime import datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formataddr
+
+from markdown import markdown
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.config import get_settings
+from app.database import engine as app_engine
+from app.dependencies.emails import TEMPLATES
+from app.models.users import EmailOutbox
+
+LOGGER = logging.getLogger(__name__)
+
+SETTINGS = get_settings()
+
+SMTP_SSL_HOST = SETTINGS.smtp_ssl_host
+SMTP_SSL_PORT = SETTINGS.smtp_ssl_port
+SMTP_SSL_SENDER = SETTINGS.smtp_ssl_sender
+SMTP_SSL_LOGIN = SETTINGS.smtp_ssl_login
+SMTP_SSL_PASSWORD = SETTINGS.smtp_ssl_password
+SMTP_STARTTLS = SETTINGS.smtp_starttls
+SMTP_TIMEOUT = SETTINGS.smtp_timeout
+SMTP_POOL_SIZE = SETTINGS.smtp_pool_size
+SMTP_POOL_IDLE_TIMEOUT = SETTINGS.smtp_pool_idle_timeout
+SMTP_POOL_CHECK_SECONDS = SETTINGS.smtp_pool_check_seconds
+
+OUTBOX_BATCH_SIZE = SETTINGS.outbox_batch_size
+OUTBOX_POLL_SECONDS = SETTINGS.outbox_poll_seconds
+OUTBOX_MAX_ATTEMPTS = SETTINGS.outbox_max_attempts
+OUTBOX_RETRY_BACKOFF = SETTINGS.outbox_retry_backoff
+OUTBOX_RETRY_MAX_BACKOFF = SETTINGS.outbox_retry_max_backoff
+OUTBOX_RETENTION = timedelta(hours=SETTINGS.outbox_retention_hours)
+OUTBOX_PRUNE_SECONDS = SETTINGS.outbox_prune_seconds
+
+# Refusals of a single message, after which the connection is still usable
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def queue_email(session: AsyncSession, email: str, template: str, code: str) -> EmailOutbox:
+    """
+    Queue an email for the outbox worker. Needs a commit.
+
+    Parameters
+    ----------
+    session : AsyncSession
+        Session
+    email : str
+        Recipient
+    template : str
+        Template name
+    code : str
+        Code to send
+
+    Returns
+    -------
+    EmailOutbox
+        Queued email
+    """
+    queued = EmailOutbox(recipient=email, subject=TEMPLATES[template].subject, template=template, code=code)
+    session.add(queued)
+    return queued
+
+
+def build_message(email: str, subject: str, text: str, html: str) -> MIMEMultipart:
+    """
+    Build an email with plain text and HTML parts.
+
+    Parameters
+    ----------
+    email : str
+        Recipient
+    subject : str
+        Subject
+    text : str
+        Plain text body
+    html : str
+        HTML body
+
+    Returns
+    -------
+    MIMEMultipart
+        Message
+    """
+    msg = MIMEMultipart("alternative")
+    msg["From"] = formataddr((SMTP_SSL_SENDER, SMTP_SSL_LOGIN))
+    msg["To"] = email
+    msg["Subject"] = subject
+    msg.attach(MIMEText(text, "plain"))
+    msg.attach(MIMEText(html, "html"))
+    return msg
+
+
+def render_message(email: EmailOutbox) -> MIMEMultipart:
+    """
+    Render a queued email from its template.
+
+    Parameters
+    ----------
+    email : EmailOutbox
+        Queued email
+
+    Returns
+    -------
+    MIMEMultipart
+        Message
+    """
+    if email.template is None:
+        # Queued before templates, with the whole body stored
+        return build_message(email.recipient, email.subject, email.body, markdown(email.body))
+    text, html = TEMPLATES[email.template].render(email.code)
+    return build_message(email.recipient, email.subject, text, html)
+
+
+class SMTPConnection:
+    """SMTP connection kept open between sends, reconnecting once if the relay dropped it."""
+
+    def __init__(
+        self,
+        host: str = SMTP_SSL_HOST,
+        port: int = SMTP_SSL_PORT,
+        login: str = SMTP_SSL_LOGIN,
+        password: str = SMTP_SSL_PASSWORD,
+        starttls: bool = SMTP_STARTTLS,
+        timeout: float = SMTP_TIMEOUT,
+    ):
+        self.host = host
+        self.port = port
+        self.login = login
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.smtp: smtplib.SMTP | None = None
+        self.connects = 0
+        self.last_used = 0.0
+
+    def connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            if self.starttls:
+                smtp.starttls()
+                smtp.ehlo()
+            if self.password:
+                smtp.login(self.login, self.password)
+        except BaseException:
+            smtp.close()
+            raise
+        self.connects += 1
+        return smtp
+
+    def send(self, msg: MIMEMultipart) -> None:
+        """
+        Send a message, connecting first if needed.
+
+        Parameters
+        ----------
+        msg : MIMEMultipart
+            Message
+        """
+        if self.smtp is None:
+            self.smtp = self.connect()
+        try:
+            self.smtp.send_message(msg, from_addr=self.login)
+        except smtplib.SMTPServerDisconnected:
+            # Relays close idle connections, so reconnect once before giving up
+            self.smtp = self.connect()
+            self.smtp.send_message(msg, from_addr=self.login)
+        finally:
+            self.last_used = time.monotonic()
+
+    def is_healthy(self) -> bool:
+        """
+        Check the connection is still open with a NOOP.
+
+        Returns
+        -------
+        bool
+            Whether the relay answered
+        """
+        if self.smtp is None:
+            return False
+        try:
+            return self.smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def close(self) -> None:
+        """Close the connection."""
+        if self.smtp is not None:
+            with suppress(smtplib.SMTPException, OSError):
+                self.smtp.quit()
+            self.smtp = None
+
+
+class SMTPPool:
+    """Pool of SMTP connections shared by the threads sending a batch.
+
+    Connections idle for longer than `idle_timeout` are closed before relays drop them, and ones idle for longer
+    than `check_seconds` are checked with a NOOP before reuse, so a send rarely hits a dead connection.
+    """
+
+    def __init__(
+        self,
+        size: int = SMTP_POOL_SIZE,
+        idle_timeout: float = SMTP_POOL_IDLE_TIMEOUT,
+        check_seconds: float = SMTP_POOL_CHECK_SECONDS,
+        **kwargs,
+    ):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.check_seconds = check_seconds
+        self.kwargs = kwargs
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.idle: deque[SMTPConnection] = deque()
+        self.connects = 0
+
+    def acquire(self) -> SMTPConnection:
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return SMTPConnection(**self.kwargs)
+                # Most recently used first, so spare connections age out when traffic drops
+                connection = self.idle.pop()
+            idle = time.monotonic() - connection.last_used
+            if idle < self.check_seconds or (idle < self.idle_timeout and connection.is_healthy()):
+                return connection
+            self.discard(connection)
+
+    def release(self, connection: SMTPConnection) -> None:
+        with self.lock:
+            self.idle.append(connection)
+
+    def discard(self, connection: SMTPConnection) -> None:
+        connection.close()
+        with self.lock:
+            self.connects += connection.connects
+
+    def send(self, msg: MIMEMultipart) -> None:
+        """
+        Send a message over a pooled connection, blocking while all are busy.
+
+        Parameters
+        ----------
+        msg : MIMEMultipart
+            Message
+        """
+        with self.slots:
+            connection = self.acquire()
+            try:
+                connection.send(msg)
+            except MESSAGE_ERRORS:
+                self.release(connection)
+                raise
+            except BaseException:
+                self.discard(connection)
+                raise
+            self.release(connection)
+
+    def get_connects(self) -> int:
+        """
+        Get the number of connections opened so far.
+
+        Returns
+        -------
+        int
+            Connections opened
+        """
+        with self.lock:
+            return self.connects + sum(connection.connects for connection in self.idle)
+
+    def close(self) -> None:
+        """Close idle connections."""
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return
+                connection = self.idle.pop()
+            self.discard(connection)
+
+
+def get_retry_delay(
+    attempts: int, backoff: float = OUTBOX_RETRY_BACKOFF, max_backoff: float = OUTBOX_RETRY_MAX_BACKOFF
+):
+    # Full jitter spreads retries out, so a relay coming back is not hit by every deferred email at once
+    return timedelta(seconds=random.uniform(0, min(backoff * 2 ** (attempts - 1), max_backoff)))  # noqa: S311
+
+
+class OutboxWorker:
+    """Worker that sends due emails from the outbox in batches, retrying failures with backoff.
+
+    Each batch is claimed with `FOR UPDATE SKIP LOCKED`, so several workers can drain the outbox without sending
+    an email twice, and its emails are sent concurrently over the pool. An email that still fails after
+    `max_attempts` is marked failed. Sent and failed emails lose their code as soon as they are marked, and are
+    deleted once older than `retention`.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        pool: SMTPPool,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+        poll_seconds: float = OUTBOX_POLL_SECONDS,
+        retention: timedelta = OUTBOX_RETENTION,
+        prune_seconds: float = OUTBOX_PRUNE_SECONDS,
+    ):
+        self.engine = engine
+        self.pool = pool
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.retention = retention
+        self.prune_seconds = prune_seconds
+
+    async def send(self, email: EmailOutbox) -> Exception | None:
+        """
+        Render and send one email.
+
+        Parameters
+        ----------
+        email : EmailOutbox
+            Queued email
+
+        Returns
+        -------
+        Exception | None
+            Why it was not sent, else None
+        """
+        try:
+            await asyncio.to_thread(self.pool.send, render_message(email))
+        except Exception as error:
+            if not isinstance(error, (smtplib.SMTPException, OSError)):
+                LOGGER.exception("Unable to send email %s", email.id)
+            return error
+        return None
+
+    async def send_batch(self) -> int:
+        """
+        Send one batch of due emails.
+
+        Returns
+        -------
+        int
+            Emails claimed
+        """
+        async with AsyncSession(self.engine, expire_on_commit=False) as session:
+            emails = (
+                await session.exec(
+                    select(EmailOutbox)
+                    .where(EmailOutbox.status == "pending")
+                    .where(EmailOutbox.next_attempt_date <= datetime.utcnow())
+                    .order_by(EmailOutbox.next_attempt_date)
+                    .limit(self.batch_size)
+                    .with_for_update(skip_locked=True)
+                )
+            ).all()
+
+            results = await asyncio.gather(*(self.send(email) for email in emails))
+            for email, error in zip(emails, results, strict=True):
+                if error is None:
+                    email.status = "sent"
+                    email.sent_date = datetime.utcnow()
+                else:
+                    # Anything failing one email, even a bad template, only counts against that email, so the rest
+                    # of the batch is still marked sent rather than rolled back and sent again
+                    email.attempts += 1
+                    email.last_error = repr(error)[:1000]
+                    if email.attempts >= self.max_attempts:
+                        email.status = "failed"
+                        LOGGER.error("Giving up on email %s after %s attempts: %r", email.id, email.attempts, error)
+                    else:
+                        email.next_attempt_date = datetime.utcnow() + get_retry_delay(email.attempts)
+                if email.status != "pending":
+                    # Codes are live credentials, so they are not kept once they cannot be sent again
+                    email.code = None
+                    email.body = None
+                session.add(email)
+            await session.commit()
+        return len(emails)
+
+    async def prune(self) -> int:
+        """
+        Delete sent and failed emails older than the retention.
+
+        Returns
+        -------
+        int
+            Emails deleted
+        """
+        async with AsyncSession(self.engine) as session:
+            result = await session.exec(
+                delete(EmailOutbox)
+                .where(EmailOutbox.status != "pending")
+                .where(EmailOutbox.created_date < datetime.utcnow() - self.retention)
+            )
+            await session.commit()
+        return result.rowcount
+
+    async def run(self) -> None:
+        """Send emails until cancelled, polling when the outbox is drained and pruning it periodically."""
+        pruned_at = 0.0
+        try:
+            while True:
+                if time.monotonic() - pruned_at >= self.prune_seconds:
+                    try:
+                        LOGGER.info("Pruned %s finished emails", await self.prune())
+                    except Exception:
+                        LOGGER.exception("Unable to prune outbox")
+                    pruned_at = time.monotonic()
+                try:
+                    claimed = await self.send_batch()
+                except Exception:
+                    LOGGER.exception("Unable to send outbox batch")
+                    claimed = 0
+                # A full batch means more are likely due, so only wait once the outbox is drained
+                if claimed < self.batch_size:
+                    await asyncio.sleep(self.poll_seconds)
+        finally:
+            self.pool.close()
+
+
+def main():
+    """Run the outbox worker."""
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(OutboxWorker(app_engine, SMTPPool()).run())
+
+
+if __name__ == "__main__":
+    main()
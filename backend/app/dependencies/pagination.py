@@ -0,0 +1,161 @@
+"""Keyset pagination with opaque cursors."""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Literal, Optional
+from uuid import UUID
+
+from fastapi import HTTPException, Query, Response
+
+from app.config import get_settings
+from app.models.users import Page
+
+SETTINGS = get_settings()
+
+PAGE_SIZE = SETTINGS.page_size
+MAX_PAGE_SIZE = SETTINGS.max_page_size
+SEARCH_PAGE_SIZE = SETTINGS.search_page_size
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+INVALID_CURSOR_EXCEPTION = HTTPException(status_code=400, detail="Cursor is invalid")
+
+
+def encode_cursor(sort: str, key: Any, uid: UUID) -> str:
+    """
+    Encode the position after a row as an opaque cursor.
+
+    Parameters
+    ----------
+    sort : str
+        Sort the cursor is valid for
+    key : Any
+        Sort key of the row, a datetime, a str, or a (rank, name) tuple for search
+    uid : UUID
+        Uid of the row, breaking ties in the sort key
+
+    Returns
+    -------
+    str
+        Cursor
+    """
+    key = key.isoformat() if isinstance(key, datetime) else key
+    data = json.dumps([sort, key, uid.hex], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> tuple[Any, UUID]:
+    """
+    Decode a cursor back into the position it points after.
+
+    Parameters
+    ----------
+    cursor : str
+        Cursor
+    sort : str
+        Sort of the requested page
+
+    Returns
+    -------
+    tuple[Any, UUID]
+        (sort key, uid)
+
+    Raises
+    ------
+    HTTPException
+        If the cursor is malformed or was issued for another sort
+    """
+    try:
+        cursor_sort, key, uid = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if cursor_sort != sort:
+            raise ValueError(cursor_sort)
+        if sort == "date":
+            return datetime.fromisoformat(key), UUID(uid)
+        if sort == "search":
+            rank, name = key
+            return (int(rank), str(name)), UUID(uid)
+        return str(key), UUID(uid)
+    except (ValueError, TypeError) as error:
+        raise INVALID_CURSOR_EXCEPTION from error
+
+
+def get_page(
+    limit: int = Query(default=PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    sort: Literal["date", "username"] = "date",
+    cursor: Optional[str] = None,
+) -> Page:
+    """
+    Get the requested page from the query string.
+
+    Parameters
+    ----------
+    limit : int
+        Rows per page
+    sort : Literal["date", "username"]
+        Sort
+    cursor : Optional[str]
+        Cursor from the previous page's X-Next-Cursor header
+
+    Returns
+    -------
+    Page
+        Page
+    """
+    return Page(limit=limit, sort=sort, after=decode_cursor(cursor, sort) if cursor else None)
+
+
+def get_search_page(
+    limit: int = Query(default=SEARCH_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+) -> Page:
+    """
+    Get the requested page of search results from the query string.
+
+    Parameters
+    ----------
+    limit : int
+        Results per page
+    cursor : Optional[str]
+        Cursor from the previous page's X-Next-Cursor header
+
+    Returns
+    -------
+    Page
+        Page
+    """
+    return Page(limit=limit, sort="search", after=decode_cursor(cursor, "search") if cursor else None)
+
+
+def paginate(response: Response, page: Page, rows: list, date_field: str = "") -> list:
+    """
+    Trim the extra row fetched past the page, and point X-Next-Cursor after the last row if there are more.
+
+    Parameters
+    ----------
+    response : Response
+        Response
+    page : Page
+        Page
+    rows : list
+        Up to limit + 1 rows
+    date_field : str
+        Field of the rows holding the date they are sorted by, if sorted by date
+
+    Returns
+    -------
+    list
+        Rows in the page
+    """
+    if len(rows) <= page.limit:
+        return rows
+    rows = rows[: page.limit]
+    last = rows[-1]
+    if page.sort == "date":
+        key = getattr(last, date_field)
+    elif page.sort == "search":
+        key = (last.rank, last.name)
+    else:
+        key = last.username
+    response.headers[NEXT_CURSOR_HEADER] = encode_cursor(page.sort, key, last.uid)
+    return rows
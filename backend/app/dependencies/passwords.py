@@ -0,0 +1,201 @@
+"""Password hashing in a bounded process pool, so bcrypt never blocks the event loop."""
+
+import argparse
+import statistics
+import time
+from typing import Any, Callable
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from app.config import get_settings
+from app.dependencies.processes import ProcessPool
+from app.models.metrics import PasswordMetrics
+
+SETTINGS = get_settings()
+
+PASSWORD_WORKERS = SETTINGS.password_workers
+PASSWORD_MAX_PENDING = SETTINGS.password_max_pending
+PASSWORD_BCRYPT_ROUNDS = SETTINGS.password_bcrypt_rounds
+# Below this, bcrypt is too cheap to slow down offline guessing, whatever the latency budget
+MIN_BCRYPT_ROUNDS = 10
+
+# Hashes with any other cost need an update, so changing the rounds re-tunes every account as it logs in
+PWD_CONTEXT = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=PASSWORD_BCRYPT_ROUNDS,
+    bcrypt__min_rounds=PASSWORD_BCRYPT_ROUNDS,
+    bcrypt__max_rounds=PASSWORD_BCRYPT_ROUNDS,
+)
+
+PASSWORD_POOL = ProcessPool(PASSWORD_WORKERS, "Password hashing is unavailable")
+
+
+class PasswordStats:
+    """Counters for password pool load and latency in this worker."""
+
+    pending: int = 0
+    hashes: int = 0
+    rejected: int = 0
+    hash_seconds: float = 0.0
+    max_hash_seconds: float = 0.0
+    wait_seconds: float = 0.0
+
+
+def shutdown_password_pool() -> None:
+    """Shut down the password process pool."""
+    PASSWORD_POOL.shutdown()
+
+
+def timed(function: Callable, *args) -> tuple[Any, float]:
+    # Runs in the password process pool, timing only the hash and not the time spent queued
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def hash_password(password: str) -> str:
+    return PWD_CONTEXT.hash(password)
+
+
+def check_password(plain_password: str, hashed_password: str) -> bool:
+    return PWD_CONTEXT.verify(plain_password, hashed_password)
+
+
+def check_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    return PWD_CONTEXT.verify_and_update(plain_password, hashed_password)
+
+
+async def run_in_password_pool(function: Callable, *args) -> Any:
+    """
+    Run a password function in the password process pool.
+
+    Parameters
+    ----------
+    function : Callable
+        Module-level function, so it can be pickled
+    *args
+        Arguments
+
+    Returns
+    -------
+    Any
+        Result
+
+    Raises
+    ------
+    HTTPException
+        If too many passwords are already pending, or the pool is unavailable
+    """
+    # Rejecting at once keeps a login burst from queueing requests until they time out anyway
+    if PasswordStats.pending >= PASSWORD_MAX_PENDING:
+        PasswordStats.rejected += 1
+        raise HTTPException(
+            status_code=503, detail="Too many requests, try again shortly", headers={"Retry-After": "1"}
+        )
+
+    PasswordStats.pending += 1
+    start = time.perf_counter()
+    try:
+        result, elapsed = await PASSWORD_POOL.run(timed, function, *args)
+    finally:
+        PasswordStats.pending -= 1
+
+    PasswordStats.hashes += 1
+    PasswordStats.hash_seconds += elapsed
+    PasswordStats.max_hash_seconds = max(PasswordStats.max_hash_seconds, elapsed)
+    PasswordStats.wait_seconds += time.perf_counter() - start - elapsed
+    return result
+
+
+def get_password_metrics() -> PasswordMetrics:
+    """
+    Get password pool metrics.
+
+    Returns
+    -------
+    PasswordMetrics
+        Password pool metrics
+    """
+    hashes = PasswordStats.hashes
+    return PasswordMetrics(
+        workers=PASSWORD_WORKERS,
+        max_pending=PASSWORD_MAX_PENDING,
+        pending=PasswordStats.pending,
+        queued=max(PasswordStats.pending - PASSWORD_WORKERS, 0),
+        hashes=hashes,
+        rejected=PasswordStats.rejected,
+        avg_hash_ms=PasswordStats.hash_seconds / hashes * 1000 if hashes else 0.0,
+        max_hash_ms=PasswordStats.max_hash_seconds * 1000,
+        avg_wait_ms=PasswordStats.wait_seconds / hashes * 1000 if hashes else 0.0,
+    )
+
+
+def time_bcrypt(rounds: int, samples: int) -> float:
+    """
+    Time hashing with bcrypt at a cost.
+
+    Parameters
+    ----------
+    rounds : int
+        Log2 of bcrypt iterations
+    samples : int
+        Hashes to take the median of
+
+    Returns
+    -------
+    float
+        Median seconds per hash
+    """
+    context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        context.hash("calibration password")
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def calibrate_bcrypt_rounds(target_seconds: float, samples: int = 5) -> tuple[int, float]:
+    """
+    Find the highest bcrypt cost that hashes within a target time on this host.
+
+    Parameters
+    ----------
+    target_seconds : float
+        Latency budget per hash
+    samples : int
+        Hashes to time at each cost
+
+    Returns
+    -------
+    tuple[int, float]
+        Rounds and measured seconds per hash at those rounds
+    """
+    # Each round doubles the work, so estimate from the floor and then confirm by measuring
+    floor = time_bcrypt(MIN_BCRYPT_ROUNDS, samples)
+    rounds = MIN_BCRYPT_ROUNDS
+    while rounds < 31 and floor * 2 ** (rounds + 1 - MIN_BCRYPT_ROUNDS) <= target_seconds:
+        rounds += 1
+    seconds = time_bcrypt(rounds, samples)
+    while rounds > MIN_BCRYPT_ROUNDS and seconds > target_seconds:
+        rounds -= 1
+        seconds = time_bcrypt(rounds, samples)
+    return rounds, seconds
+
+
+def main():
+    """Print the bcrypt cost to set as PASSWORD_BCRYPT_ROUNDS for a latency budget."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--target-ms", type=float, default=250)
+    parser.add_argument("--samples", type=int, default=5)
+    args = parser.parse_args()
+
+    rounds, seconds = calibrate_bcrypt_rounds(args.target_ms / 1000, args.samples)
+    print(f"# {seconds * 1000:.0f} ms per hash on this host, currently {PASSWORD_BCRYPT_ROUNDS} rounds")
+    print(f"PASSWORD_BCRYPT_ROUNDS={rounds}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""Dependencies for profile picture storage."""
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import tempfile
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from pathlib import Path
+
+from fastapi import HTTPException
+from PIL import Image, ImageOps
+from starlette.concurrency import run_in_threadpool
+
+from app.config import get_settings
+from app.dependencies.processes import ProcessPool
+
+SETTINGS = get_settings()
+
+API_URL = SETTINGS.api_url.rstrip("/")
+PICTURE_STORAGE = SETTINGS.picture_storage
+PICTURE_STORAGE_PATH = SETTINGS.picture_storage_path
+PICTURE_MAX_BYTES = SETTINGS.picture_max_bytes
+PICTURE_MAX_PIXELS = SETTINGS.picture_max_pixels
+PICTURE_SIZES = sorted(SETTINGS.picture_sizes)
+PICTURE_DEFAULT_SIZE = SETTINGS.picture_default_size
+PICTURE_WORKERS = SETTINGS.picture_workers
+PICTURE_MAX_PENDING = SETTINGS.picture_max_pending
+PICTURE_MAX_WAITING = SETTINGS.picture_max_waiting
+if PICTURE_DEFAULT_SIZE not in PICTURE_SIZES:
+    # Every URL handed out is at the default size, so it would never be stored
+    raise RuntimeError(f"PICTURE_DEFAULT_SIZE {PICTURE_DEFAULT_SIZE} is not one of PICTURE_SIZES {PICTURE_SIZES}")
+
+Image.init()
+# Encoders such as AVIF depend on how Pillow was built, so skip any that are unavailable
+PICTURE_FORMATS = [fmt for fmt in SETTINGS.picture_formats if fmt.upper() in Image.SAVE]
+if not PICTURE_FORMATS:
+    # Every URL handed out is in the first format, so there is nothing to serve without one
+    raise RuntimeError(f"None of PICTURE_FORMATS {SETTINGS.picture_formats} can be encoded by this Pillow build")
+
+PICTURE_MEDIA_TYPES = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
+PICTURE_KEY_PATTERN = re.compile(r"^(?P<digest>[0-9a-f]{64})(_(?P<size>\d+))?\.(?P<extension>png|jpg|webp|avif)$")
+PICTURE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+PICTURE_POOL = ProcessPool(PICTURE_WORKERS, "Picture processing is unavailable")
+PICTURE_SEMAPHORE = asyncio.Semaphore(PICTURE_MAX_PENDING)
+PICTURE_TASKS: dict[str, asyncio.Task] = {}
+
+
+class PictureStats:
+    """Counters for picture processing load in this worker."""
+
+    # Processing, up to PICTURE_MAX_PENDING, or waiting for PICTURE_SEMAPHORE
+    pending: int = 0
+
+
+class PictureStorage(ABC):
+    """Content-addressed blob store for pictures."""
+
+    @abstractmethod
+    def save(self, key: str, data: bytes) -> None:
+        """Save data under key, doing nothing if it already exists."""
+
+    @abstractmethod
+    def load(self, key: str) -> bytes | None:
+        """Load data stored under key, or None if missing."""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Check whether data is stored under key."""
+
+
+class LocalPictureStorage(PictureStorage):
+    """Picture storage on the local filesystem, sharded by the first two hash characters."""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def save(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so readers never see a partial picture
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def load(self, key: str) -> bytes | None:
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+
+
+PICTURE_STORAGES: dict[str, type[PictureStorage]] = {"local": LocalPictureStorage}
+
+
+@lru_cache
+def get_picture_storage() -> PictureStorage:
+    """
+    Get the configured picture storage backend.
+
+    Returns
+    -------
+    PictureStorage
+        Picture storage
+    """
+    return PICTURE_STORAGES[PICTURE_STORAGE](PICTURE_STORAGE_PATH)
+
+
+def get_picture_extension(data: bytes) -> str | None:
+    """
+    Get picture extension from its magic bytes.
+
+    Parameters
+    ----------
+    data : bytes
+        Picture data
+
+    Returns
+    -------
+    str | None
+        Extension if picture type is supported, else None
+    """
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def get_picture_key(digest: str, size: int, extension: str) -> str:
+    """
+    Get the storage key of a processed picture.
+
+    Parameters
+    ----------
+    digest : str
+        SHA-256 of the uploaded picture
+    size : int
+        Side length in pixels
+    extension : str
+        Extension
+
+    Returns
+    -------
+    str
+        Picture key
+    """
+    return f"{digest}_{size}.{extension}"
+
+
+def get_picture_url(key: str) -> str:
+    """
+    Get the URL a stored picture is served from.
+
+    Parameters
+    ----------
+    key : str
+        Picture key
+
+    Returns
+    -------
+    str
+        Picture URL
+    """
+    return f"{API_URL}/pictures/{key}"
+
+
+def shutdown_picture_pool() -> None:
+    """Shut down the picture process pool."""
+    PICTURE_POOL.shutdown()
+
+
+def process_picture(data: bytes, sizes: list[int], formats: list[str], max_pixels: int) -> dict[tuple[int, str], bytes]:
+    """
+    Center-crop a picture and encode it at every size and format.
+
+    Runs in the picture process pool, so it must stay importable and picklable.
+
+    Parameters
+    ----------
+    data : bytes
+        Picture data
+    sizes : list[int]
+        Side lengths in pixels
+    formats : list[str]
+        Output formats
+    max_pixels : int
+        Largest accepted source resolution
+
+    Returns
+    -------
+    dict[tuple[int, str], bytes]
+        Encoded pictures keyed by (size, format)
+
+    Raises
+    ------
+    ValueError
+        If picture is too large or of an unsupported type
+    """
+    with Image.open(io.BytesIO(data), formats=["PNG", "JPEG", "WEBP"]) as image:
+        if image.width * image.height > max_pixels:
+            raise ValueError("Picture resolution is too large")
+        # Let JPEG decode at a reduced scale when the source is much larger than needed
+        image.draft("RGB", (max(sizes), max(sizes)))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+
+    side = min(image.size)
+    left = (image.width - side) // 2
+    top = (image.height - side) // 2
+    image = image.crop((left, top, left + side, top + side))
+
+    pictures = {}
+    for size in sorted(sizes, reverse=True):
+        # Resize from the previous, larger size so each step stays cheap
+        image = image.resize((size, size), Image.LANCZOS, reducing_gap=3.0)
+        for fmt in formats:
+            buffer = io.BytesIO()
+            image.save(buffer, format=fmt.upper(), quality=80)
+            pictures[(size, fmt)] = buffer.getvalue()
+    return pictures
+
+
+async def process_and_save_picture(digest: str, data: bytes) -> None:
+    """
+    Process a picture in the process pool and save every size and format.
+
+    Parameters
+    ----------
+    digest : str
+        SHA-256 of the picture
+    data : bytes
+        Picture data
+
+    Raises
+    ------
+    HTTPException
+        If picture is invalid, too many pictures are already waiting, or the process pool is unavailable
+    """
+    # Rejecting at once keeps an upload burst from queueing requests until they time out anyway
+    if PictureStats.pending >= PICTURE_MAX_PENDING + PICTURE_MAX_WAITING:
+        raise HTTPException(
+            status_code=503, detail="Too many requests, try again shortly", headers={"Retry-After": "1"}
+        )
+
+    PictureStats.pending += 1
+    try:
+        async with PICTURE_SEMAPHORE:
+            try:
+                pictures = await PICTURE_POOL.run(
+                    process_picture, data, PICTURE_SIZES, PICTURE_FORMATS, PICTURE_MAX_PIXELS
+                )
+            except (ValueError, OSError, Image.DecompressionBombError):
+                raise HTTPException(status_code=400, detail="Picture is invalid") from None
+    finally:
+        PictureStats.pending -= 1
+
+    storage = get_picture_storage()
+    default = (PICTURE_DEFAULT_SIZE, PICTURE_FORMATS[0])
+    # Save the default picture last, since its presence marks the whole set as processed
+    for size, fmt in sorted(pictures, key=lambda picture: picture == default):
+        await run_in_threadpool(storage.save, get_picture_key(digest, size, fmt), pictures[(size, fmt)])
+
+
+async def store_picture(data: bytes) -> str:
+    """
+    Validate, process and store a picture, reusing earlier results for identical uploads.
+
+    Parameters
+    ----------
+    data : bytes
+        Picture data
+
+    Returns
+    -------
+    str
+        URL of the picture at the default size and format
+
+    Raises
+    ------
+    HTTPException
+        If picture is too large or of an unsupported type
+    """
+    if len(data) > PICTURE_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Picture is too large")
+    if not get_picture_extension(data):
+        raise HTTPException(status_code=400, detail="Picture must be png, jpg, or webp")
+
+    digest = hashlib.sha256(data).hexdigest()
+    key = get_picture_key(digest, PICTURE_DEFAULT_SIZE, PICTURE_FORMATS[0])
+    if not await run_in_threadpool(get_picture_storage().exists, key):
+        # Concurrent uploads of the same picture share one processing task
+        task = PICTURE_TASKS.get(digest)
+        if task is None:
+            task = asyncio.ensure_future(process_and_save_picture(digest, data))
+            PICTURE_TASKS[digest] = task
+            task.add_done_callback(lambda _: PICTURE_TASKS.pop(digest, None))
+        await asyncio.shield(task)
+    return get_picture_url(key)
+
+
+async def store_profile_picture(profile_picture: str | None) -> str | None:
+    """
+    Move an inline data URL picture to storage.
+
+    Parameters
+    ----------
+    profile_picture : str | None
+        Profile picture as a data URL or URL
+
+    Returns
+    -------
+    str | None
+        Picture URL, unchanged if it was not a data URL
+
+    Raises
+    ------
+    HTTPException
+        If data URL is invalid
+    """
+    if not profile_picture or not profile_picture.startswith("data:"):
+        return profile_picture
+    try:
+        data = base64.b64decode(profile_picture.split(",", 1)[1], validate=True)
+    except (IndexError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Picture is invalid") from None
+    return await store_picture(data)
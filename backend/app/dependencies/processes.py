@@ -0,0 +1,68 @@
+"""Process pools for CPU-bound work, so it never blocks the event loop."""
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+from fastapi import HTTPException
+
+
+class ProcessPool:
+    """Process pool started on first use, and replaced by the next run if one of its processes died."""
+
+    def __init__(self, workers: int, unavailable: str):
+        self.workers = workers
+        self.unavailable = unavailable
+        self.executor: ProcessPoolExecutor | None = None
+
+    def get(self) -> ProcessPoolExecutor:
+        """
+        Get the executor, starting it if needed.
+
+        Returns
+        -------
+        ProcessPoolExecutor
+            Executor
+        """
+        if self.executor is None:
+            # Forking a process that is running an event loop and thread pool is unsafe
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self.executor
+
+    def shutdown(self) -> None:
+        """Shut down the executor, cancelling queued work."""
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    async def run(self, function: Callable, *args) -> Any:
+        """
+        Run a function in the pool.
+
+        Parameters
+        ----------
+        function : Callable
+            Module-level function, so it can be pickled
+        *args
+            Arguments
+
+        Returns
+        -------
+        Any
+            Result
+
+        Raises
+        ------
+        HTTPException
+            If the pool broke, which also shuts it down so the next run starts a new one
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.get(), function, *args)
+        except BrokenProcessPool:
+            self.shutdown()
+            raise HTTPException(status_code=503, detail=self.unavailable) from None
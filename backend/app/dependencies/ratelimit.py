@@ -0,0 +1,351 @@
+"""Token bucket rate limiting for routes that hash passwords or send email."""
+
+import hashlib
+import ipaddress
+import json
+import logging
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable
+
+from fastapi import HTTPException, Request
+from starlette.requests import HTTPConnection
+
+from app.config import get_settings
+from app.models.metrics import RateLimitMetrics
+
+LOGGER = logging.getLogger(__name__)
+
+SETTINGS = get_settings()
+
+RATE_LIMIT_BACKEND = SETTINGS.rate_limit_backend
+RATE_LIMIT_REDIS_URL = SETTINGS.rate_limit_redis_url
+RATE_LIMITS = SETTINGS.rate_limits
+TRUSTED_PROXIES = [ipaddress.ip_network(proxy, strict=False) for proxy in SETTINGS.trusted_proxies]
+# Buckets kept by the in-process backend; an evicted bucket only comes back full
+MEMORY_BUCKETS = 100_000
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+# Bucket = (capacity, tokens per second)
+Bucket = tuple[float, float]
+
+# Takes from every bucket or from none, so a request rejected by one budget does not spend the others
+TAKE_SCRIPT = """
+local now = redis.call("TIME")
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local retry_after = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    local rate = tonumber(ARGV[i * 2])
+    local bucket = redis.call("HMGET", key, "tokens", "updated")
+    local available = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    available = math.min(capacity, available + math.max(now - updated, 0) * rate)
+    tokens[i] = available
+    if available < 1 then
+        retry_after = math.max(retry_after, (1 - available) / rate)
+    end
+end
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    local rate = tonumber(ARGV[i * 2])
+    local available = tokens[i]
+    if retry_after == 0 then
+        available = available - 1
+    end
+    redis.call("HSET", key, "tokens", tostring(available), "updated", tostring(now))
+    redis.call("PEXPIRE", key, math.ceil((capacity - available) / rate * 1000) + 1000)
+end
+return tostring(retry_after)
+"""
+
+
+def parse_rate(rate: str) -> Bucket:
+    """
+    Parse a budget like "10/minute".
+
+    Parameters
+    ----------
+    rate : str
+        Requests per second, minute, hour or day
+
+    Returns
+    -------
+    Bucket
+        Capacity and tokens per second
+
+    Raises
+    ------
+    ValueError
+        If the budget is malformed or allows no requests
+    """
+    requests, period = rate.split("/")
+    requests = float(requests)
+    # A bucket that never refills would divide by zero when computing Retry-After
+    if not requests > 0 or period.strip() not in PERIODS:
+        raise ValueError(f"Rate limit {rate!r} must allow a positive number of requests per {', '.join(PERIODS)}")
+    return requests, requests / PERIODS[period.strip()]
+
+
+class RateLimitBackend(ABC):
+    """Token bucket store."""
+
+    @abstractmethod
+    async def take(self, buckets: dict[str, Bucket]) -> float:
+        """
+        Take a token from every bucket, or from none if any is empty.
+
+        Parameters
+        ----------
+        buckets : dict[str, Bucket]
+            Capacity and tokens per second by key
+
+        Returns
+        -------
+        float
+            0 if taken, else seconds until every bucket has a token
+        """
+
+    @abstractmethod
+    async def close(self) -> None:
+        """Release buckets and connections."""
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """Token buckets in this worker, so each worker allows the full budget."""
+
+    def __init__(self, maxsize: int = MEMORY_BUCKETS, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self.buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def take(self, buckets: dict[str, Bucket]) -> float:
+        now = self.clock()
+        tokens = {}
+        for key, (capacity, rate) in buckets.items():
+            available, updated = self.buckets.get(key, (capacity, now))
+            tokens[key] = min(capacity, available + (now - updated) * rate)
+        retry_after = max(
+            ((1 - tokens[key]) / rate for key, (_, rate) in buckets.items() if tokens[key] < 1), default=0
+        )
+
+        for key, available in tokens.items():
+            self.buckets[key] = (available - 1 if retry_after == 0 else available, now)
+            self.buckets.move_to_end(key)
+        while len(self.buckets) > self.maxsize:
+            self.buckets.popitem(last=False)
+        return retry_after
+
+    async def close(self) -> None:
+        self.buckets.clear()
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """Token buckets in Redis, or anything speaking its protocol and Lua scripting, shared by every worker."""
+
+    def __init__(self, client):
+        self.client = client
+        self.script = client.register_script(TAKE_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisRateLimitBackend":
+        import redis.asyncio  # Only needed with the redis backend
+
+        return cls(redis.asyncio.from_url(url))
+
+    async def take(self, buckets: dict[str, Bucket]) -> float:
+        args = [value for bucket in buckets.values() for value in bucket]
+        return float(await self.script(keys=list(buckets), args=args))
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+RATE_LIMIT_BACKENDS: dict[str, Callable[[], RateLimitBackend]] = {
+    "memory": MemoryRateLimitBackend,
+    "redis": lambda: RedisRateLimitBackend.from_url(RATE_LIMIT_REDIS_URL),
+}
+
+BACKEND: RateLimitBackend | None = None
+
+
+def get_rate_limit_backend() -> RateLimitBackend:
+    """
+    Get the configured rate limit backend, creating it if needed.
+
+    Returns
+    -------
+    RateLimitBackend
+        Rate limit backend
+    """
+    global BACKEND
+    if BACKEND is None:
+        BACKEND = RATE_LIMIT_BACKENDS[RATE_LIMIT_BACKEND]()
+    return BACKEND
+
+
+async def close_rate_limit_backend() -> None:
+    """Close the rate limit backend."""
+    global BACKEND
+    if BACKEND is not None:
+        await BACKEND.close()
+        BACKEND = None
+
+
+def is_trusted_proxy(address: str) -> bool:
+    try:
+        return any(ipaddress.ip_address(address) in network for network in TRUSTED_PROXIES)
+    except ValueError:
+        return False
+
+
+def get_client_ip(request: HTTPConnection) -> str | None:
+    """
+    Get the address of the client behind any trusted proxies.
+
+    Each proxy appends the address it was called from to X-Forwarded-For, so the header is read from the right and the
+    first address not of a trusted proxy is the client. Addresses further left are whatever the client sent, and
+    headers from untrusted peers are ignored, since anyone can send them. List in TRUSTED_PROXIES only proxies that
+    append to the header, such as the frontend's server, which passes on the address its own proxy appended.
+
+    Parameters
+    ----------
+    request : HTTPConnection
+        Request
+
+    Returns
+    -------
+    str | None
+        Client address
+    """
+    host = request.client.host if request.client else None
+    if not host or not is_trusted_proxy(host):
+        return host
+    forwarded = [
+        address.strip()
+        for header in request.headers.getlist("X-Forwarded-For")
+        for address in header.split(",")
+        if address.strip()
+    ]
+    for address in reversed(forwarded):
+        if not is_trusted_proxy(address):
+            return address
+    return forwarded[0] if forwarded else host
+
+
+def get_account(body) -> str | None:
+    """
+    Get the account a request body targets, the way the routes resolve it: by email if given, else by username.
+
+    Parameters
+    ----------
+    body
+        JSON body
+
+    Returns
+    -------
+    str | None
+        Normalized email or username, prefixed by which it is
+    """
+    if not isinstance(body, dict):
+        return None
+    for field in ("email", "username"):
+        value = body.get(field)
+        if isinstance(value, str) and value.strip():
+            return f"{field}:{value.strip().lower()}"
+    return None
+
+
+# Every rate limit by route, for metrics
+RATE_LIMITERS = {}
+
+
+class RateLimit:
+    """Dependency that limits a route with token buckets per client IP, account and API key.
+
+    The client IP is taken from X-Forwarded-For when the request comes through a trusted proxy, such as the frontend's
+    server, which must itself sit behind a proxy that appends the client's address. The account is the email or
+    username read from the JSON body, so guessing codes or passwords for one account is slowed down however many
+    addresses it comes from. The API key budget is only a coarse cap on the route as a whole, since every user of the
+    frontend shares its key. If the backend is unavailable, requests are allowed rather than locking everyone out.
+    """
+
+    def __init__(self, route: str):
+        self.route = route
+        self.budgets = {scope: parse_rate(rate) for scope, rate in RATE_LIMITS[route].items()}
+        self.allowed = 0
+        self.rejected = 0
+        self.errors = 0
+        RATE_LIMITERS[route] = self
+
+    async def get_keys(self, request: Request) -> dict[str, str]:
+        values = {"ip": get_client_ip(request), "api_key": request.headers.get("X-API-Key")}
+        try:
+            body = await request.json()  # Cached on the request, so the route does not parse it twice
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            body = None
+        values["account"] = get_account(body)
+        # Keys are hashed, so a shared backend never holds emails, usernames or API keys
+        return {
+            scope: f"ratelimit:{self.route}:{scope}:{hashlib.sha256(value.encode()).hexdigest()[:32]}"
+            for scope, value in values.items()
+            if value and scope in self.budgets
+        }
+
+    async def __call__(self, request: Request) -> None:
+        """
+        Take a token for the request, or reject it.
+
+        Parameters
+        ----------
+        request : Request
+            Request
+
+        Raises
+        ------
+        HTTPException
+            If any budget is spent, with Retry-After set to when it refills
+        """
+        keys = await self.get_keys(request)
+        try:
+            retry_after = await get_rate_limit_backend().take({key: self.budgets[scope] for scope, key in keys.items()})
+        except Exception:
+            LOGGER.exception("Unable to rate limit %s", self.route)
+            self.errors += 1
+            return
+
+        if retry_after > 0:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests, try again later",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+        self.allowed += 1
+
+    def get_metrics(self) -> RateLimitMetrics:
+        """
+        Get rate limit metrics.
+
+        Returns
+        -------
+        RateLimitMetrics
+            Rate limit metrics
+        """
+        return RateLimitMetrics(allowed=self.allowed, rejected=self.rejected, errors=self.errors)
+
+
+def get_rate_limit_metrics() -> dict[str, RateLimitMetrics]:
+    """
+    Get metrics for every rate limited route in this worker.
+
+    Returns
+    -------
+    dict[str, RateLimitMetrics]
+        Rate limit metrics by route
+    """
+    return {route: limiter.get_metrics() for route, limiter in RATE_LIMITERS.items()}
@@ -0,0 +1,208 @@
+"""Revoked token ids, checked through an in-memory bloom filter before the revoked token table."""
+
+import asyncio
+import hashlib
+import math
+import time
+from datetime import datetime, timedelta
+from typing import Callable
+
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.config import get_settings
+from app.models.metrics import RevocationMetrics
+from app.models.users import RevokedToken
+
+SETTINGS = get_settings()
+
+# Revocations can commit out of id and timestamp order, and worker clocks drift, so each refresh reads back this far
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+
+class BloomFilter:
+    """Bloom filter of strings, sized for a capacity and false positive rate."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, value: str) -> list[int]:
+        # Derive every position from one digest by double hashing
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, value: str):
+        """
+        Add a value, counting it only if it was not already present.
+
+        Parameters
+        ----------
+        value : str
+            Value
+        """
+        new = False
+        for position in self.positions(value):
+            if not self.bits[position >> 3] & 1 << (position & 7):
+                self.bits[position >> 3] |= 1 << (position & 7)
+                new = True
+        self.count += new
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[position >> 3] & 1 << (position & 7) for position in self.positions(value))
+
+
+class RevocationList:
+    """Revoked token ids, with a per-worker bloom filter in front of the revoked token table.
+
+    Most tokens are not revoked, and the filter says so without any I/O. Only possible positives, about `error_rate`
+    of unrevoked tokens, are looked up in the table. Every `refresh_seconds` the filter adds revocations made since
+    the last refresh, so a token revoked by another worker is rejected here within that time. Once it holds
+    `capacity` entries, the filter is rebuilt from the revocations that have not expired.
+    """
+
+    def __init__(
+        self, capacity: int, error_rate: float, refresh_seconds: float, clock: Callable[[], float] = time.monotonic
+    ):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_seconds = refresh_seconds
+        self.clock = clock
+        self.lock = asyncio.Lock()
+        self.clear()
+
+    def clear(self):
+        """Empty the filter and reset counters, so the next check rebuilds it."""
+        self.filter = BloomFilter(self.capacity, self.error_rate)
+        self.since: datetime | None = None
+        self.refreshed = float("-inf")
+        self.checks = self.possible_positives = self.false_positives = self.refreshes = 0
+
+    async def refresh(self, session: AsyncSession):
+        """
+        Add new revocations to the filter, or rebuild it if it is full or was never built.
+
+        Parameters
+        ----------
+        session : AsyncSession
+            Session
+        """
+        # Once a filter is built, requests arriving during a refresh check against it rather than wait, but until then
+        # the filter is empty, so they wait for the first build
+        if self.lock.locked() and self.since is not None:
+            return
+        async with self.lock:
+            if self.since is not None and self.clock() - self.refreshed < self.refresh_seconds:
+                # Built while waiting
+                return
+            now = datetime.utcnow()
+            rebuild = self.since is None or self.filter.count >= self.capacity
+            if rebuild:
+                statement = select(RevokedToken.jti).where(RevokedToken.expire_date > now)
+            else:
+                statement = select(RevokedToken.jti).where(RevokedToken.revoked_date >= self.since - REFRESH_OVERLAP)
+            jtis = (await session.exec(statement)).all()
+
+            bloom_filter = BloomFilter(self.capacity, self.error_rate) if rebuild else self.filter
+            for jti in jtis:
+                bloom_filter.add(jti)
+            self.filter = bloom_filter
+            self.since = now
+            self.refreshed = self.clock()
+            self.refreshes += 1
+
+    async def is_revoked(self, session: AsyncSession, jti: str) -> bool:
+        """
+        Check if a token id was revoked.
+
+        Parameters
+        ----------
+        session : AsyncSession
+            Session
+        jti : str
+            Token id
+
+        Returns
+        -------
+        bool
+            Whether the token was revoked
+        """
+        if self.clock() - self.refreshed >= self.refresh_seconds:
+            await self.refresh(session)
+        self.checks += 1
+        if jti not in self.filter:
+            return False
+
+        self.possible_positives += 1
+        revoked = (await session.exec(select(RevokedToken.id).where(RevokedToken.jti == jti))).first() is not None
+        self.false_positives += not revoked
+        return revoked
+
+    async def revoke(self, session: AsyncSession, jti: str, expire_date: datetime):
+        """
+        Revoke a token id until the token expires, doing nothing if it already is. Needs a commit.
+
+        Parameters
+        ----------
+        session : AsyncSession
+            Session
+        jti : str
+            Token id
+        expire_date : datetime
+            When the token expires
+        """
+        if await self.is_revoked(session, jti):
+            return
+        # Expired revocations can never match a valid token again
+        await session.exec(delete(RevokedToken).where(RevokedToken.expire_date <= datetime.utcnow()))
+        try:
+            # A savepoint, so a concurrent revocation of the same token that committed first leaves the rest of the
+            # transaction intact
+            async with session.begin_nested():
+                session.add(RevokedToken(jti=jti, expire_date=expire_date))
+        except IntegrityError:
+            pass
+        self.filter.add(jti)
+
+    def get_metrics(self) -> RevocationMetrics:
+        """
+        Get revocation list metrics.
+
+        Returns
+        -------
+        RevocationMetrics
+            Revocation list metrics
+        """
+        unrevoked = self.checks - self.possible_positives + self.false_positives
+        return RevocationMetrics(
+            size=self.filter.count,
+            capacity=self.capacity,
+            filter_bytes=len(self.filter.bits),
+            checks=self.checks,
+            possible_positives=self.possible_positives,
+            false_positives=self.false_positives,
+            false_positive_rate=self.false_positives / unrevoked if unrevoked else 0.0,
+            refreshes=self.refreshes,
+        )
+
+
+REVOCATIONS = RevocationList(
+    SETTINGS.revocation_capacity, SETTINGS.revocation_error_rate, SETTINGS.revocation_refresh_seconds
+)
+
+
+def get_revocation_metrics() -> RevocationMetrics:
+    """
+    Get revocation list metrics for this worker.
+
+    Returns
+    -------
+    RevocationMetrics
+        Revocation list metrics
+    """
+    return REVOCATIONS.get_metrics()
@@ -0,0 +1,398 @@
+"""Typeahead search for users by username and full name."""
+
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+from contextlib import suppress
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional
+from uuid import UUID
+
+from sqlalchemy import Row, Select, event, inspect, tuple_
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session, object_session
+from sqlmodel import and_, func, literal, or_, select, union_all
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.config import get_settings
+from app.models.users import Page, User
+
+LOGGER = logging.getLogger(__name__)
+
+SETTINGS = get_settings()
+
+USER_SEARCH_BACKEND = SETTINGS.user_search_backend
+SEARCH_FUZZY_MIN_LENGTH = SETTINGS.search_fuzzy_min_length
+SEARCH_MAX_LENGTH = SETTINGS.search_max_length
+
+# Usernames starting with the query come first, then full names, then fuzzy matches
+RANK_USERNAME, RANK_FULLNAME, RANK_FUZZY = 0, 1, 2
+
+SEARCH_COLUMNS = (User.uid, User.username, User.fullname, User.profile_picture)
+
+
+class SearchRow(NamedTuple):
+    """Row of a search result, shaped like the SQL search's rows."""
+
+    uid: UUID
+    username: str
+    fullname: Optional[str]
+    profile_picture: Optional[str]
+    rank: int
+    name: str
+
+
+# Session.info key of user changes waiting for their transaction to commit
+PENDING_KEY = "user_search_pending"
+
+
+class UserSearch(ABC):
+    """Search over enabled users, ranked and paged by (rank, matched name, uid)."""
+
+    @abstractmethod
+    async def search(self, session: AsyncSession, query: str, page: Page) -> list[Row | SearchRow]:
+        """
+        Search users.
+
+        Parameters
+        ----------
+        session : AsyncSession
+            Session
+        query : str
+            Query
+        page : Page
+            Page, after a ((rank, name), uid) cursor
+
+        Returns
+        -------
+        list[Row | SearchRow]
+            Up to limit + 1 rows of SEARCH_COLUMNS, rank and name
+        """
+
+    @abstractmethod
+    def update(self, changes: dict[UUID, Optional[dict]]) -> None:
+        """
+        Apply committed user changes.
+
+        Parameters
+        ----------
+        changes : dict[UUID, Optional[dict]]
+            Changed username, fullname and disabled by uid, None for deleted users
+        """
+
+    @abstractmethod
+    async def close(self) -> None:
+        """Release the index."""
+
+
+class SQLUserSearch(UserSearch):
+    """Search straight from the user table, one branch per rank, each reading at most a page.
+
+    On Postgres, the prefix branches walk the (lower(username) COLLATE "C", uid) and (lower(fullname) COLLATE "C", uid)
+    indexes in order from the cursor, and the fuzzy branch finds matches with the pg_trgm GIN indexes and orders them
+    by trigram distance. Elsewhere, the fuzzy branch falls back to substrings in name order.
+    """
+
+    async def search(self, session: AsyncSession, query: str, page: Page) -> list[Row]:
+        query = query.lower()
+        postgres = session.bind.dialect.name == "postgresql"
+        username, fullname = func.lower(User.username), func.lower(User.fullname)
+        # Byte order, so ORDER BY and the keyset match the C collated indexes, as SQLite compares anyway
+        username_key, fullname_key = (
+            (username.collate("C"), fullname.collate("C")) if postgres else (username, fullname)
+        )
+        username_prefix = username_key.startswith(query, autoescape=True)
+        fullname_prefix = fullname_key.startswith(query, autoescape=True)
+
+        branches = [
+            self.select_branch(RANK_USERNAME, username_key, username_prefix, page),
+            # Users matching both are listed once, under their username
+            self.select_branch(RANK_FULLNAME, fullname_key, and_(fullname_prefix, ~username_prefix), page),
+        ]
+        # Short queries share trigrams with nearly everyone, so they only match prefixes
+        if len(query) >= SEARCH_FUZZY_MIN_LENGTH:
+            if postgres:
+                match = or_(username.op("%")(query), fullname.op("%")(query))
+                distance = func.least(username.op("<->")(query), func.coalesce(fullname.op("<->")(query), 1))
+                # Distances are in [0, 1], so fixed width text sorts like them and shares the name column
+                key = func.to_char(distance, "FM0.000000")
+            else:
+                match = or_(username.contains(query, autoescape=True), fullname.contains(query, autoescape=True))
+                key = username_key
+            not_prefix = and_(~username_prefix, or_(User.fullname.is_(None), ~fullname_prefix))
+            branches.append(self.select_branch(RANK_FUZZY, key, and_(match, not_prefix), page))
+
+        branches = [branch for branch in branches if branch is not None]
+        if not branches:
+            return []
+        results = union_all(*branches).subquery()
+        return (
+            await session.exec(
+                select(*results.c).order_by(results.c.rank, results.c.name, results.c.uid).limit(page.limit + 1)
+            )
+        ).all()
+
+    @staticmethod
+    def select_branch(rank: int, key, condition, page: Page) -> Select | None:
+        """
+        Select one rank's matches after the cursor, in key order.
+
+        Parameters
+        ----------
+        rank : int
+            Rank
+        key : ColumnElement
+            Sort key within the rank
+        condition : ColumnElement
+            Match condition
+        page : Page
+            Page
+
+        Returns
+        -------
+        Select | None
+            Up to limit + 1 matches, or None if the cursor is past the rank
+        """
+        statement = (
+            select(*SEARCH_COLUMNS, literal(rank).label("rank"), key.label("name"))
+            .where(condition)
+            .where(User.disabled.is_not(True))
+        )
+        if page.after:
+            (after_rank, after_name), after_uid = page.after
+            if rank < after_rank:
+                return None
+            if rank == after_rank:
+                statement = statement.where(tuple_(key, User.uid) > (after_name, after_uid))
+        # Wrapped, since SQLite does not allow LIMIT on the members of a UNION
+        return statement.order_by(key, User.uid).limit(page.limit + 1).subquery().select()
+
+    def update(self, changes: dict[UUID, Optional[dict]]) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class SortedKeys:
+    """Sorted (key, uid) pairs of lowercase keys, searched by bisection."""
+
+    __slots__ = ("entries",)
+
+    def __init__(self, entries: Iterable[tuple[str, UUID]] = ()):
+        self.entries: list[tuple[str, UUID]] = sorted(entries)
+
+    def add(self, key: str, uid: UUID) -> None:
+        insort(self.entries, (key, uid))
+
+    def remove(self, key: str, uid: UUID) -> None:
+        index = bisect_left(self.entries, (key, uid))
+        if index < len(self.entries) and self.entries[index] == (key, uid):
+            del self.entries[index]
+
+    def iter_prefix(self, prefix: str, after: Optional[tuple[str, UUID]] = None) -> Iterator[tuple[str, UUID]]:
+        """
+        Iterate keys starting with a prefix in (key, uid) order.
+
+        Parameters
+        ----------
+        prefix : str
+            Prefix
+        after : Optional[tuple[str, UUID]]
+            Only yield entries after this (key, uid)
+
+        Yields
+        ------
+        tuple[str, UUID]
+            (key, uid)
+        """
+        # (prefix,) sorts before every (key, uid) whose key starts with the prefix
+        index = bisect_left(self.entries, (prefix,))
+        if after:
+            index = max(index, bisect_right(self.entries, after))
+        while index < len(self.entries) and self.entries[index][0].startswith(prefix):
+            yield self.entries[index]
+            index += 1
+
+
+class MemoryUserSearch(UserSearch):
+    """Prefix search over sorted usernames and full names in this worker, without fuzzy matching.
+
+    The first search starts loading the index in the background and, like every search until it is loaded, is served
+    by SQL. From then on it is kept up to date by committed inserts, updates and deletes of users in this worker only,
+    so it suits a single worker or a tolerance for other workers' changes being missed. Each enabled user costs a
+    couple of list entries rather than a node per character.
+    """
+
+    def __init__(self):
+        self.usernames = SortedKeys()
+        self.fullnames = SortedKeys()
+        self.users: dict[UUID, tuple[str, str]] = {}
+        self.loaded = False
+        self.loading: asyncio.Task | None = None
+        # Changes committed while loading, applied on top of what the load read
+        self.pending: dict[UUID, Optional[dict]] = {}
+        self.fallback = SQLUserSearch()
+
+    async def load(self, engine: AsyncEngine) -> None:
+        """
+        Load enabled users from the database.
+
+        Parameters
+        ----------
+        engine : AsyncEngine
+            Engine
+        """
+        async with AsyncSession(engine) as session:
+            rows = (
+                await session.exec(select(User.uid, User.username, User.fullname).where(User.disabled.is_not(True)))
+            ).all()
+        self.users = {row.uid: ((row.username or "").lower(), (row.fullname or "").lower()) for row in rows}
+        self.usernames = SortedKeys((username, uid) for uid, (username, _) in self.users.items() if username)
+        self.fullnames = SortedKeys((fullname, uid) for uid, (_, fullname) in self.users.items() if fullname)
+        self.loaded = True
+        self.update(self.pending)
+        self.pending = {}
+
+    async def run_load(self, engine: AsyncEngine) -> None:
+        try:
+            await self.load(engine)
+        except Exception:
+            LOGGER.exception("Unable to load the user search index")
+        finally:
+            # Retried by the next search if it failed
+            self.loading = None
+
+    def add(self, uid: UUID, username: Optional[str], fullname: Optional[str]) -> None:
+        self.remove(uid)
+        username, fullname = (username or "").lower(), (fullname or "").lower()
+        self.users[uid] = (username, fullname)
+        if username:
+            self.usernames.add(username, uid)
+        if fullname:
+            self.fullnames.add(fullname, uid)
+
+    def remove(self, uid: UUID) -> None:
+        username, fullname = self.users.pop(uid, ("", ""))
+        if username:
+            self.usernames.remove(username, uid)
+        if fullname:
+            self.fullnames.remove(fullname, uid)
+
+    async def search(self, session: AsyncSession, query: str, page: Page) -> list[Row | SearchRow]:
+        if not self.loaded:
+            if self.loading is None:
+                self.pending = {}
+                self.loading = asyncio.create_task(self.run_load(session.bind))
+            return await self.fallback.search(session, query, page)
+        query = query.lower()
+        matches = []
+        for rank, keys in [(RANK_USERNAME, self.usernames), (RANK_FULLNAME, self.fullnames)]:
+            after = None
+            if page.after:
+                (after_rank, after_name), after_uid = page.after
+                if rank < after_rank:
+                    continue
+                if rank == after_rank:
+                    after = (after_name, after_uid)
+            for name, uid in keys.iter_prefix(query, after):
+                # Listed once, under the username
+                if rank == RANK_FULLNAME and self.users[uid][0].startswith(query):
+                    continue
+                matches.append((rank, name, uid))
+                if len(matches) > page.limit:
+                    break
+            if len(matches) > page.limit:
+                break
+        if not matches:
+            return []
+
+        rows = {
+            row.uid: row
+            for row in (
+                await session.exec(
+                    select(*SEARCH_COLUMNS)
+                    .where(User.uid.in_([uid for _, _, uid in matches]))
+                    .where(User.disabled.is_not(True))
+                )
+            ).all()
+        }
+        return [SearchRow(*rows[uid], rank, name) for rank, name, uid in matches if uid in rows]
+
+    def update(self, changes: dict[UUID, Optional[dict]]) -> None:
+        if not self.loaded:
+            if self.loading is not None:
+                self.pending.update(changes)
+            return
+        for uid, change in changes.items():
+            if change is None or change.get("disabled"):
+                self.remove(uid)
+                continue
+            username, fullname = self.users.get(uid, ("", ""))
+            self.add(uid, change.get("username", username), change.get("fullname", fullname))
+
+    async def close(self) -> None:
+        if self.loading is not None:
+            self.loading.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.loading
+        self.usernames, self.fullnames, self.users, self.pending = SortedKeys(), SortedKeys(), {}, {}
+        self.loaded = False
+
+
+USER_SEARCH_BACKENDS: dict[str, Callable[[], UserSearch]] = {
+    "sql": SQLUserSearch,
+    "memory": MemoryUserSearch,
+}
+
+SEARCH: UserSearch | None = None
+
+
+def get_user_search() -> UserSearch:
+    """
+    Get the configured user search, creating it if needed.
+
+    Returns
+    -------
+    UserSearch
+        User search
+    """
+    global SEARCH
+    if SEARCH is None:
+        SEARCH = USER_SEARCH_BACKENDS[USER_SEARCH_BACKEND]()
+    return SEARCH
+
+
+async def close_user_search() -> None:
+    """Close the user search."""
+    global SEARCH
+    if SEARCH is not None:
+        await SEARCH.close()
+        SEARCH = None
+
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+def queue_user_search_update(mapper, connection, target: User):
+    # Only loaded attributes are known, and the rest keep their indexed values
+    loaded = inspect(target).dict
+    change = {key: loaded[key] for key in ("username", "fullname", "disabled") if key in loaded}
+    object_session(target).info.setdefault(PENDING_KEY, {})[target.uid] = change
+
+
+@event.listens_for(User, "after_delete")
+def queue_user_search_delete(mapper, connection, target: User):
+    object_session(target).info.setdefault(PENDING_KEY, {})[target.uid] = None
+
+
+@event.listens_for(Session, "after_commit")
+def apply_user_search_updates(session: Session):
+    # Applied only once committed, so a rolled back signup or rename never shows up
+    changes = session.info.pop(PENDING_KEY, None)
+    if changes and SEARCH is not None:
+        SEARCH.update(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_user_search_updates(session: Session):
+    session.info.pop(PENDING_KEY, None)
@@ -1,43 +1,50 @@
 """Dependencies for user endpoints."""
-import smtplib
+import hashlib
+import secrets
+import time
 import uuid
 from datetime import datetime, timedelta
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.utils import formataddr
-from typing import Annotated, List, Optional
+from typing import Annotated, Optional
+from uuid import UUID
 
-import requests
-from fastapi import Cookie, Depends, HTTPException, Response
+import httpx
+from fastapi import Cookie, Depends, HTTPException, Request, Response
 from fastapi.responses import RedirectResponse
 from jose import JWTError, jwt
-from markdown import markdown
-from passlib.context import CryptContext
-from sqlmodel import Session, select
+from sqlalchemy import Row, Select, Subquery, event, inspect, tuple_
+from sqlalchemy.orm import aliased, load_only
+from sqlmodel import and_, case, delete, func, insert, literal, or_, select, text, union_all, update
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.config import get_settings
 from app.database import get_session
-from app.models.users import AuthCode, Friend, FriendRequest, User
+from app.dependencies.authcodes import get_auth_code_store
+from app.dependencies.cache import TTLCache
+from app.dependencies.http import http_request
+from app.dependencies.jwks import JWKSCache
+from app.dependencies.passwords import (
+    check_and_update_password,
+    check_password,
+    hash_password,
+    run_in_password_pool,
+)
+from app.dependencies.revocation import REVOCATIONS
+from app.models.users import Friend, FriendRequest, Page, User, UserSession
 
 SETTINGS = get_settings()
 
-SMTP_SSL_HOST = SETTINGS.smtp_ssl_host
-SMTP_SSL_PORT = SETTINGS.smtp_ssl_port
-SMTP_SSL_SENDER = SETTINGS.smtp_ssl_sender
-SMTP_SSL_LOGIN = SETTINGS.smtp_ssl_login
-SMTP_SSL_PASSWORD = SETTINGS.smtp_ssl_password
-
 JWT_SECRET = SETTINGS.jwt_secret
 ACCESS_TOKEN_EXPIRES = timedelta(minutes=SETTINGS.access_token_expire_minutes)
 REFRESH_TOKEN_EXPIRES = timedelta(minutes=SETTINGS.refresh_token_expire_minutes)
 VERIFY_CODE_EXPIRES = timedelta(minutes=SETTINGS.verify_code_expire_minutes)
 RECOVERY_CODE_EXPIRES = timedelta(minutes=SETTINGS.recovery_code_expire_minutes)
 JWT_ALGORITHM = "HS256"
-PWD_CONTEXT = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 GOOGLE_CLIENT_ID = SETTINGS.google_client_id
 GOOGLE_CLIENT_SECRET = SETTINGS.google_client_secret
 GOOGLE_REDIRECT_URI = SETTINGS.google_redirect_uri
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+GOOGLE_JWKS = JWKSCache(SETTINGS.google_jwks_url)
 
 FRONTEND_URL = SETTINGS.frontend_url
 DOMAIN = FRONTEND_URL.split("//")[1].split(":")[0]  # : is for port in case of localhost
@@ -50,16 +57,60 @@ CREDENTIALS_EXCEPTION = HTTPException(
     detail="Could not validate credentials",
 )
 
+# Columns needed to authenticate and identify a user, and to return them as UserRead.
+# Everything else, such as the password hash and refresh token, is deferred and raises if accessed.
+PRINCIPAL_COLUMNS = (User.id, User.uid, User.email, User.username, User.provider, User.disabled)
+USER_READ_COLUMNS = (
+    *PRINCIPAL_COLUMNS,
+    User.join_date,
+    User.profile_picture,
+    User.fullname,
+    User.account_view,
+    User.is_sidebar_open,
+)
+FRIEND_READ_COLUMNS = (User.uid, User.join_date, User.profile_picture, User.username)
+
+# Users by (provider, token, columns), tagged by uid so every entry for a user can be invalidated.
+# Entries are detached and may be stale, so routes that write the user load it with get_user_for_update instead of
+# merging an entry, which would write every cached attribute back over other writers' changes.
+PRINCIPAL_CACHE = TTLCache("principal", SETTINGS.principal_cache_size, SETTINGS.principal_cache_ttl)
+
+# Friend suggestions by (uid, limit, friends_version), tagged by uid. The version lives in the database, so a user's
+# friendship changes invalidate them in every worker. Changes among their friends' friends only show once entries
+# expire.
+FRIEND_SUGGESTIONS_SIZE = SETTINGS.friend_suggestions_size
+FRIEND_SUGGESTIONS_CACHE = TTLCache(
+    "friend_suggestions", SETTINGS.friend_suggestions_cache_size, SETTINGS.friend_suggestions_cache_ttl
+)
+
+RELATIONSHIP_NONE = "none"
+RELATIONSHIP_PENDING_OUT = "pending-out"
+RELATIONSHIP_PENDING_IN = "pending-in"
+RELATIONSHIP_FRIENDS = "friends"
+
+MAX_BULK_SIZE = SETTINGS.max_bulk_size
+FRIEND_ACTION_MESSAGES = {
+    "accept": "Friend request accepted",
+    "decline": "Friend request declined",
+    "revert": "Friend request reverted",
+    "delete": "Friend deleted",
+}
 
-def get_user(
-    session: Session, disabled: bool = None, provider: str = None, email: str = None, username: str = None
+
+async def get_user(
+    session: AsyncSession,
+    disabled: bool = None,
+    provider: str = None,
+    email: str = None,
+    username: str = None,
+    columns: tuple = None,
 ) -> User | None:
     """
     Get user.
 
     Parameters
     ----------
-    session : Session
+    session : AsyncSession
         Session
     provider : str
         Provider
@@ -67,6 +118,8 @@ def get_user(
         Email
     username : str
         Username
+    columns : tuple
+        Columns to load, deferring the rest, by default all
 
     Returns
     -------
@@ -75,6 +128,9 @@ def get_user(
     """
     statement = select(User)
 
+    if columns:
+        statement = statement.options(load_only(*columns, raiseload=True))
+
     if disabled is not None:
         statement = statement.where(User.disabled == disabled)
 
@@ -82,41 +138,13 @@ def get_user(
         statement = statement.where(User.provider == provider)
 
     if email:
-        return session.exec(statement.where(User.email == email)).first()
+        return (await session.exec(statement.where(User.email == email))).first()
     elif username:
-        return session.exec(statement.where(User.username == username)).first()
+        return (await session.exec(statement.where(User.username == username))).first()
     else:
         return None
 
 
-def send_email(email: str, subject: str, body: str) -> None:
-    """
-    Send email.
-
-    Parameters
-    ----------
-    email : str
-        Email
-    subject : str
-        Subject
-    body : str
-        Body
-    """
-    with smtplib.SMTP(SMTP_SSL_HOST, SMTP_SSL_PORT) as s:
-        s.ehlo()
-        s.starttls()
-        s.ehlo()
-        s.login(SMTP_SSL_LOGIN, SMTP_SSL_PASSWORD)
-
-        msg = MIMEMultipart("alternative")
-        msg["From"] = formataddr((SMTP_SSL_SENDER, SMTP_SSL_LOGIN))
-        msg["To"] = email
-        msg["Subject"] = subject
-        msg.attach(MIMEText(body, "plain"))
-        msg.attach(MIMEText(markdown(body), "html"))
-        s.send_message(msg)
-
-
 def get_google_auth_url(state: str) -> str:
     """
     Get Google auth URL.
@@ -134,51 +162,53 @@ def get_google_auth_url(state: str) -> str:
     return f"https://accounts.google.com/o/oauth2/v2/auth?response_type=code&client_id={GOOGLE_CLIENT_ID}&redirect_uri={GOOGLE_REDIRECT_URI}&scope=openid%20profile%20email&access_type=offline&state={state}"
 
 
-def get_auth_code(session: Session, email: str, request_type: str, status: str = "pending") -> AuthCode | None:
+async def create_code(session: AsyncSession, email: str, request_type: str, expires: timedelta) -> str:
     """
-    Get auth code.
+    Create a code to email, replacing any previous one. Needs a commit.
 
     Parameters
     ----------
-    session : Session
+    session : AsyncSession
         Session
     email : str
         Email
     request_type : str
         Request type
-    status : str
-        Status
+    expires : timedelta
+        Time until the code expires
 
     Returns
     -------
-    AuthCode
-        Auth code
+    str
+        Code
     """
-    return session.exec(
-        select(AuthCode)
-        .where(AuthCode.email == email)
-        .where(AuthCode.request_type == request_type)
-        .where(AuthCode.status == status)
-    ).all()[-1]
+    return await get_auth_code_store().issue(session, email, request_type, expires)
 
 
-def verify_code(session: Session, code: str, email: str, request_type: str) -> bool:
+async def verify_code(session: AsyncSession, code: str, email: str, request_type: str) -> bool:
     """
-    Check if code is valid.
+    Check if code is valid, and use it up so it cannot be used again.
 
     Parameters
     ----------
-    session : Session
+    session : AsyncSession
         Session
     code : str
         Code
     email : str
         Email
+    request_type : str
+        Request type
 
     Returns
     -------
     bool
-        True if code is valid, else False
+        True if code is valid
+
+    Raises
+    ------
+    HTTPException
+        If code is empty, not found, invalid or expired
     """
     if not code:
         raise HTTPException(
@@ -186,33 +216,7 @@ def verify_code(session: Session, code: str, email: str, request_type: str) -> b
             detail="Code is empty",
         )
 
-    db_verify_code = get_auth_code(session, email, request_type)
-    now = datetime.utcnow()
-
-    if not db_verify_code or not db_verify_code.code:
-        raise HTTPException(
-            status_code=404,
-            detail="Previous code not found, request new code",
-        )
-    if code != db_verify_code.code or db_verify_code.status == "verified":
-        raise HTTPException(
-            status_code=400,
-            detail="Code is invalid",
-        )
-    if db_verify_code.expire_date < now or db_verify_code.status == "expired":
-        if db_verify_code.status != "expired":
-            db_verify_code.status = "expired"
-            session.add(db_verify_code)
-            session.commit()
-        raise HTTPException(
-            status_code=400,
-            detail="Code is expired, request new code",
-        )
-
-    db_verify_code.status = "verified"
-    db_verify_code.usage_date = now
-    session.add(db_verify_code)
-    session.commit()
+    await get_auth_code_store().verify(session, email, request_type, code)
     return True
 
 
@@ -234,18 +238,19 @@ def create_token(data: dict, expires_delta: timedelta) -> str:
     """
     to_encode = data.copy()
     expire = datetime.utcnow() + expires_delta
-    to_encode.update({"exp": expire})
+    # A unique id per token lets a single token be revoked before it expires
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
 
-def generate_username_from_email(session: Session, email: str) -> str:
+async def generate_username_from_email(session: AsyncSession, email: str) -> str:
     """
     Generate username from email.
 
     Parameters
     ----------
-    session : Session
+    session : AsyncSession
         Session
     email : str
         Email
@@ -257,15 +262,15 @@ def generate_username_from_email(session: Session, email: str) -> str:
     """
     base = email.split("@")[0]
     username = base
-    while get_user(session, username=username):
+    while await get_user(session, username=username):
         unique_suffix = uuid.uuid4().hex[:4]
         username = f"{base}_{unique_suffix}"
     return username
 
 
-def get_password_hash(password: str) -> str:
+async def get_password_hash(password: str) -> str:
     """
-    Get password hash.
+    Get password hash in the password process pool.
 
     Parameters
     ----------
@@ -277,7 +282,7 @@ def get_password_hash(password: str) -> str:
     str
         Hashed password
     """
-    return PWD_CONTEXT.hash(password)
+    return await run_in_password_pool(hash_password, password)
 
 
 def set_auth_cookies(
@@ -336,8 +341,8 @@ def set_auth_cookies(
         )
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify password.
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify password in the password process pool.
 
     Parameters
     ----------
@@ -351,10 +356,28 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     bool
         True if password is verified, else False
     """
-    return PWD_CONTEXT.verify(plain_password, hashed_password)
+    return await run_in_password_pool(check_password, plain_password, hashed_password)
+
 
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """Verify password, and rehash it if it was hashed with outdated settings.
 
-def google_get_tokens(data: dict) -> dict[str, str]:
+    Parameters
+    ----------
+    plain_password: str
+        Plain text password
+    hashed_password: str
+        Hashed password
+
+    Returns
+    -------
+    tuple[bool, str | None]
+        True if password is verified, else False, and the new hash if it needs replacing, else None
+    """
+    return await run_in_password_pool(check_and_update_password, plain_password, hashed_password)
+
+
+async def google_get_tokens(data: dict) -> dict[str, str]:
     """
     Get tokens from Google.
 
@@ -368,19 +391,20 @@ def google_get_tokens(data: dict) -> dict[str, str]:
     dict[str, str]
         Tokens
     """
-    response = requests.post(
-        "https://www.googleapis.com/oauth2/v4/token",
-        data=data,
-    )
-    result = response.json()
+    try:
+        response = await http_request("POST", "https://www.googleapis.com/oauth2/v4/token", data=data)
+        result = response.json()
+    except (httpx.HTTPError, ValueError):
+        raise CREDENTIALS_EXCEPTION from None
     access_token = result.get("access_token")
     refresh_token = result.get("refresh_token")
-    if not access_token:
+    id_token = result.get("id_token")
+    if not access_token or not id_token:
         raise CREDENTIALS_EXCEPTION
-    return {"access_token": access_token, "refresh_token": refresh_token}
+    return {"access_token": access_token, "refresh_token": refresh_token, "id_token": id_token}
 
 
-def google_get_tokens_from_code(code: str) -> dict[str, str]:
+async def google_get_tokens_from_code(code: str) -> dict[str, str]:
     """
     Get tokens from Google code.
 
@@ -394,7 +418,7 @@ def google_get_tokens_from_code(code: str) -> dict[str, str]:
     dict[str, str]
         Tokens
     """
-    return google_get_tokens(
+    return await google_get_tokens(
         {
             "code": code,
             "client_id": GOOGLE_CLIENT_ID,
@@ -422,36 +446,49 @@ def google_encode_refresh_token(refresh_token: str) -> str:
     return jwt.encode({"refresh_token": refresh_token}, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
 
-def google_get_user_info_from_access_token(access_token: str) -> dict[str, str]:
+async def google_verify_id_token(id_token: str, access_token: str = None) -> dict[str, str]:
     """
-    Get user info from Google access token.
+    Verify a Google ID token against Google's cached signing keys, without calling Google.
 
     Parameters
     ----------
+    id_token : str
+        ID token
     access_token : str
-        Access token
+        Access token issued with the ID token, to check its at_hash claim
 
     Raises
     ------
     credentials_exception
-        If credentials are invalid
+        If the token is invalid, expired, for another client or for an unverified email
 
     Returns
     -------
     dict[str, str]
-        User info
+        Claims, including email, name and picture
     """
     try:
-        response = requests.get(
-            "https://www.googleapis.com/oauth2/v1/userinfo", headers={"Authorization": f"Bearer {access_token}"}
+        key = await GOOGLE_JWKS.get_key(jwt.get_unverified_header(id_token).get("kid"))
+        if key is None:
+            raise CREDENTIALS_EXCEPTION
+        claims = jwt.decode(
+            id_token,
+            key,
+            algorithms=["RS256"],
+            audience=GOOGLE_CLIENT_ID,
+            issuer=GOOGLE_ISSUERS,
+            access_token=access_token,
+            options={"verify_at_hash": access_token is not None},
         )
-        return response.json()
-    except Exception:
+    except JWTError:
         raise CREDENTIALS_EXCEPTION from None
+    if not claims.get("email") or not claims.get("email_verified"):
+        raise CREDENTIALS_EXCEPTION
+    return claims
 
 
-def google_get_user_from_user_info(
-    session: Session,
+async def google_get_user_from_user_info(
+    session: AsyncSession,
     user_info: dict,
     disabled: bool = None,
 ) -> User:
@@ -460,7 +497,7 @@ def google_get_user_from_user_info(
 
     Parameters
     ----------
-    session : Session
+    session : AsyncSession
         Session
     token : str
         Token
@@ -478,8 +515,8 @@ def google_get_user_from_user_info(
     provider = "google"
     email = user_info.get("email")
     if disabled is not None:
-        return get_user(session, disabled=disabled, provider=provider, email=email)
-    return get_user(session, provider=provider, email=email)
+        return await get_user(session, disabled=disabled, provider=provider, email=email)
+    return await get_user(session, provider=provider, email=email)
 
 
 def set_redirect_fe(response: RedirectResponse, route: str) -> RedirectResponse:
@@ -523,7 +560,7 @@ def google_decode_refresh_token(refresh_token: str) -> str:
         raise CREDENTIALS_EXCEPTION from None
 
 
-def google_get_new_access_token(refresh_token: str) -> dict[str, str]:
+async def google_get_tokens_from_refresh_token(refresh_token: str) -> dict[str, str]:
     """
     Get tokens from Google refresh token.
 
@@ -537,28 +574,30 @@ def google_get_new_access_token(refresh_token: str) -> dict[str, str]:
     dict[str, str]
         Tokens
     """
-    return google_get_tokens(
+    return await google_get_tokens(
         {
             "refresh_token": refresh_token,
             "client_id": GOOGLE_CLIENT_ID,
             "client_secret": GOOGLE_CLIENT_SECRET,
             "grant_type": "refresh_token",
         },
-    )["access_token"]
+    )
 
 
-def get_user_from_token(session: Session, provider: str, token: str) -> User:
+async def get_user_from_token(session: AsyncSession, provider: str, token: str, columns: tuple = None) -> User:
     """
     Verify token.
 
     Parameters
     ----------
-    session : Session
+    session : AsyncSession
         Session
     provider : str
         Provider
     token : str
         Token
+    columns : tuple
+        Columns to load, deferring the rest, by default all
 
     Raises
     ------
@@ -570,33 +609,201 @@ def get_user_from_token(session: Session, provider: str, token: str) -> User:
     User
         User
     """
-    if provider == "template":
-        try:
-            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-            email: str = payload.get("email")
-            if email is None:
-                raise CREDENTIALS_EXCEPTION
-        except JWTError:
-            raise CREDENTIALS_EXCEPTION from None
-    elif provider == "google":
-        # Check if token is access token or refresh token
-        try:
-            user_info = google_get_user_info_from_access_token(token)
-            email = user_info.get("email")
-        except HTTPException:  # token is refresh token
-            dec_refresh_token = google_decode_refresh_token(token)
-            access_token = google_get_new_access_token(dec_refresh_token)
-            user_info = google_get_user_info_from_access_token(access_token)
-            email = user_info.get("email")
-    else:
+    if provider not in ("template", "google"):
+        raise CREDENTIALS_EXCEPTION
+    # Google users get our own session token once Google's ID token is verified, so both providers verify locally
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except JWTError:
+        raise CREDENTIALS_EXCEPTION from None
+    email: str = payload.get("email")
+    jti: str = payload.get("jti")
+    if email is None or jti is None or payload.get("provider", "template") != provider:
+        raise CREDENTIALS_EXCEPTION
+    if await REVOCATIONS.is_revoked(session, jti):
         raise CREDENTIALS_EXCEPTION
 
-    db_user = get_user(session, disabled=False, provider=provider, email=email)
+    db_user = await get_user(session, disabled=False, provider=provider, email=email, columns=columns)
     if db_user is None:
         raise CREDENTIALS_EXCEPTION
     return db_user
 
 
+def hash_refresh_token(refresh_token: str) -> str:
+    """
+    Hash refresh token for storage and lookup.
+
+    Refresh tokens are random, so a fast unsalted hash is enough to make stored hashes useless to an attacker.
+
+    Parameters
+    ----------
+    refresh_token : str
+        Refresh token
+
+    Returns
+    -------
+    str
+        SHA-256 of the refresh token
+    """
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+
+def create_user_session(
+    session: AsyncSession, user: User, provider: str, request: Request, provider_refresh_token: str = None
+) -> str:
+    """
+    Create a session for a newly signed in device.
+
+    Parameters
+    ----------
+    session : AsyncSession
+        Session
+    user : User
+        User
+    provider : str
+        Provider
+    request : Request
+        Request, for device metadata
+    provider_refresh_token : str
+        Encoded refresh token from the provider, if any
+
+    Returns
+    -------
+    str
+        Refresh token, to be committed with the session
+    """
+    refresh_token = secrets.token_urlsafe(32)
+    session.add(
+        UserSession(
+            user_uid=user.uid,
+            token_hash=hash_refresh_token(refresh_token),
+            provider=provider,
+            provider_refresh_token=provider_refresh_token,
+            user_agent=(request.headers.get("user-agent") or "")[:255] or None,
+            ip_address=request.client.host if request.client else None,
+            expire_date=datetime.utcnow() + REFRESH_TOKEN_EXPIRES,
+        )
+    )
+    return refresh_token
+
+
+def rotate_user_session(session: AsyncSession, user_session: UserSession) -> str:
+    """
+    Replace the refresh token of a session, extending its expiry, without touching the user.
+
+    Parameters
+    ----------
+    session : AsyncSession
+        Session
+    user_session : UserSession
+        User session
+
+    Returns
+    -------
+    str
+        New refresh token, to be committed with the session
+    """
+    refresh_token = secrets.token_urlsafe(32)
+    user_session.token_hash = hash_refresh_token(refresh_token)
+    user_session.last_used_date = datetime.utcnow()
+    user_session.expire_date = user_session.last_used_date + REFRESH_TOKEN_EXPIRES
+    session.add(user_session)
+    return refresh_token
+
+
+async def get_user_session(session: AsyncSession, refresh_token: str) -> tuple[UserSession, User] | None:
+    """
+    Get an unexpired session and its active user from a refresh token.
+
+    One lookup on the session token_hash unique index, joined to the user by uid.
+
+    Parameters
+    ----------
+    session : AsyncSession
+        Session
+    refresh_token : str
+        Refresh token
+
+    Returns
+    -------
+    tuple[UserSession, User] | None
+        User session and user with USER_READ_COLUMNS loaded, if the token is valid
+    """
+    statement = (
+        select(UserSession, User)
+        .join(User, User.uid == UserSession.user_uid)
+        .where(
+            UserSession.token_hash == hash_refresh_token(refresh_token),
+            UserSession.expire_date > datetime.utcnow(),
+            User.disabled.is_(False),
+        )
+        .options(load_only(*USER_READ_COLUMNS, raiseload=True))
+    )
+    return (await session.exec(statement)).first()
+
+
+async def revoke_token(session: AsyncSession, token: str) -> None:
+    """
+    Revoke a token until it expires, if it is valid. Needs a commit.
+
+    Parameters
+    ----------
+    session : AsyncSession
+        Session
+    token : str
+        Token
+    """
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except JWTError:
+        return
+    if "jti" in payload:
+        await REVOCATIONS.revoke(session, payload["jti"], datetime.utcfromtimestamp(payload["exp"]))
+
+
+async def delete_user_session(session: AsyncSession, refresh_token: str) -> UUID | None:
+    """
+    Delete the session of a refresh token.
+
+    Parameters
+    ----------
+    session : AsyncSession
+        Session
+    refresh_token : str
+        Refresh token
+
+    Returns
+    -------
+    UUID | None
+        Uid of the session's user, if the session existed
+    """
+    statement = (
+        delete(UserSession)
+        .where(UserSession.token_hash == hash_refresh_token(refresh_token))
+        .returning(UserSession.user_uid)
+    )
+    return (await session.exec(statement)).scalar_one_or_none()
+
+
+async def delete_user_sessions(session: AsyncSession, user: User, expired_only: bool = False) -> None:
+    """
+    Delete the sessions of a user.
+
+    Parameters
+    ----------
+    session : AsyncSession
+        Session
+    user : User
+        User
+    expired_only : bool
+        Only delete expired sessions, by default False
+    """
+    statement = delete(UserSession).where(UserSession.user_uid == user.uid)
+    if expired_only:
+        statement = statement.where(UserSession.expire_date <= datetime.utcnow())
+    await session.exec(statement)
+
+
 def delete_auth_cookies(response: Response, cookies: list[str] = None) -> None:
     """
     Delete auth cookies.
@@ -612,9 +819,96 @@ def delete_auth_cookies(response: Response, cookies: list[str] = None) -> None:
         response.delete_cookie(key=cookie)
 
 
+async def get_cached_user_from_token(session: AsyncSession, provider: str, token: str, columns: tuple) -> User:
+    """
+    Verify token, through PRINCIPAL_CACHE.
+
+    Parameters
+    ----------
+    session : AsyncSession
+        Session
+    provider : str
+        Provider
+    token : str
+        Token
+    columns : tuple
+        Columns to load, deferring the rest
+
+    Returns
+    -------
+    User
+        User, detached from the session
+    """
+    key = (provider, token, tuple(column.key for column in columns))
+    cached = PRINCIPAL_CACHE.get(key)
+    if cached is None:
+        user = await get_user_from_token(session, provider, token, columns=columns)
+        session.expunge(user)
+        claims = jwt.get_unverified_claims(token)
+        # An entry never outlives its token
+        PRINCIPAL_CACHE.set(key, (user, claims["jti"], claims["exp"]), tags=[user.uid], ttl=claims["exp"] - time.time())
+        return user
+
+    # The token was verified when cached, but may have expired or been revoked since, possibly by another worker
+    user, jti, expire = cached
+    if expire <= time.time() or await REVOCATIONS.is_revoked(session, jti):
+        PRINCIPAL_CACHE.delete(key)
+        raise CREDENTIALS_EXCEPTION
+    return user
+
+
+async def get_user_for_update(session: AsyncSession, current_user: User) -> User:
+    """
+    Load the current user's row in a session, to write only the fields a request changes.
+
+    Parameters
+    ----------
+    session : AsyncSession
+        Session
+    current_user : User
+        Current user, possibly a cached principal
+
+    Returns
+    -------
+    User
+        User as currently stored
+
+    Raises
+    ------
+    HTTPException
+        If user was deleted or disabled since they were cached
+    """
+    user = await session.get(User, current_user.id)
+    if user is None:
+        raise CREDENTIALS_EXCEPTION
+    if user.disabled:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return user
+
+
+def invalidate_principal(user_uid: UUID):
+    """
+    Remove a user from PRINCIPAL_CACHE after it was changed, deleted or logged out.
+
+    Parameters
+    ----------
+    user_uid : UUID
+        User uid
+    """
+    PRINCIPAL_CACHE.invalidate(user_uid)
+
+
+@event.listens_for(User, "after_update")
+def invalidate_disabled_principal(mapper, connection, target: User):
+    # Disabling a user through the ORM in this worker stops their cached tokens from authenticating at once. Other
+    # workers, bulk updates and plain SQL are not seen, so there a disabled user keeps access until entries expire.
+    if inspect(target).attrs.disabled.history.has_changes():
+        invalidate_principal(target.uid)
+
+
 async def get_current_user(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     access_token: Optional[str] = Cookie(default=None),
     provider: Optional[str] = Cookie(default=None),
 ) -> User:
@@ -623,7 +917,7 @@ async def get_current_user(
 
     Parameters
     ----------
-    session : Session, optional
+    session : AsyncSession, optional
         Session, by default Depends(get_session)
     token : str
         Token
@@ -635,7 +929,7 @@ async def get_current_user(
     """
     if not access_token or not provider:
         raise CREDENTIALS_EXCEPTION
-    return get_user_from_token(session, provider, access_token)
+    return await get_cached_user_from_token(session, provider, access_token, USER_READ_COLUMNS)
 
 
 async def get_current_active_user(
@@ -664,13 +958,51 @@ async def get_current_active_user(
     return current_user
 
 
-def verify_user_update(session: Session, current_user: User, user_data: dict):
+async def get_current_principal(
+    *,
+    session: AsyncSession = Depends(get_session),
+    access_token: Optional[str] = Cookie(default=None),
+    provider: Optional[str] = Cookie(default=None),
+) -> User:
+    """
+    Get current active user with only PRINCIPAL_COLUMNS loaded.
+
+    For routes that only need to know who the user is, not return them.
+
+    Parameters
+    ----------
+    session : AsyncSession, optional
+        Session, by default Depends(get_session)
+    access_token : str
+        Access token
+    provider : str
+        Provider
+
+    Returns
+    -------
+    User
+        Current user
+
+    Raises
+    ------
+    HTTPException
+        If user is inactive
+    """
+    if not access_token or not provider:
+        raise CREDENTIALS_EXCEPTION
+    principal = await get_cached_user_from_token(session, provider, access_token, PRINCIPAL_COLUMNS)
+    if principal.disabled:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return principal
+
+
+async def verify_user_update(session: AsyncSession, current_user: User, user_data: dict):
     """
     Verify user update data.
 
     Parameters
     ----------
-    session : Session
+    session : AsyncSession
         Session
     current_user : User
         Current user
@@ -695,7 +1027,7 @@ def verify_user_update(session: Session, current_user: User, user_data: dict):
                 detail="Username is empty",
             )
         if current_user.username != user_data["username"]:
-            if get_user(session, username=user_data["username"]):
+            if await get_user(session, username=user_data["username"]):
                 raise HTTPException(
                     status_code=400,
                     detail="Username is invalid",
@@ -717,112 +1049,521 @@ def verify_user_update(session: Session, current_user: User, user_data: dict):
                 status_code=400,
                 detail="Passwords do not match",
             )
-        user_data["hashed_password"] = get_password_hash(user_data["password"])
+        user_data["hashed_password"] = await get_password_hash(user_data["password"])
         del user_data["password"]
         del user_data["confirm_password"]
 
 
-def get_sent_friend_request_links(current_user: User, status: str = "pending") -> List[FriendRequest]:
+def select_page_keys(mine, other, date, current_user: User, status: str, page: Page) -> Select:
     """
-    Get sent friend request links.
+    Select the sort keys of one direction of a user's links, for a keyset page.
+
+    Sorted by date, the page is read straight off the (mine, status, date, other) index, which also covers it.
 
     Parameters
     ----------
+    mine : InstrumentedAttribute
+        Link column holding the current user
+    other : InstrumentedAttribute
+        Link column holding the other user
+    date : InstrumentedAttribute
+        Link date column
     current_user : User
         Current user
+    status : str
+        Status
+    page : Page
+        Page
 
     Returns
     -------
-    List[FriendRequest]
-        Sent friend request links
+    Select
+        Other user uid, link date and sort keys of up to limit + 1 links
     """
-    return [link for link in current_user.sender_links if link.status == status]
+    keys = (date, other) if page.sort == "date" else (User.username, User.uid)
+    query = (
+        select(other.label("other_uid"), date, keys[0].label("sort_key"), keys[1].label("sort_uid"))
+        .where(mine == current_user.uid)
+        .where(mine.class_.status == status)
+    )
+    if page.sort == "username":
+        query = query.join(User, User.uid == other)
+    if page.after:
+        query = query.where(tuple_(*keys) > page.after)
+    return query.order_by(*keys).limit(page.limit + 1)
+
+
+async def get_page_rows(session: AsyncSession, keys: Subquery, date: str, page: Page, *columns) -> list[Row]:
+    # Only the columns a friend list shows, as plain rows rather than ORM objects, named like the response fields
+    return (
+        await session.exec(
+            select(*FRIEND_READ_COLUMNS, keys.c[date], *columns)
+            .join(keys, User.uid == keys.c.other_uid)
+            .order_by(keys.c.sort_key, keys.c.sort_uid)
+            .limit(page.limit + 1)
+        )
+    ).all()
 
 
-def get_sent_friend_requests(current_user: User, status: str = "pending") -> List[User]:
+async def get_sent_friend_requests(
+    session: AsyncSession, current_user: User, page: Page, status: str = "pending"
+) -> list[Row]:
     """
-    Get sent friend requests.
+    Get a page of sent friend requests in one statement.
+
+    Served by ix_friendrequest_user_uid_status_request_date.
 
     Parameters
     ----------
+    session : AsyncSession
+        Session
     current_user : User
         Current user
+    page : Page
+        Page
+    status : str
+        Status
 
     Returns
     -------
-    List[User]
-        Sent friend requests
+    list[Row]
+        Up to limit + 1 rows of FRIEND_READ_COLUMNS and request_date
     """
-    return [link.receiver for link in current_user.sender_links if link.status == status]
+    keys = select_page_keys(
+        FriendRequest.user_uid, FriendRequest.friend_uid, FriendRequest.request_date, current_user, status, page
+    ).subquery()
+    return await get_page_rows(session, keys, "request_date", page)
 
 
-def get_incoming_friend_request_links(current_user: User, status: str = "pending") -> List[FriendRequest]:
+async def get_incoming_friend_requests(
+    session: AsyncSession, current_user: User, page: Page, status: str = "pending"
+) -> list[Row]:
     """
-    Get incoming friend request links.
+    Get a page of incoming friend requests in one statement.
+
+    Served by ix_friendrequest_friend_uid_status_request_date.
 
     Parameters
     ----------
+    session : AsyncSession
+        Session
     current_user : User
         Current user
+    page : Page
+        Page
+    status : str
+        Status
 
     Returns
     -------
-    List[FriendRequest]
-        Incoming friend request links
+    list[Row]
+        Up to limit + 1 rows of FRIEND_READ_COLUMNS and request_date
     """
-    return [link for link in current_user.receiver_links if link.status == status]
+    keys = select_page_keys(
+        FriendRequest.friend_uid, FriendRequest.user_uid, FriendRequest.request_date, current_user, status, page
+    ).subquery()
+    return await get_page_rows(session, keys, "request_date", page)
 
 
-def get_incoming_friend_requests(current_user: User, status: str = "pending") -> List[User]:
+async def get_friends(session: AsyncSession, current_user: User, page: Page, status: str = "confirmed") -> list[Row]:
     """
-    Get incoming friend requests.
+    Get a page of friends in one statement.
+
+    Served by ix_friend_user_uid_status_friendship_date and ix_friend_friend_uid_status_friendship_date.
 
     Parameters
     ----------
+    session : AsyncSession
+        Session
     current_user : User
         Current user
+    page : Page
+        Page
+    status : str
+        Status
+
+    Returns
+    -------
+    list[Row]
+        Up to limit + 1 rows of FRIEND_READ_COLUMNS, friendship_date and mutual_friends
+    """
+    # Each edge is stored once, so page both directions off their own index and merge the two short lists
+    keys = union_all(
+        select_page_keys(Friend.user_uid, Friend.friend_uid, Friend.friendship_date, current_user, status, page)
+        .subquery()
+        .select(),
+        select_page_keys(Friend.friend_uid, Friend.user_uid, Friend.friendship_date, current_user, status, page)
+        .subquery()
+        .select(),
+    ).subquery()
+    # Counted per row of the page only, by looking each friend's edges up in the same indexes
+    mine = select_friend_uids(current_user.uid).cte("mine")
+    mutual = aliased(Friend)
+    mutual_friends = (
+        select(func.count())
+        .select_from(mutual)
+        .where(
+            or_(
+                and_(mutual.user_uid == keys.c.other_uid, mutual.friend_uid.in_(select(mine.c.uid))),
+                and_(mutual.friend_uid == keys.c.other_uid, mutual.user_uid.in_(select(mine.c.uid))),
+            )
+        )
+        .where(mutual.status == "confirmed")
+        .scalar_subquery()
+        .label("mutual_friends")
+    )
+    return await get_page_rows(session, keys, "friendship_date", page, mutual_friends)
+
+
+def select_friend_uids(uid: UUID) -> Select:
+    """
+    Select the uids of a user's confirmed friends.
+
+    Parameters
+    ----------
+    uid : UUID
+        User uid
 
     Returns
     -------
-    List[User]
-        Incoming friend requests
+    Select
+        Friend uids, as uid
     """
-    return [link.sender for link in current_user.receiver_links if link.status == status]
+    return union_all(
+        select(Friend.friend_uid.label("uid")).where(Friend.user_uid == uid).where(Friend.status == "confirmed"),
+        select(Friend.user_uid.label("uid")).where(Friend.friend_uid == uid).where(Friend.status == "confirmed"),
+    )
 
 
-def get_friend_links(current_user: User, status: str = "confirmed") -> List[Friend]:
+async def get_friend_suggestions(session: AsyncSession, current_user: User, limit: int) -> list[Row]:
     """
-    Get friends links.
+    Get friends of friends, ranked by how many friends they share with a user, in one aggregation.
+
+    Users already friends with or in a pending request with the user are left out.
 
     Parameters
     ----------
+    session : AsyncSession
+        Session
     current_user : User
         Current user
+    limit : int
+        Suggestions
 
     Returns
     -------
-    List[Friend]
-        Friend links
+    list[Row]
+        Up to limit rows of FRIEND_READ_COLUMNS and mutual_friends
     """
-    return [link for link in current_user.friend_1_links if link.status == status] + [
-        link for link in current_user.friend_2_links if link.status == status
-    ]
+    mine = select_friend_uids(current_user.uid).cte("mine")
+    # Both directions of every edge from a friend, served by the (uid, status, date, other uid) indexes
+    candidates = union_all(
+        select(Friend.friend_uid.label("uid"))
+        .where(Friend.user_uid.in_(select(mine.c.uid)))
+        .where(Friend.status == "confirmed"),
+        select(Friend.user_uid.label("uid"))
+        .where(Friend.friend_uid.in_(select(mine.c.uid)))
+        .where(Friend.status == "confirmed"),
+    ).subquery()
+    requested = union_all(
+        select(FriendRequest.friend_uid.label("uid"))
+        .where(FriendRequest.user_uid == current_user.uid)
+        .where(FriendRequest.status == "pending"),
+        select(FriendRequest.user_uid.label("uid"))
+        .where(FriendRequest.friend_uid == current_user.uid)
+        .where(FriendRequest.status == "pending"),
+    )
+    counts = (
+        select(candidates.c.uid, func.count().label("mutual_friends"))
+        .where(candidates.c.uid != current_user.uid)
+        .where(candidates.c.uid.not_in(select(mine.c.uid)))
+        .where(candidates.c.uid.not_in(requested))
+        .group_by(candidates.c.uid)
+        .subquery()
+    )
+    return (
+        await session.exec(
+            select(*FRIEND_READ_COLUMNS, counts.c.mutual_friends)
+            .join(counts, User.uid == counts.c.uid)
+            .where(User.disabled.is_not(True))
+            .order_by(counts.c.mutual_friends.desc(), User.uid)
+            .limit(limit)
+        )
+    ).all()
 
 
-def get_friends(current_user: User, status: str = "confirmed") -> List[User]:
+async def get_cached_friend_suggestions(session: AsyncSession, current_user: User, limit: int) -> list[Row]:
     """
-    Get friends.
+    Get friend suggestions from FRIEND_SUGGESTIONS_CACHE, aggregating them on a miss.
 
     Parameters
     ----------
+    session : AsyncSession
+        Session
     current_user : User
         Current user
+    limit : int
+        Suggestions
 
     Returns
     -------
-    List[User]
-        Friend
+    list[Row]
+        Up to limit rows of FRIEND_READ_COLUMNS and mutual_friends
+    """
+    # Every worker sees the version bumped with the user's friendships, so entries cached before a change are skipped
+    version = (await session.exec(select(User.friends_version).where(User.uid == current_user.uid))).one()
+    key = (current_user.uid, limit, version)
+    suggestions = FRIEND_SUGGESTIONS_CACHE.get(key)
+    if suggestions is None:
+        suggestions = await get_friend_suggestions(session, current_user, limit)
+        FRIEND_SUGGESTIONS_CACHE.set(key, suggestions, tags=(current_user.uid,))
+    return suggestions
+
+
+async def invalidate_friend_suggestions(session: AsyncSession, *uids: UUID):
     """
-    return [link.friend_1 for link in current_user.friend_1_links if link.status == status] + [
-        link.friend_2 for link in current_user.friend_2_links if link.status == status
-    ]
+    Invalidate users' friend suggestions in every worker after their friendships or requests changed. Needs a commit.
+
+    Bumps their friends_version, which keys FRIEND_SUGGESTIONS_CACHE, and drops this worker's entries right away.
+    Suggestions of their friends, which count them as mutual friends, are left to expire with the TTL.
+
+    Parameters
+    ----------
+    session : AsyncSession
+        Session
+    *uids : UUID
+        User uids
+    """
+    await session.exec(update(User).where(User.uid.in_(uids)).values(friends_version=User.friends_version + 1))
+    for uid in uids:
+        FRIEND_SUGGESTIONS_CACHE.invalidate(uid)
+
+
+async def delete_user_links(session: AsyncSession, current_user: User) -> None:
+    """
+    Delete all friend and friend request links of a user.
+
+    Parameters
+    ----------
+    session : AsyncSession
+        Session
+    current_user : User
+        Current user
+    """
+    await session.exec(
+        delete(FriendRequest).where(
+            or_(FriendRequest.user_uid == current_user.uid, FriendRequest.friend_uid == current_user.uid)
+        )
+    )
+    await session.exec(
+        delete(Friend).where(or_(Friend.user_uid == current_user.uid, Friend.friend_uid == current_user.uid))
+    )
+
+
+def get_friend_edge(uid: UUID, other_uid: UUID) -> tuple[UUID, UUID]:
+    """
+    Get the ordered pair a friendship between two users is stored under.
+
+    Parameters
+    ----------
+    uid : UUID
+        User uid
+    other_uid : UUID
+        Other user uid
+
+    Returns
+    -------
+    tuple[UUID, UUID]
+        (low uid, high uid)
+    """
+    return (uid, other_uid) if uid < other_uid else (other_uid, uid)
+
+
+async def get_relationship(session: AsyncSession, current_user: User, other_user: User) -> str:
+    """
+    Get the relationship state between two users in a single query.
+
+    Served by uq_friend_edge and uq_friendrequest_pending_pair.
+
+    Parameters
+    ----------
+    session : AsyncSession
+        Session
+    current_user : User
+        Current user
+    other_user : User
+        Other user
+
+    Returns
+    -------
+    str
+        One of RELATIONSHIP_NONE, RELATIONSHIP_PENDING_OUT, RELATIONSHIP_PENDING_IN or RELATIONSHIP_FRIENDS
+    """
+    low_uid, high_uid = get_friend_edge(current_user.uid, other_user.uid)
+    friends = (
+        select(literal(RELATIONSHIP_FRIENDS).label("state"), literal(0).label("priority"))
+        .where(Friend.user_uid == low_uid)
+        .where(Friend.friend_uid == high_uid)
+        .where(Friend.status == "confirmed")
+    )
+    requests = (
+        select(
+            case(
+                (FriendRequest.user_uid == current_user.uid, RELATIONSHIP_PENDING_OUT),
+                else_=RELATIONSHIP_PENDING_IN,
+            ).label("state"),
+            literal(1).label("priority"),
+        )
+        .where(
+            or_(
+                and_(FriendRequest.user_uid == current_user.uid, FriendRequest.friend_uid == other_user.uid),
+                and_(FriendRequest.user_uid == other_user.uid, FriendRequest.friend_uid == current_user.uid),
+            )
+        )
+        .where(FriendRequest.status == "pending")
+    )
+    row = (await session.exec(union_all(friends, requests).order_by("priority").limit(1))).first()
+    return row.state if row else RELATIONSHIP_NONE
+
+
+async def get_relationships(session: AsyncSession, current_user: User, uids: list[UUID]) -> dict[UUID, str]:
+    """
+    Get the relationship states between a user and many others in a single query.
+
+    Served by ix_friend_user_uid_status_friendship_date, ix_friend_friend_uid_status_friendship_date and the friend
+    request equivalents.
+
+    Parameters
+    ----------
+    session : AsyncSession
+        Session
+    current_user : User
+        Current user
+    uids : list[UUID]
+        Other users' uids
+
+    Returns
+    -------
+    dict[UUID, str]
+        Relationship state by uid, RELATIONSHIP_NONE if absent
+    """
+    friends = (
+        select(
+            case((Friend.user_uid == current_user.uid, Friend.friend_uid), else_=Friend.user_uid).label("uid"),
+            literal(RELATIONSHIP_FRIENDS).label("state"),
+            literal(0).label("priority"),
+        )
+        .where(
+            or_(
+                and_(Friend.user_uid == current_user.uid, Friend.friend_uid.in_(uids)),
+                and_(Friend.friend_uid == current_user.uid, Friend.user_uid.in_(uids)),
+            )
+        )
+        .where(Friend.status == "confirmed")
+    )
+    requests = (
+        select(
+            case(
+                (FriendRequest.user_uid == current_user.uid, FriendRequest.friend_uid),
+                else_=FriendRequest.user_uid,
+            ).label("uid"),
+            case(
+                (FriendRequest.user_uid == current_user.uid, RELATIONSHIP_PENDING_OUT),
+                else_=RELATIONSHIP_PENDING_IN,
+            ).label("state"),
+            literal(1).label("priority"),
+        )
+        .where(
+            or_(
+                and_(FriendRequest.user_uid == current_user.uid, FriendRequest.friend_uid.in_(uids)),
+                and_(FriendRequest.friend_uid == current_user.uid, FriendRequest.user_uid.in_(uids)),
+            )
+        )
+        .where(FriendRequest.status == "pending")
+    )
+    relationships = dict.fromkeys(uids, RELATIONSHIP_NONE)
+    # Friendship wins over a request left pending, as in get_relationship
+    for row in (await session.exec(union_all(friends, requests).order_by(text("priority DESC")))).all():
+        relationships[row.uid] = row.state
+    return relationships
+
+
+def check_friend_action(action: str, relationship: str) -> str | None:
+    """
+    Check a friend action is allowed in a relationship state.
+
+    Parameters
+    ----------
+    action : str
+        One of "accept", "decline", "revert" or "delete"
+    relationship : str
+        Relationship state
+
+    Returns
+    -------
+    str | None
+        Why the action is not allowed, else None
+    """
+    if action == "delete":
+        return None if relationship == RELATIONSHIP_FRIENDS else "Friend not added"
+    if relationship == RELATIONSHIP_FRIENDS:
+        return "Friend already added"
+    if action == "revert":
+        return None if relationship == RELATIONSHIP_PENDING_OUT else "Friend request not found"
+    return None if relationship == RELATIONSHIP_PENDING_IN else "Friend request not sent"
+
+
+async def apply_friend_action(session: AsyncSession, current_user: User, action: str, uids: list[UUID]) -> None:
+    """
+    Apply a friend action to many users with one statement per table. Needs a commit.
+
+    Parameters
+    ----------
+    session : AsyncSession
+        Session
+    current_user : User
+        Current user
+    action : str
+        One of "accept", "decline", "revert" or "delete", already checked with check_friend_action
+    uids : list[UUID]
+        Other users' uids
+    """
+    if action in ("accept", "decline"):
+        await session.exec(
+            update(FriendRequest)
+            .where(FriendRequest.user_uid.in_(uids))
+            .where(FriendRequest.friend_uid == current_user.uid)
+            .where(FriendRequest.status == "pending")
+            .values(status="accepted" if action == "accept" else "declined")
+        )
+    if action == "accept":
+        # One executemany, where adding each Friend would insert them one by one to read back their ids
+        now = datetime.utcnow()
+        edges = [get_friend_edge(current_user.uid, uid) for uid in uids]
+        await session.exec(
+            insert(Friend),
+            params=[
+                {"user_uid": low_uid, "friend_uid": high_uid, "friendship_date": now, "status": "confirmed"}
+                for low_uid, high_uid in edges
+            ],
+        )
+    if action == "revert":
+        await session.exec(
+            update(FriendRequest)
+            .where(FriendRequest.user_uid == current_user.uid)
+            .where(FriendRequest.friend_uid.in_(uids))
+            .where(FriendRequest.status == "pending")
+            .values(status="reverted")
+        )
+    if action == "delete":
+        await session.exec(
+            update(Friend)
+            .where(
+                or_(
+                    and_(Friend.user_uid == current_user.uid, Friend.friend_uid.in_(uids)),
+                    and_(Friend.friend_uid == current_user.uid, Friend.user_uid.in_(uids)),
+                )
+            )
+            .where(Friend.status == "confirmed")
+            .values(status="deleted")
+        )
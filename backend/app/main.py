@@ -1,20 +1,53 @@
 """Main application and routing logic for the API."""
 
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.config import get_settings
-from app.dependencies.users import WWW_URL
-from app.routers import users
+from app.dependencies.authcodes import close_auth_code_store
+from app.dependencies.http import close_http_client, get_http_client
+from app.dependencies.pagination import NEXT_CURSOR_HEADER
+from app.dependencies.passwords import shutdown_password_pool
+from app.dependencies.pictures import shutdown_picture_pool
+from app.dependencies.ratelimit import close_rate_limit_backend
+from app.dependencies.search import close_user_search
+from app.dependencies.users import GOOGLE_CLIENT_ID, GOOGLE_JWKS, WWW_URL
+from app.routers import metrics, pictures, users
 
 # Settings
 SETTINGS = get_settings()
 FRONTEND_URL = SETTINGS.frontend_url
 
+
+# Lifespan
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop shared resources."""
+    get_http_client()
+    # Keep Google's signing keys fresh so verifying Google sessions never waits on a fetch
+    jwks_task = asyncio.create_task(GOOGLE_JWKS.run()) if GOOGLE_CLIENT_ID else None
+    yield
+    if jwks_task:
+        jwks_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await jwks_task
+    shutdown_picture_pool()
+    shutdown_password_pool()
+    await close_http_client()
+    await close_rate_limit_backend()
+    await close_auth_code_store()
+    await close_user_search()
+
+
 # App
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.include_router(users.router)
+app.include_router(metrics.router)
+app.include_router(pictures.router)
 
 # CORS
 app.add_middleware(
@@ -23,6 +56,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 
@@ -0,0 +1,39 @@
+"""Add user search indexes
+
+Revision ID: 21405fe7dc20
+Revises: 6a0d2f8e5c13
+Create Date: 2024-04-02 15:21:37.104826
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "21405fe7dc20"
+down_revision = "6a0d2f8e5c13"
+branch_labels = None
+depends_on = None
+
+# (name, expression, method), prefixes being served by text_pattern_ops whatever the collation, fuzzy matches by trigrams
+INDEXES = [
+    ("ix_user_username_lower_pattern", "lower(username) text_pattern_ops", "btree"),
+    ("ix_user_fullname_lower_pattern", "lower(fullname) text_pattern_ops", "btree"),
+    ("ix_user_username_lower_trgm", "lower(username) gin_trgm_ops", "gin"),
+    ("ix_user_fullname_lower_trgm", "lower(fullname) gin_trgm_ops", "gin"),
+]
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction and does not block writes
+    with op.get_context().autocommit_block():
+        for name, expression, method in INDEXES:
+            op.create_index(
+                name, "user", [sa.text(expression)], unique=False, postgresql_using=method, postgresql_concurrently=True
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _, _ in INDEXES:
+            op.drop_index(name, table_name="user", postgresql_concurrently=True)
@@ -0,0 +1,37 @@
+"""Add revoked tokens
+
+Revision ID: 22735cdf7ead
+Revises: 5b7e2c9a4d10
+Create Date: 2024-03-18 09:41:27.604513
+
+"""
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "22735cdf7ead"
+down_revision = "5b7e2c9a4d10"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "revoked_token",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("jti", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("revoked_date", sa.DateTime(), nullable=False),
+        sa.Column("expire_date", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_revoked_token_expire_date"), "revoked_token", ["expire_date"], unique=False)
+    op.create_index(op.f("ix_revoked_token_jti"), "revoked_token", ["jti"], unique=True)
+    op.create_index(op.f("ix_revoked_token_revoked_date"), "revoked_token", ["revoked_date"], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f("ix_revoked_token_revoked_date"), table_name="revoked_token")
+    op.drop_index(op.f("ix_revoked_token_jti"), table_name="revoked_token")
+    op.drop_index(op.f("ix_revoked_token_expire_date"), table_name="revoked_token")
+    op.drop_table("revoked_token")
@@ -0,0 +1,35 @@
+"""Clear codes of finished outbox emails and index them for pruning
+
+Revision ID: 3c570b083114
+Revises: 21405fe7dc20
+Create Date: 2024-04-05 10:12:48.319207
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3c570b083114"
+down_revision = "21405fe7dc20"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Sent and failed emails no longer keep the codes they carried
+    op.execute("UPDATE email_outbox SET code = NULL, body = NULL WHERE status != 'pending'")
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction and does not block writes
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_email_outbox_finished",
+            "email_outbox",
+            ["created_date"],
+            unique=False,
+            postgresql_where=sa.text("status != 'pending'"),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_email_outbox_finished", table_name="email_outbox", postgresql_concurrently=True)
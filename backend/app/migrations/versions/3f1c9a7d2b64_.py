@@ -0,0 +1,93 @@
+"""Add friend and friend request lookup indexes
+
+Revision ID: 3f1c9a7d2b64
+Revises: 14a2b347e196
+Create Date: 2024-03-02 11:08:41.207913
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3f1c9a7d2b64"
+down_revision = "14a2b347e196"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep only the newest active row per pair so the unique indexes can be built
+    op.execute(
+        """
+        UPDATE friendrequest SET status = 'reverted'
+        WHERE status = 'pending' AND id NOT IN (
+            SELECT MAX(id) FROM friendrequest WHERE status = 'pending' GROUP BY user_uid, friend_uid
+        )
+        """
+    )
+    op.execute(
+        """
+        UPDATE friend SET status = 'deleted'
+        WHERE status = 'confirmed' AND id NOT IN (
+            SELECT MAX(id) FROM friend WHERE status = 'confirmed'
+            GROUP BY LEAST(user_uid, friend_uid), GREATEST(user_uid, friend_uid)
+        )
+        """
+    )
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction and does not block writes
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_friendrequest_user_uid_status",
+            "friendrequest",
+            ["user_uid", "status"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_friendrequest_friend_uid_status",
+            "friendrequest",
+            ["friend_uid", "status"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "uq_friendrequest_pending_pair",
+            "friendrequest",
+            ["user_uid", "friend_uid"],
+            unique=True,
+            postgresql_where=sa.text("status = 'pending'"),
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_friend_user_uid_status",
+            "friend",
+            ["user_uid", "status"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_friend_friend_uid_status",
+            "friend",
+            ["friend_uid", "status"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "uq_friend_confirmed_pair",
+            "friend",
+            [sa.text("LEAST(user_uid, friend_uid)"), sa.text("GREATEST(user_uid, friend_uid)")],
+            unique=True,
+            postgresql_where=sa.text("status = 'confirmed'"),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index("uq_friend_confirmed_pair", table_name="friend", postgresql_concurrently=True)
+        op.drop_index("ix_friend_friend_uid_status", table_name="friend", postgresql_concurrently=True)
+        op.drop_index("ix_friend_user_uid_status", table_name="friend", postgresql_concurrently=True)
+        op.drop_index("uq_friendrequest_pending_pair", table_name="friendrequest", postgresql_concurrently=True)
+        op.drop_index("ix_friendrequest_friend_uid_status", table_name="friendrequest", postgresql_concurrently=True)
+        op.drop_index("ix_friendrequest_user_uid_status", table_name="friendrequest", postgresql_concurrently=True)
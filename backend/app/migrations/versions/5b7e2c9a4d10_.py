@@ -0,0 +1,71 @@
+"""Move refresh tokens from users to hashed per-device sessions
+
+Revision ID: 5b7e2c9a4d10
+Revises: 8d4e6b1f0a39
+Create Date: 2024-03-16 11:04:52.318207
+
+"""
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+from alembic import op
+
+from app.config import get_settings
+
+# revision identifiers, used by Alembic.
+revision = "5b7e2c9a4d10"
+down_revision = "8d4e6b1f0a39"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "session",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_uid", sqlmodel.sql.sqltypes.GUID(), nullable=False),
+        sa.Column("token_hash", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("provider", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("provider_refresh_token", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("user_agent", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("ip_address", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("created_date", sa.DateTime(), nullable=False),
+        sa.Column("last_used_date", sa.DateTime(), nullable=False),
+        sa.Column("expire_date", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["user_uid"],
+            ["user.uid"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_session_token_hash"), "session", ["token_hash"], unique=True)
+    op.create_index(op.f("ix_session_user_uid"), "session", ["user_uid"], unique=False)
+
+    # Keep signed in users signed in: their refresh token cookie hashes to their new session, which lasts as long as a
+    # refresh token issued now would
+    op.execute(
+        sa.text(
+            """
+            INSERT INTO session (
+                user_uid, token_hash, provider, provider_refresh_token, created_date, last_used_date, expire_date
+            )
+            SELECT
+                uid,
+                encode(sha256(convert_to(refresh_token, 'UTF8')), 'hex'),
+                provider,
+                CASE WHEN provider = 'google' THEN refresh_token END,
+                now() AT TIME ZONE 'utc',
+                now() AT TIME ZONE 'utc',
+                now() AT TIME ZONE 'utc' + make_interval(mins => :minutes)
+            FROM "user"
+            WHERE refresh_token IS NOT NULL
+            """
+        ).bindparams(minutes=get_settings().refresh_token_expire_minutes)
+    )
+    op.drop_column("user", "refresh_token")
+
+
+def downgrade():
+    op.add_column("user", sa.Column("refresh_token", sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    op.drop_index(op.f("ix_session_user_uid"), table_name="session")
+    op.drop_index(op.f("ix_session_token_hash"), table_name="session")
+    op.drop_table("session")
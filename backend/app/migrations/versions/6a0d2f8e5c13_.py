@@ -0,0 +1,54 @@
+"""Add keyset pagination indexes for friend lists
+
+Revision ID: 6a0d2f8e5c13
+Revises: b83f5e1c0a47
+Create Date: 2024-03-27 11:46:09.530284
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "6a0d2f8e5c13"
+down_revision = "b83f5e1c0a47"
+branch_labels = None
+depends_on = None
+
+# (table, old index, new index, new columns)
+INDEXES = [
+    (
+        "friendrequest",
+        ("ix_friendrequest_user_uid_status", ["user_uid", "status"]),
+        ("ix_friendrequest_user_uid_status_request_date", ["user_uid", "status", "request_date", "friend_uid"]),
+    ),
+    (
+        "friendrequest",
+        ("ix_friendrequest_friend_uid_status", ["friend_uid", "status"]),
+        ("ix_friendrequest_friend_uid_status_request_date", ["friend_uid", "status", "request_date", "user_uid"]),
+    ),
+    (
+        "friend",
+        ("ix_friend_user_uid_status", ["user_uid", "status"]),
+        ("ix_friend_user_uid_status_friendship_date", ["user_uid", "status", "friendship_date", "friend_uid"]),
+    ),
+    (
+        "friend",
+        ("ix_friend_friend_uid_status", ["friend_uid", "status"]),
+        ("ix_friend_friend_uid_status_friendship_date", ["friend_uid", "status", "friendship_date", "user_uid"]),
+    ),
+]
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction and does not block writes
+    with op.get_context().autocommit_block():
+        for table, (old_name, _), (new_name, new_columns) in INDEXES:
+            op.create_index(new_name, table, new_columns, unique=False, postgresql_concurrently=True)
+            # Lookups by user and status use the new index's leading columns
+            op.drop_index(old_name, table_name=table, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for table, (old_name, old_columns), (new_name, _) in INDEXES:
+            op.create_index(old_name, table, old_columns, unique=False, postgresql_concurrently=True)
+            op.drop_index(new_name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,23 @@
+"""Add user friends version
+
+Revision ID: 6f2a9c3e7b14
+Revises: 9e1b7d4c2f58
+Create Date: 2024-04-07 14:36:09.618452
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "6f2a9c3e7b14"
+down_revision = "9e1b7d4c2f58"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("user", sa.Column("friends_version", sa.Integer(), server_default="0", nullable=False))
+
+
+def downgrade():
+    op.drop_column("user", "friends_version")
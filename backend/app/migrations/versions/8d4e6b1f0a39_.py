@@ -0,0 +1,53 @@
+"""Store friendships as ordered edges
+
+Revision ID: 8d4e6b1f0a39
+Revises: 3f1c9a7d2b64
+Create Date: 2024-03-09 15:21:07.664180
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8d4e6b1f0a39"
+down_revision = "3f1c9a7d2b64"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Swap reversed rows so every edge is stored as (low uid, high uid)
+    op.execute(
+        "UPDATE friend SET user_uid = friend_uid, friend_uid = user_uid WHERE user_uid > friend_uid",
+    )
+    op.execute(
+        "ALTER TABLE friend ADD CONSTRAINT ck_friend_ordered_edge CHECK (user_uid < friend_uid) NOT VALID",
+    )
+
+    with op.get_context().autocommit_block():
+        # Validating in its own transaction, once the exclusive lock taken by adding the constraint is released,
+        # only needs a lock that lets writes through while existing rows are checked
+        op.execute("ALTER TABLE friend VALIDATE CONSTRAINT ck_friend_ordered_edge")
+        op.create_index(
+            "uq_friend_edge",
+            "friend",
+            ["user_uid", "friend_uid"],
+            unique=True,
+            postgresql_where=sa.text("status = 'confirmed'"),
+            postgresql_concurrently=True,
+        )
+        op.drop_index("uq_friend_confirmed_pair", table_name="friend", postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "uq_friend_confirmed_pair",
+            "friend",
+            [sa.text("LEAST(user_uid, friend_uid)"), sa.text("GREATEST(user_uid, friend_uid)")],
+            unique=True,
+            postgresql_where=sa.text("status = 'confirmed'"),
+            postgresql_concurrently=True,
+        )
+        op.drop_index("uq_friend_edge", table_name="friend", postgresql_concurrently=True)
+    op.drop_constraint("ck_friend_ordered_edge", "friend", type_="check")
@@ -0,0 +1,38 @@
+"""Add auth code lookup index
+
+Revision ID: 9c4f0e27b1d8
+Revises: 22735cdf7ead
+Create Date: 2024-03-20 14:22:05.871396
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "9c4f0e27b1d8"
+down_revision = "22735cdf7ead"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction and does not block writes
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_authcode_email_request_type_status_request_date",
+            "authcode",
+            ["email", "request_type", "status", "request_date"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        # Lookups by email alone use the new index's leading column
+        op.drop_index("ix_authcode_email", table_name="authcode", postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index("ix_authcode_email", "authcode", ["email"], unique=False, postgresql_concurrently=True)
+        op.drop_index(
+            "ix_authcode_email_request_type_status_request_date",
+            table_name="authcode",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,48 @@
+"""Key user search prefix indexes by uid in byte order
+
+Revision ID: 9e1b7d4c2f58
+Revises: 3c570b083114
+Create Date: 2024-04-06 09:48:15.527361
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "9e1b7d4c2f58"
+down_revision = "3c570b083114"
+branch_labels = None
+depends_on = None
+
+# (old name, old expression, new name, new expressions), each rank's page being read off the index in (name, uid) order
+INDEXES = [
+    (
+        "ix_user_username_lower_pattern",
+        "lower(username) text_pattern_ops",
+        "ix_user_username_lower_uid",
+        ['lower(username) COLLATE "C"', "uid"],
+    ),
+    (
+        "ix_user_fullname_lower_pattern",
+        "lower(fullname) text_pattern_ops",
+        "ix_user_fullname_lower_uid",
+        ['lower(fullname) COLLATE "C"', "uid"],
+    ),
+]
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction and does not block writes
+    with op.get_context().autocommit_block():
+        for old_name, _, name, expressions in INDEXES:
+            op.create_index(
+                name, "user", [sa.text(expression) for expression in expressions], postgresql_concurrently=True
+            )
+            op.drop_index(old_name, table_name="user", postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for old_name, old_expression, name, _ in INDEXES:
+            op.create_index(old_name, "user", [sa.text(old_expression)], postgresql_concurrently=True)
+            op.drop_index(name, table_name="user", postgresql_concurrently=True)
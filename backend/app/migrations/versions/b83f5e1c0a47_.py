@@ -0,0 +1,30 @@
+"""Render outbox emails from templates
+
+Revision ID: b83f5e1c0a47
+Revises: 4e1a7d3c8f62
+Create Date: 2024-03-25 16:03:31.225918
+
+"""
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b83f5e1c0a47"
+down_revision = "4e1a7d3c8f62"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("email_outbox", sa.Column("template", sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    op.add_column("email_outbox", sa.Column("code", sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    # Emails queued before templates keep their body, and the worker still sends them
+    op.alter_column("email_outbox", "body", existing_type=sa.VARCHAR(), nullable=True)
+
+
+def downgrade():
+    op.execute("DELETE FROM email_outbox WHERE body IS NULL")
+    op.alter_column("email_outbox", "body", existing_type=sa.VARCHAR(), nullable=False)
+    op.drop_column("email_outbox", "code")
+    op.drop_column("email_outbox", "template")
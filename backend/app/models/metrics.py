@@ -0,0 +1,67 @@
+"""Models for runtime metrics."""
+
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class PoolMetrics(BaseModel):
+    """Database connection pool metrics for a single worker."""
+
+    size: int
+    max_overflow: int
+    max_connections: Optional[int]
+    checked_in: int
+    checked_out: int
+    overflow: int
+    checkouts: int
+    timeouts: int
+    avg_wait_ms: float
+    max_wait_ms: float
+
+
+class CacheMetrics(BaseModel):
+    """In-process cache metrics for a single worker."""
+
+    size: int
+    maxsize: int
+    ttl: float
+    hits: int
+    misses: int
+    evictions: int
+    hit_rate: float
+
+
+class PasswordMetrics(BaseModel):
+    """Password hashing process pool metrics for a single worker."""
+
+    workers: int
+    max_pending: int
+    pending: int
+    queued: int
+    hashes: int
+    rejected: int
+    avg_hash_ms: float
+    max_hash_ms: float
+    avg_wait_ms: float
+
+
+class RevocationMetrics(BaseModel):
+    """Token revocation list metrics for a single worker."""
+
+    size: int
+    capacity: int
+    filter_bytes: int
+    checks: int
+    possible_positives: int
+    false_positives: int
+    false_positive_rate: float
+    refreshes: int
+
+
+class RateLimitMetrics(BaseModel):
+    """Rate limit metrics for a single route in a single worker."""
+
+    allowed: int
+    rejected: int
+    errors: int
@@ -1,10 +1,11 @@
 """Models for the application."""
 
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, List, Literal, Optional
 from uuid import UUID, uuid4
 
 from pydantic import BaseModel
+from sqlalchemy import CheckConstraint, Index, text
 from sqlmodel import Field, Relationship, SQLModel
 
 
@@ -12,8 +13,13 @@ from sqlmodel import Field, Relationship, SQLModel
 class AuthCode(SQLModel, table=True):
     """Verification code model."""
 
+    # Finds the latest pending code for an email without touching older codes, and covers lookups by email alone
+    __table_args__ = (
+        Index("ix_authcode_email_request_type_status_request_date", "email", "request_type", "status", "request_date"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    email: str = Field(default=None, index=True)
+    email: str = Field(default=None)
     code: str = Field(default_factory=lambda: uuid4().hex[:6])
 
     status: str = Field(default="pending", index=True)
@@ -23,6 +29,43 @@ class AuthCode(SQLModel, table=True):
     usage_date: Optional[datetime] = Field(default=None)
 
 
+class EmailOutbox(SQLModel, table=True):
+    """Email waiting to be sent by the outbox worker, written in the same transaction as what it announces."""
+
+    __tablename__ = "email_outbox"
+    # The worker only ever scans pending emails that are due, so sent ones do not slow it down
+    __table_args__ = (
+        Index(
+            "ix_email_outbox_pending",
+            "next_attempt_date",
+            postgresql_where=text("status = 'pending'"),
+            sqlite_where=text("status = 'pending'"),
+        ),
+        # Finished emails are pruned by age
+        Index(
+            "ix_email_outbox_finished",
+            "created_date",
+            postgresql_where=text("status != 'pending'"),
+            sqlite_where=text("status != 'pending'"),
+        ),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    recipient: str
+    subject: str
+    # Rendered from the template when sent, so only the code is stored, and only until the email is sent or fails
+    template: Optional[str] = Field(default=None)
+    code: Optional[str] = Field(default=None)
+    body: Optional[str] = Field(default=None)
+
+    status: str = Field(default="pending")
+    attempts: int = Field(default=0)
+    last_error: Optional[str] = Field(default=None)
+    created_date: datetime = Field(default_factory=datetime.utcnow)
+    next_attempt_date: datetime = Field(default_factory=datetime.utcnow)
+    sent_date: Optional[datetime] = Field(default=None)
+
+
 class GoogleAuth(SQLModel):
     """Google auth model."""
 
@@ -50,26 +93,30 @@ class UserBase(SQLModel):
 class User(UserBase, table=True):
     """User model."""
 
+    # User search's pg_trgm and (lower(...) COLLATE "C", uid) indexes on username and fullname are Postgres only,
+    # so they live in migrations alone
+
     id: Optional[int] = Field(default=None, primary_key=True)
     uid: UUID = Field(default_factory=lambda: uuid4(), unique=True)
 
     hashed_password: Optional[str] = Field(default=None)
-    refresh_token: Optional[str] = Field(default=None)
+    # Bumped with every change to the user's friendships or requests, keying their cached friend suggestions
+    friends_version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
     sender_links: Optional[List["FriendRequest"]] = Relationship(
         back_populates="sender",
         sa_relationship_kwargs={
             "foreign_keys": "FriendRequest.user_uid",
-            "lazy": "selectin",
-            "cascade": "all, delete",
+            "lazy": "raise",
+            "passive_deletes": "all",
         },
     )
     receiver_links: Optional[List["FriendRequest"]] = Relationship(
         back_populates="receiver",
         sa_relationship_kwargs={
             "foreign_keys": "FriendRequest.friend_uid",
-            "lazy": "selectin",
-            "cascade": "all, delete",
+            "lazy": "raise",
+            "passive_deletes": "all",
         },
     )
 
@@ -77,26 +124,72 @@ class User(UserBase, table=True):
         back_populates="friend_1",
         sa_relationship_kwargs={
             "foreign_keys": "Friend.user_uid",
-            "lazy": "selectin",
-            "cascade": "all, delete",
+            "lazy": "raise",
+            "passive_deletes": "all",
         },
     )
     friend_2_links: Optional[List["Friend"]] = Relationship(
         back_populates="friend_2",
         sa_relationship_kwargs={
             "foreign_keys": "Friend.friend_uid",
-            "lazy": "selectin",
-            "cascade": "all, delete",
+            "lazy": "raise",
+            "passive_deletes": "all",
         },
     )
 
 
+class UserSession(SQLModel, table=True):
+    """Refresh token session model, one per signed in device."""
+
+    __tablename__ = "session"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_uid: UUID = Field(default=None, foreign_key="user.uid", index=True)
+    # Only a hash is stored, so a leaked table cannot be used to sign in
+    token_hash: str = Field(default=None, unique=True, index=True)
+
+    provider: str = Field(default="template")
+    provider_refresh_token: Optional[str] = Field(default=None)
+    user_agent: Optional[str] = Field(default=None)
+    ip_address: Optional[str] = Field(default=None)
+
+    created_date: datetime = Field(default_factory=datetime.utcnow)
+    last_used_date: datetime = Field(default_factory=datetime.utcnow)
+    expire_date: datetime = Field(default=None)
+
+
+class RevokedToken(SQLModel, table=True):
+    """Revoked access token model, kept until the token would have expired anyway."""
+
+    __tablename__ = "revoked_token"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    jti: str = Field(default=None, unique=True, index=True)
+    revoked_date: datetime = Field(default_factory=datetime.utcnow, index=True)
+    expire_date: datetime = Field(default=None, index=True)
+
+
 class UserReference(UserBase):
     """Model for referencing a user."""
 
     username: str
 
 
+class FriendBulkAction(SQLModel):
+    """Model for applying one friend action to many users."""
+
+    action: Literal["accept", "decline", "revert", "delete"]
+    usernames: List[str]
+
+
+class FriendBulkResult(BaseModel):
+    """Result of a friend action for one user."""
+
+    username: str
+    status_code: int
+    detail: str
+
+
 class UserCreate(UserBase):
     """User create model."""
 
@@ -131,6 +224,20 @@ class UserUpdate(SQLModel):
 class FriendRequest(SQLModel, table=True):
     """Friend request link model."""
 
+    # Each direction is listed by date straight off its index, the other user's uid breaking ties
+    __table_args__ = (
+        Index("ix_friendrequest_user_uid_status_request_date", "user_uid", "status", "request_date", "friend_uid"),
+        Index("ix_friendrequest_friend_uid_status_request_date", "friend_uid", "status", "request_date", "user_uid"),
+        Index(
+            "uq_friendrequest_pending_pair",
+            "user_uid",
+            "friend_uid",
+            unique=True,
+            postgresql_where=text("status = 'pending'"),
+            sqlite_where=text("status = 'pending'"),
+        ),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_uid: UUID = Field(default=None, foreign_key="user.uid")
     friend_uid: UUID = Field(default=None, foreign_key="user.uid")
@@ -154,6 +261,22 @@ class FriendRequest(SQLModel, table=True):
 class Friend(SQLModel, table=True):
     """Friend link model."""
 
+    # Friendships are undirected, so each edge is stored once with user_uid < friend_uid,
+    # and listing a user's friends by date reads both indexes
+    __table_args__ = (
+        Index("ix_friend_user_uid_status_friendship_date", "user_uid", "status", "friendship_date", "friend_uid"),
+        Index("ix_friend_friend_uid_status_friendship_date", "friend_uid", "status", "friendship_date", "user_uid"),
+        Index(
+            "uq_friend_edge",
+            "user_uid",
+            "friend_uid",
+            unique=True,
+            postgresql_where=text("status = 'confirmed'"),
+            sqlite_where=text("status = 'confirmed'"),
+        ),
+        CheckConstraint("user_uid < friend_uid", name="ck_friend_ordered_edge"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_uid: UUID = Field(default=None, foreign_key="user.uid")
     friend_uid: UUID = Field(default=None, foreign_key="user.uid")
@@ -174,6 +297,24 @@ class Friend(SQLModel, table=True):
     )
 
 
+class Page(BaseModel):
+    """Keyset page request model."""
+
+    limit: int
+    sort: str = "date"
+    # (sort key, uid) of the last row of the previous page, the sort key being (rank, name) for search
+    after: Optional[tuple[Any, UUID]] = None
+
+
+class UserSearchRead(BaseModel):
+    """User search result model."""
+
+    uid: UUID
+    username: str
+    fullname: Optional[str]
+    profile_picture: Optional[str]
+
+
 class FriendReadBase(BaseModel):
     """Friend read base model."""
 
@@ -193,3 +334,10 @@ class FriendRead(FriendReadBase):
     """Friend read model."""
 
     friendship_date: datetime
+    mutual_friends: int = 0
+
+
+class FriendSuggestionRead(FriendReadBase):
+    """Friend suggestion read model."""
+
+    mutual_friends: int
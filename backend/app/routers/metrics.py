@@ -0,0 +1,87 @@
+"""Metrics routes."""
+
+from fastapi import APIRouter, Security
+
+from app.database import get_pool_metrics
+from app.dependencies.cache import get_cache_metrics
+from app.dependencies.passwords import get_password_metrics
+from app.dependencies.ratelimit import get_rate_limit_metrics
+from app.dependencies.revocation import get_revocation_metrics
+from app.dependencies.security import verify_api_key
+from app.models.metrics import CacheMetrics, PasswordMetrics, PoolMetrics, RateLimitMetrics, RevocationMetrics
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"],
+    dependencies=[Security(verify_api_key)],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.get("/database", response_model=PoolMetrics)
+async def read_database_metrics():
+    """Get database connection pool metrics for this worker.
+
+    Multiply `max_connections` by workers per node and nodes to size against Postgres `max_connections`. It is null
+    when a negative `max_overflow` leaves the pool unbounded.
+
+    Returns
+    -------
+    PoolMetrics
+        Pool metrics
+    """
+    return get_pool_metrics()
+
+
+@router.get("/cache", response_model=dict[str, CacheMetrics])
+async def read_cache_metrics():
+    """Get in-process cache metrics for this worker.
+
+    Returns
+    -------
+    dict[str, CacheMetrics]
+        Cache metrics by name
+    """
+    return get_cache_metrics()
+
+
+@router.get("/passwords", response_model=PasswordMetrics)
+async def read_password_metrics():
+    """Get password hashing pool metrics for this worker.
+
+    A growing `queued` or `rejected` count means logins need more `password_workers` or cheaper hashes.
+
+    Returns
+    -------
+    PasswordMetrics
+        Password pool metrics
+    """
+    return get_password_metrics()
+
+
+@router.get("/revocations", response_model=RevocationMetrics)
+async def read_revocation_metrics():
+    """Get token revocation list metrics for this worker.
+
+    A `false_positive_rate` well above `revocation_error_rate` means the filter is over capacity between rebuilds.
+
+    Returns
+    -------
+    RevocationMetrics
+        Revocation list metrics
+    """
+    return get_revocation_metrics()
+
+
+@router.get("/rate-limits", response_model=dict[str, RateLimitMetrics])
+async def read_rate_limit_metrics():
+    """Get rate limit metrics for this worker.
+
+    `errors` counts requests let through because the rate limit backend was unavailable.
+
+    Returns
+    -------
+    dict[str, RateLimitMetrics]
+        Rate limit metrics by route
+    """
+    return get_rate_limit_metrics()
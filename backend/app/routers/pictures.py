@@ -0,0 +1,56 @@
+"""Picture routes."""
+
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Response
+from starlette.concurrency import run_in_threadpool
+
+from app.dependencies.pictures import (
+    PICTURE_CACHE_CONTROL,
+    PICTURE_KEY_PATTERN,
+    PICTURE_MEDIA_TYPES,
+    get_picture_storage,
+)
+
+# No API key, since pictures are loaded directly by browsers
+router = APIRouter(
+    prefix="/pictures",
+    tags=["pictures"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.get("/{key}", response_class=Response)
+async def read_picture(
+    *,
+    key: str,
+    if_none_match: Optional[str] = Header(default=None),
+):
+    """Get picture.
+
+    Pictures are content-addressed, so they are cached forever and the key is the ETag.
+
+    Parameters
+    ----------
+    key
+        Picture key
+    if_none_match
+        ETag of the cached picture
+
+    Returns
+    -------
+    Response
+        Picture
+    """
+    match = PICTURE_KEY_PATTERN.match(key)
+    if not match:
+        raise HTTPException(status_code=404, detail="Picture not found")
+
+    headers = {"Cache-Control": PICTURE_CACHE_CONTROL, "ETag": f'"{key}"'}
+    if if_none_match and headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    data = await run_in_threadpool(get_picture_storage().load, key)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Picture not found")
+    return Response(content=data, media_type=PICTURE_MEDIA_TYPES[match["extension"]], headers=headers)
@@ -1,58 +1,88 @@
 """User routes."""
 
-from datetime import datetime
 from typing import Annotated, List, Optional
 
-from fastapi import APIRouter, Cookie, Depends, HTTPException, Response, Security
+from fastapi import APIRouter, Cookie, Depends, HTTPException, Query, Request, Response, Security, UploadFile
 from fastapi.responses import RedirectResponse
-from sqlmodel import Session
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.database import get_session
+from app.dependencies.outbox import queue_email
+from app.dependencies.pagination import MAX_PAGE_SIZE, get_page, get_search_page, paginate
+from app.dependencies.pictures import PICTURE_MAX_BYTES, store_picture, store_profile_picture
+from app.dependencies.ratelimit import RateLimit
+from app.dependencies.search import SEARCH_MAX_LENGTH, get_user_search
 from app.dependencies.security import verify_api_key
 from app.dependencies.users import (
     ACCESS_TOKEN_EXPIRES,
     CREDENTIALS_EXCEPTION,
+    FRIEND_ACTION_MESSAGES,
+    FRIEND_SUGGESTIONS_SIZE,
+    MAX_BULK_SIZE,
     RECOVERY_CODE_EXPIRES,
-    REFRESH_TOKEN_EXPIRES,
+    RELATIONSHIP_FRIENDS,
+    RELATIONSHIP_PENDING_IN,
+    RELATIONSHIP_PENDING_OUT,
+    USER_READ_COLUMNS,
     VERIFY_CODE_EXPIRES,
+    apply_friend_action,
+    check_friend_action,
+    create_code,
     create_token,
+    create_user_session,
     delete_auth_cookies,
+    delete_user_links,
+    delete_user_session,
+    delete_user_sessions,
     generate_username_from_email,
+    get_cached_friend_suggestions,
     get_current_active_user,
-    get_friend_links,
+    get_current_principal,
+    get_friend_edge,
     get_friends,
     get_google_auth_url,
-    get_incoming_friend_request_links,
     get_incoming_friend_requests,
     get_password_hash,
-    get_sent_friend_request_links,
+    get_relationship,
+    get_relationships,
     get_sent_friend_requests,
     get_user,
+    get_user_for_update,
     get_user_from_token,
+    get_user_session,
     google_decode_refresh_token,
     google_encode_refresh_token,
-    google_get_new_access_token,
     google_get_tokens_from_code,
+    google_get_tokens_from_refresh_token,
     google_get_user_from_user_info,
-    google_get_user_info_from_access_token,
-    send_email,
+    google_verify_id_token,
+    invalidate_friend_suggestions,
+    invalidate_principal,
+    revoke_token,
+    rotate_user_session,
     set_auth_cookies,
     set_redirect_fe,
+    verify_and_update_password,
     verify_code,
-    verify_password,
     verify_user_update,
 )
 from app.models.users import (
-    AuthCode,
     Friend,
+    FriendBulkAction,
+    FriendBulkResult,
     FriendRead,
     FriendRequest,
     FriendRequestRead,
+    FriendSuggestionRead,
     GoogleAuth,
+    Page,
     User,
     UserCreate,
     UserRead,
     UserReference,
+    UserSearchRead,
     UserUpdate,
 )
 
@@ -64,10 +94,10 @@ router = APIRouter(
 
 
 # Native signup/login
-@router.post("/verify-email", response_model=dict[str, str])
+@router.post("/verify-email", response_model=dict[str, str], dependencies=[Depends(RateLimit("verify-email"))])
 async def verify_email(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     user: UserCreate,
 ):
     """Verify email.
@@ -105,34 +135,20 @@ async def verify_email(
             detail="Passwords do not match",
         )
 
-    user_exists = get_user(session, email=db_user.email)
+    user_exists = await get_user(session, email=db_user.email)
     if not user_exists:
-        verify_code = AuthCode(
-            email=db_user.email,
-            request_type="verify",
-            expire_date=datetime.utcnow() + VERIFY_CODE_EXPIRES,
-        )
-        session.add(verify_code)
-        session.commit()
-
-        body = f"""
-**Welcome!**
-
-Head back to the website and enter the following code to continue:
-
-**{verify_code.code}**
-
-If you did not request this code, please ignore this email.
-        """
-        send_email(db_user.email, subject="Verify Email", body=body)
+        code = await create_code(session, db_user.email, "verify", VERIFY_CODE_EXPIRES)
+        queue_email(session, db_user.email, "welcome", code)
+        await session.commit()
 
     return {"message": "If the email exists, you will receive a verification email shortly."}
 
 
-@router.post("/token/signup", response_model=UserRead)
+@router.post("/token/signup", response_model=UserRead, dependencies=[Depends(RateLimit("signup"))])
 async def signup(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
+    request: Request,
     response: Response,
     user: UserCreate,
 ):
@@ -149,31 +165,32 @@ async def signup(
         User
     """
     db_user = UserCreate.model_validate(user)
-    verify_code(session, db_user.code, db_user.email, "verify")
+    await verify_code(session, db_user.code, db_user.email, "verify")
 
     access_token = create_token(data={"email": db_user.email}, expires_delta=ACCESS_TOKEN_EXPIRES)
-    refresh_token = create_token(data={"email": db_user.email}, expires_delta=REFRESH_TOKEN_EXPIRES)
 
     created_user = User(
-        profile_picture=db_user.profile_picture,
+        profile_picture=await store_profile_picture(db_user.profile_picture),
         email=db_user.email,
-        username=generate_username_from_email(session, db_user.email),
+        username=await generate_username_from_email(session, db_user.email),
         fullname=db_user.fullname,
-        hashed_password=get_password_hash(db_user.password),
-        refresh_token=refresh_token,
+        hashed_password=await get_password_hash(db_user.password),
     )
     session.add(created_user)
-    session.commit()
-    session.refresh(created_user)
+    await session.flush()
+    refresh_token = create_user_session(session, created_user, created_user.provider, request)
+    await session.commit()
+    await session.refresh(created_user)
 
     set_auth_cookies(response, access_token, refresh_token, created_user.provider)
     return UserRead.model_validate(created_user)
 
 
-@router.post("/token/login", response_model=UserRead)
+@router.post("/token/login", response_model=UserRead, dependencies=[Depends(RateLimit("login"))])
 async def login(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
+    request: Request,
     response: Response,
     user: UserCreate,
 ):
@@ -193,9 +210,9 @@ async def login(
     db_user = UserCreate.model_validate(user)
 
     if db_user.email:
-        verified_user = get_user(session, disabled=False, provider=provider, email=db_user.email)
+        verified_user = await get_user(session, disabled=False, provider=provider, email=db_user.email)
     elif db_user.username:
-        verified_user = get_user(session, disabled=False, provider=provider, username=db_user.username)
+        verified_user = await get_user(session, disabled=False, provider=provider, username=db_user.username)
     else:
         raise HTTPException(
             status_code=400,
@@ -206,16 +223,19 @@ async def login(
             status_code=400,
             detail="Password is empty",
         )
-    if not verified_user or not verify_password(db_user.password, verified_user.hashed_password):
+    if not verified_user:
+        raise HTTPException(status_code=401, detail="Incorrect email or password")
+    verified, new_hash = await verify_and_update_password(db_user.password, verified_user.hashed_password)
+    if not verified:
         raise HTTPException(status_code=401, detail="Incorrect email or password")
+    if new_hash:  # Hashed at an outdated cost, so re-tune it while the password is at hand
+        verified_user.hashed_password = new_hash
+        session.add(verified_user)
 
     access_token = create_token(data={"email": verified_user.email}, expires_delta=ACCESS_TOKEN_EXPIRES)
-    refresh_token = create_token(data={"email": verified_user.email}, expires_delta=REFRESH_TOKEN_EXPIRES)
-
-    verified_user.refresh_token = refresh_token
-    session.add(verified_user)
-    session.commit()
-    session.refresh(verified_user)
+    await delete_user_sessions(session, verified_user, expired_only=True)
+    refresh_token = create_user_session(session, verified_user, provider, request)
+    await session.commit()
 
     set_auth_cookies(response, access_token, refresh_token, provider)
     return UserRead.model_validate(verified_user)
@@ -251,7 +271,8 @@ async def verify_email_google(
 @router.post("/token/google", response_model=UserRead)
 async def auth_google(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
+    request: Request,
     response: Response,
     auth: GoogleAuth,
 ):
@@ -280,25 +301,25 @@ async def auth_google(
             detail="State is empty",
         )
 
-    tokens = google_get_tokens_from_code(auth.code)
-    access_token = tokens["access_token"]
-    refresh_token = tokens["refresh_token"]
-    enc_refresh_token = google_encode_refresh_token(refresh_token)
+    tokens = await google_get_tokens_from_code(auth.code)
+    # Google only returns a refresh token the first time a user consents
+    enc_refresh_token = google_encode_refresh_token(tokens["refresh_token"]) if tokens["refresh_token"] else None
 
-    user_info = google_get_user_info_from_access_token(access_token)
-    db_user = google_get_user_from_user_info(session, user_info)
+    user_info = await google_verify_id_token(tokens["id_token"], tokens["access_token"])
+    db_user = await google_get_user_from_user_info(session, user_info)
 
     if not db_user and auth.state == "signup":
         db_user = User(
             profile_picture=user_info["picture"],
             email=user_info["email"],
-            username=generate_username_from_email(session, user_info["email"]),
+            username=await generate_username_from_email(session, user_info["email"]),
             fullname=user_info["name"],
-            refresh_token=enc_refresh_token,
             provider=provider,
         )
+        session.add(db_user)
+        await session.flush()
     elif db_user and auth.state == "login":
-        db_user.refresh_token = enc_refresh_token
+        await delete_user_sessions(session, db_user, expired_only=True)
     elif db_user and auth.state == "signup":
         raise HTTPException(
             status_code=400,
@@ -312,11 +333,11 @@ async def auth_google(
     else:  # shouldn't happen
         raise CREDENTIALS_EXCEPTION
 
-    session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
+    refresh_token = create_user_session(session, db_user, provider, request, enc_refresh_token)
+    await session.commit()
 
-    set_auth_cookies(response, access_token, enc_refresh_token, provider)
+    access_token = create_token(data={"email": db_user.email, "provider": provider}, expires_delta=ACCESS_TOKEN_EXPIRES)
+    set_auth_cookies(response, access_token, refresh_token, provider)
     return UserRead.model_validate(db_user)
 
 
@@ -324,7 +345,7 @@ async def auth_google(
 @router.post("/token/refresh", response_model=UserRead)
 async def refresh_token(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     response: Response,
     access_token: Optional[str] = Cookie(default=None),
     refresh_token: Optional[str] = Cookie(default=None),
@@ -350,7 +371,7 @@ async def refresh_token(
     try:
         if not access_token:
             raise CREDENTIALS_EXCEPTION
-        user = get_user_from_token(session, provider, access_token)
+        user = await get_user_from_token(session, provider, access_token, columns=USER_READ_COLUMNS)
         if user:
             return UserRead.model_validate(user)
     except HTTPException:
@@ -359,19 +380,29 @@ async def refresh_token(
     # If not, check if refresh token is valid
     if not refresh_token:
         raise CREDENTIALS_EXCEPTION
-    user = get_user_from_token(session, provider, refresh_token)
-    if not user or user.refresh_token != refresh_token:
+    result = await get_user_session(session, refresh_token)
+    if result is None:
         raise CREDENTIALS_EXCEPTION
-
-    # If valid, create new access token
-    if provider == "template":
-        access_token = create_token(data={"email": user.email}, expires_delta=ACCESS_TOKEN_EXPIRES)
-    elif provider == "google":
-        dec_refresh_token = google_decode_refresh_token(refresh_token)
-        access_token = google_get_new_access_token(dec_refresh_token)
-    else:
+    user_session, user = result
+    if user_session.provider != provider:
         raise CREDENTIALS_EXCEPTION
 
+    data = {"email": user.email}
+    if provider == "google":
+        data["provider"] = provider
+        if user_session.provider_refresh_token:
+            # Refreshing is when a grant revoked at Google stops working, since sessions are verified locally
+            dec_refresh_token = google_decode_refresh_token(user_session.provider_refresh_token)
+            tokens = await google_get_tokens_from_refresh_token(dec_refresh_token)
+            user_info = await google_verify_id_token(tokens["id_token"], tokens["access_token"])
+            if user_info["email"] != user.email:
+                raise CREDENTIALS_EXCEPTION
+
+    # If valid, create new access token and rotate refresh token
+    access_token = create_token(data=data, expires_delta=ACCESS_TOKEN_EXPIRES)
+    refresh_token = rotate_user_session(session, user_session)
+    await session.commit()
+
     set_auth_cookies(response, access_token, refresh_token, provider)
     return UserRead.model_validate(user)
 
@@ -379,11 +410,10 @@ async def refresh_token(
 @router.post("/token/logout", response_model=dict[str, str])
 async def logout(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     response: Response,
     access_token: Optional[str] = Cookie(default=None),
     refresh_token: Optional[str] = Cookie(default=None),
-    provider: Optional[str] = Cookie(default=None),
 ):
     """Logout.
 
@@ -397,44 +427,31 @@ async def logout(
         Access token
     refresh_token
         Refresh token
-    provider
-        Provider
 
     Returns
     -------
     dict[str, str]
         Message
     """
-    # Try to remove refresh token from database
-    if provider:
-        # Try to get user from access token
-        try:
-            if not access_token:
-                raise CREDENTIALS_EXCEPTION
-            user = get_user_from_token(session, provider, access_token)
-            user.refresh_token = None
-            session.add(user)
-            session.commit()
-        except HTTPException:  # If not, try to get user from refresh token
-            try:
-                if not refresh_token:
-                    raise CREDENTIALS_EXCEPTION
-                user = get_user_from_token(session, provider, refresh_token)
-                user.refresh_token = None
-                session.add(user)
-                session.commit()
-            except HTTPException:
-                pass
+    # Remove this device's session, leaving other devices signed in, and stop its access token working at once
+    user_uid = None
+    if access_token:
+        await revoke_token(session, access_token)
+    if refresh_token:
+        user_uid = await delete_user_session(session, refresh_token)
+    await session.commit()
+    if user_uid:
+        invalidate_principal(user_uid)
 
     delete_auth_cookies(response)
     return {"message": "Logout successful"}
 
 
 # Native password recovery
-@router.post("/forgot-password", response_model=dict[str, str])
+@router.post("/forgot-password", response_model=dict[str, str], dependencies=[Depends(RateLimit("forgot-password"))])
 async def forgot_password(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     user: UserUpdate,
 ):
     """Forgot password.
@@ -455,9 +472,9 @@ async def forgot_password(
     db_user = UserUpdate.model_validate(user)
 
     if db_user.email:
-        verified_user = get_user(session, disabled=False, provider=provider, email=db_user.email)
+        verified_user = await get_user(session, disabled=False, provider=provider, email=db_user.email)
     elif db_user.username:
-        verified_user = get_user(session, disabled=False, provider=provider, username=db_user.username)
+        verified_user = await get_user(session, disabled=False, provider=provider, username=db_user.username)
     else:
         raise HTTPException(
             status_code=400,
@@ -465,32 +482,17 @@ async def forgot_password(
         )
 
     if verified_user:
-        recovery_code = AuthCode(
-            email=verified_user.email,
-            request_type="recovery",
-            expire_date=datetime.utcnow() + RECOVERY_CODE_EXPIRES,
-        )
-        session.add(recovery_code)
-        session.commit()
-
-        body = f"""
-**You've requested a password reset.**
-
-Head back to the website and enter the following code to continue:
-
-**{recovery_code.code}**
-
-If you did not request this code, please ignore this email.
-        """
-        send_email(verified_user.email, subject="Password Recovery", body=body)
+        code = await create_code(session, verified_user.email, "recovery", RECOVERY_CODE_EXPIRES)
+        queue_email(session, verified_user.email, "recovery", code)
+        await session.commit()
 
     return {"message": "If the email exists, you will receive a recovery email shortly."}
 
 
-@router.post("/check-code", response_model=dict[str, str])
+@router.post("/check-code", response_model=dict[str, str], dependencies=[Depends(RateLimit("check-code"))])
 async def check_code(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     user: UserUpdate,
 ):
     """Check code.
@@ -511,16 +513,16 @@ async def check_code(
     db_user = UserUpdate.model_validate(user)
 
     if db_user.email:
-        verified_user = get_user(session, disabled=False, provider=provider, email=db_user.email)
+        verified_user = await get_user(session, disabled=False, provider=provider, email=db_user.email)
     elif db_user.username:
-        verified_user = get_user(session, disabled=False, provider=provider, username=db_user.username)
+        verified_user = await get_user(session, disabled=False, provider=provider, username=db_user.username)
     else:
         raise HTTPException(
             status_code=400,
             detail="Username or email is empty",
         )
 
-    verify_code(session, db_user.code, verified_user.email, "recovery")
+    await verify_code(session, db_user.code, verified_user.email, "recovery")
 
     return {"message": "Code is valid"}
 
@@ -528,7 +530,7 @@ async def check_code(
 @router.post("/reset-password", response_class=RedirectResponse)
 async def reset_password(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     user: UserUpdate,
 ):
     """Reset password.
@@ -550,9 +552,9 @@ async def reset_password(
     db_user = UserUpdate.model_validate(user)
 
     if db_user.email:
-        verified_user = get_user(session, disabled=False, provider=provider, email=db_user.email)
+        verified_user = await get_user(session, disabled=False, provider=provider, email=db_user.email)
     elif db_user.username:
-        verified_user = get_user(session, disabled=False, provider=provider, username=db_user.username)
+        verified_user = await get_user(session, disabled=False, provider=provider, username=db_user.username)
     else:
         raise HTTPException(
             status_code=400,
@@ -566,9 +568,9 @@ async def reset_password(
     if db_user.password != db_user.confirm_password:
         raise HTTPException(status_code=400, detail="Passwords do not match")
 
-    verified_user.hashed_password = get_password_hash(db_user.password)
+    verified_user.hashed_password = await get_password_hash(db_user.password)
     session.add(verified_user)
-    session.commit()
+    await session.commit()
 
     response = set_redirect_fe(response, "/login")
     return response
@@ -578,8 +580,8 @@ async def reset_password(
 @router.post("/verify-email/update", response_model=dict[str, str])
 async def verify_email_update(
     *,
-    current_user: Annotated[User, Depends(get_current_active_user)],
-    session: Session = Depends(get_session),
+    current_user: Annotated[User, Depends(get_current_principal)],
+    session: AsyncSession = Depends(get_session),
     provider: Optional[str] = Cookie(default=None),
     user: UserUpdate,
 ):
@@ -614,26 +616,11 @@ async def verify_email_update(
             detail="Email is the same",
         )
 
-    user_exists = get_user(session, email=db_user.email)
+    user_exists = await get_user(session, email=db_user.email)
     if not user_exists:
-        verify_code = AuthCode(
-            email=db_user.email,
-            request_type="verify",
-            expire_date=datetime.utcnow() + VERIFY_CODE_EXPIRES,
-        )
-        session.add(verify_code)
-        session.commit()
-
-        body = f"""
-**You've requested to update your email.**
-
-Head back to the website and enter the following code to continue:
-
-**{verify_code.code}**
-
-If you did not request this code, please ignore this email.
-        """
-        send_email(db_user.email, subject="Verify Email", body=body)
+        code = await create_code(session, db_user.email, "verify", VERIFY_CODE_EXPIRES)
+        queue_email(session, db_user.email, "email-change", code)
+        await session.commit()
 
     return {"message": "If the email exists, you will receive a verification email shortly."}
 
@@ -642,7 +629,7 @@ If you did not request this code, please ignore this email.
 async def update_email(
     *,
     current_user: Annotated[User, Depends(get_current_active_user)],
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     response: Response,
     user: UserUpdate,
 ):
@@ -659,12 +646,14 @@ async def update_email(
         Message
     """
     db_user = UserUpdate.model_validate(user)
-    verify_code(session, db_user.code, db_user.email, "verify")
+    await verify_code(session, db_user.code, db_user.email, "verify")
 
+    current_user = await get_user_for_update(session, current_user)
     current_user.email = db_user.email
     session.add(current_user)
-    session.commit()
-    session.refresh(current_user)
+    await session.commit()
+    await session.refresh(current_user)
+    invalidate_principal(current_user.uid)
 
     access_token = create_token(data={"email": db_user.email}, expires_delta=ACCESS_TOKEN_EXPIRES)
     set_auth_cookies(response, access_token)
@@ -691,7 +680,7 @@ async def read_user(
 async def update_user(
     *,
     current_user: Annotated[User, Depends(get_current_active_user)],
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     new_user: UserUpdate,
 ):
     """Update user with new field(s).
@@ -713,13 +702,52 @@ async def update_user(
         token_type and uid
     """
     user_data = new_user.model_dump(exclude_unset=True)
-    verify_user_update(session, current_user, user_data)
+    await verify_user_update(session, current_user, user_data)
+    if "profile_picture" in user_data:
+        user_data["profile_picture"] = await store_profile_picture(user_data["profile_picture"])
 
+    current_user = await get_user_for_update(session, current_user)
     for key, value in user_data.items():
         setattr(current_user, key, value)
     session.add(current_user)
-    session.commit()
-    session.refresh(current_user)
+    await session.commit()
+    await session.refresh(current_user)
+    invalidate_principal(current_user.uid)
+
+    return UserRead.model_validate(current_user)
+
+
+@router.post("/user/picture", response_model=UserRead)
+async def upload_profile_picture(
+    *,
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    session: AsyncSession = Depends(get_session),
+    picture: UploadFile,
+):
+    """Upload profile picture as multipart form data.
+
+    Parameters
+    ----------
+    session
+        Database session
+    current_user
+        Current user
+    picture
+        Picture file
+
+    Returns
+    -------
+    UserRead
+        User
+    """
+    # Read one byte past the limit so oversized uploads are rejected without buffering them
+    profile_picture = await store_picture(await picture.read(PICTURE_MAX_BYTES + 1))
+    current_user = await get_user_for_update(session, current_user)
+    current_user.profile_picture = profile_picture
+    session.add(current_user)
+    await session.commit()
+    await session.refresh(current_user)
+    invalidate_principal(current_user.uid)
 
     return UserRead.model_validate(current_user)
 
@@ -727,11 +755,15 @@ async def update_user(
 @router.delete("/user/delete", response_model=dict[str, str])
 async def delete_user(
     *,
-    session: Session = Depends(get_session),
-    current_user: Annotated[User, Depends(get_current_active_user)],
+    session: AsyncSession = Depends(get_session),
+    current_user: Annotated[User, Depends(get_current_principal)],
 ) -> dict[str, str]:
-    session.delete(current_user)
-    session.commit()
+    await delete_user_links(session, current_user)
+    await delete_user_sessions(session, current_user)
+    await invalidate_friend_suggestions(session, current_user.uid)
+    await session.delete(await get_user_for_update(session, current_user))
+    await session.commit()
+    invalidate_principal(current_user.uid)
     return {"message": "User deleted"}
 
 
@@ -739,7 +771,7 @@ async def delete_user(
 @router.post("/friends/send-request", response_model=UserRead)
 async def send_friend_request(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     current_user: Annotated[User, Depends(get_current_active_user)],
     friend: UserReference,
 ):
@@ -749,19 +781,20 @@ async def send_friend_request(
     if current_user.username == db_friend.username:
         raise HTTPException(status_code=400, detail="Cannot send request to yourself")
 
-    friend = get_user(session, disabled=False, username=db_friend.username)
+    friend = await get_user(session, disabled=False, username=db_friend.username)
     if friend:
-        if friend in get_sent_friend_requests(current_user):
+        relationship = await get_relationship(session, current_user, friend)
+        if relationship == RELATIONSHIP_PENDING_OUT:
             raise HTTPException(status_code=400, detail="Friend request already sent")
-        if friend in get_incoming_friend_requests(current_user):
+        if relationship == RELATIONSHIP_PENDING_IN:
             raise HTTPException(status_code=400, detail="Friend request already received")
-        if friend in get_friends(current_user):
+        if relationship == RELATIONSHIP_FRIENDS:
             raise HTTPException(status_code=400, detail="Friend already added")
 
-        new_friend_request = FriendRequest(sender=current_user, receiver=friend)
+        new_friend_request = FriendRequest(user_uid=current_user.uid, friend_uid=friend.uid)
         session.add(new_friend_request)
-        session.commit()
-        session.refresh(new_friend_request)
+        await invalidate_friend_suggestions(session, current_user.uid, friend.uid)
+        await session.commit()
         return UserRead.model_validate(current_user)
     else:
         raise HTTPException(status_code=404, detail="Friend not found")
@@ -770,7 +803,7 @@ async def send_friend_request(
 @router.post("/friends/revert-request", response_model=UserRead)
 async def revert_friend_request(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     current_user: Annotated[User, Depends(get_current_active_user)],
     friend: UserReference,
 ):
@@ -780,22 +813,24 @@ async def revert_friend_request(
     if current_user.username == db_friend.username:
         raise HTTPException(status_code=400, detail="Cannot send request to yourself")
 
-    friend = get_user(session, disabled=False, username=db_friend.username)
+    friend = await get_user(session, disabled=False, username=db_friend.username)
     if friend:
-        friend_request_links = get_sent_friend_request_links(current_user)
-        friend_requests = get_sent_friend_requests(current_user)
-        if friend not in friend_requests:
-            raise HTTPException(status_code=400, detail="Friend request not found")
-        if friend in get_friends(current_user):
+        relationship = await get_relationship(session, current_user, friend)
+        if relationship == RELATIONSHIP_FRIENDS:
             raise HTTPException(status_code=400, detail="Friend already added")
+        if relationship != RELATIONSHIP_PENDING_OUT:
+            raise HTTPException(status_code=400, detail="Friend request not found")
 
-        for delete_request, delete_request_link in zip(friend_requests, friend_request_links, strict=False):
-            if delete_request.username == friend.username:
-                delete_request_link.status = "reverted"
-                session.add(current_user)
-                session.commit()
-                session.refresh(current_user)
-                return UserRead.model_validate(current_user)
+        await session.exec(
+            update(FriendRequest)
+            .where(FriendRequest.user_uid == current_user.uid)
+            .where(FriendRequest.friend_uid == friend.uid)
+            .where(FriendRequest.status == "pending")
+            .values(status="reverted")
+        )
+        await invalidate_friend_suggestions(session, current_user.uid, friend.uid)
+        await session.commit()
+        return UserRead.model_validate(current_user)
     else:
         raise HTTPException(status_code=404, detail="Friend not found")
 
@@ -803,7 +838,7 @@ async def revert_friend_request(
 @router.post("/friends/accept-request", response_model=UserRead)
 async def accept_friend_request(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     current_user: Annotated[User, Depends(get_current_active_user)],
     friend: UserReference,
 ):
@@ -813,24 +848,31 @@ async def accept_friend_request(
     if current_user.username == db_friend.username:
         raise HTTPException(status_code=400, detail="Cannot accept request from yourself")
 
-    friend = get_user(session, disabled=False, username=db_friend.username)
+    friend = await get_user(session, disabled=False, username=db_friend.username)
     if friend:
-        friend_request_links = get_incoming_friend_request_links(current_user)
-        friend_requests = get_incoming_friend_requests(current_user)
-        if friend not in friend_requests:
-            raise HTTPException(status_code=400, detail="Friend request not sent")
-        if friend in get_friends(current_user):
+        relationship = await get_relationship(session, current_user, friend)
+        if relationship == RELATIONSHIP_FRIENDS:
             raise HTTPException(status_code=400, detail="Friend already added")
+        if relationship != RELATIONSHIP_PENDING_IN:
+            raise HTTPException(status_code=400, detail="Friend request not sent")
 
-        for friend_request, friend_request_link in zip(friend_requests, friend_request_links, strict=False):
-            if friend_request.username == friend.username:
-                friend_request_link.status = "accepted"
-                new_friend = Friend(friend_1=current_user, friend_2=friend)
-                session.add(current_user)
-                session.add(new_friend)
-                session.commit()
-                session.refresh(current_user)
-                return UserRead.model_validate(current_user)
+        await session.exec(
+            update(FriendRequest)
+            .where(FriendRequest.user_uid == friend.uid)
+            .where(FriendRequest.friend_uid == current_user.uid)
+            .where(FriendRequest.status == "pending")
+            .values(status="accepted")
+        )
+        low_uid, high_uid = get_friend_edge(current_user.uid, friend.uid)
+        session.add(Friend(user_uid=low_uid, friend_uid=high_uid))
+        try:
+            await invalidate_friend_suggestions(session, current_user.uid, friend.uid)
+            await session.commit()
+        except IntegrityError:
+            # A concurrent accept confirmed the same edge after the relationship was read
+            await session.rollback()
+            raise HTTPException(status_code=400, detail="Friend already added") from None
+        return UserRead.model_validate(current_user)
     else:
         raise HTTPException(status_code=404, detail="Friend not found")
 
@@ -838,7 +880,7 @@ async def accept_friend_request(
 @router.post("/friends/decline-request", response_model=UserRead)
 async def decline_friend_request(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     current_user: Annotated[User, Depends(get_current_active_user)],
     friend: UserReference,
 ):
@@ -848,92 +890,125 @@ async def decline_friend_request(
     if current_user.username == db_friend.username:
         raise HTTPException(status_code=400, detail="Cannot decline request from yourself")
 
-    friend = get_user(session, disabled=False, username=db_friend.username)
+    friend = await get_user(session, disabled=False, username=db_friend.username)
     if friend:
-        friend_request_links = get_incoming_friend_request_links(current_user)
-        friend_requests = get_incoming_friend_requests(current_user)
-        if friend not in friend_requests:
-            raise HTTPException(status_code=400, detail="Friend request not sent")
-        if friend in get_friends(current_user):
+        relationship = await get_relationship(session, current_user, friend)
+        if relationship == RELATIONSHIP_FRIENDS:
             raise HTTPException(status_code=400, detail="Friend already added")
+        if relationship != RELATIONSHIP_PENDING_IN:
+            raise HTTPException(status_code=400, detail="Friend request not sent")
 
-        for friend_request, friend_request_link in zip(friend_requests, friend_request_links, strict=False):
-            if friend_request.username == friend.username:
-                friend_request_link.status = "declined"
-                session.add(current_user)
-                session.commit()
-                session.refresh(current_user)
-                return UserRead.model_validate(current_user)
+        await session.exec(
+            update(FriendRequest)
+            .where(FriendRequest.user_uid == friend.uid)
+            .where(FriendRequest.friend_uid == current_user.uid)
+            .where(FriendRequest.status == "pending")
+            .values(status="declined")
+        )
+        await invalidate_friend_suggestions(session, current_user.uid, friend.uid)
+        await session.commit()
+        return UserRead.model_validate(current_user)
     else:
         raise HTTPException(status_code=404, detail="Friend not found")
 
 
+# User search
+@router.get("/users/search", response_model=List[UserSearchRead])
+async def search_users(
+    *,
+    session: AsyncSession = Depends(get_session),
+    response: Response,
+    current_user: Annotated[User, Depends(get_current_principal)],
+    q: Annotated[str, Query(min_length=1, max_length=SEARCH_MAX_LENGTH)],
+    page: Annotated[Page, Depends(get_search_page)],
+):
+    """Search enabled users by username and full name, as they are typed.
+
+    Usernames starting with the query come first, then full names starting with it, then fuzzy matches.
+
+    Parameters
+    ----------
+    q : str
+        Query, case insensitive
+
+    Returns
+    -------
+    List[UserSearchRead]
+        Matching users, with X-Next-Cursor pointing to the next page if there is one
+    """
+    rows = await get_user_search().search(session, q, page)
+    rows = paginate(response, page, rows)
+    return [UserSearchRead.model_construct(**row._asdict()) for row in rows]
+
+
 @router.get("/friends/requests/sent", response_model=List[FriendRequestRead])
 async def read_sent_friend_requests(
     *,
-    current_user: Annotated[User, Depends(get_current_active_user)],
+    session: AsyncSession = Depends(get_session),
+    response: Response,
+    current_user: Annotated[User, Depends(get_current_principal)],
+    page: Annotated[Page, Depends(get_page)],
 ):
-    friend_request_links = get_sent_friend_request_links(current_user)
-    friend_requests = get_sent_friend_requests(current_user)
-    friend_requests = [
-        FriendRequestRead(
-            uid=friend_request.uid,
-            join_date=friend_request.join_date,
-            profile_picture=friend_request.profile_picture,
-            username=friend_request.username,
-            request_date=link.request_date,
-        )
-        for friend_request, link in zip(friend_requests, friend_request_links, strict=False)
-    ]
-    return friend_requests
+    rows = await get_sent_friend_requests(session, current_user, page)
+    # Rows hold exactly the response's fields, so skip validating them again
+    friend_requests = [FriendRequestRead.model_construct(**row._mapping) for row in rows]
+    return paginate(response, page, friend_requests, "request_date")
 
 
 @router.get("/friends/requests/incoming", response_model=List[FriendRequestRead])
 async def read_incoming_friend_requests(
     *,
-    current_user: Annotated[User, Depends(get_current_active_user)],
+    session: AsyncSession = Depends(get_session),
+    response: Response,
+    current_user: Annotated[User, Depends(get_current_principal)],
+    page: Annotated[Page, Depends(get_page)],
 ):
-    friend_request_links = get_incoming_friend_request_links(current_user)
-    friend_requests = get_incoming_friend_requests(current_user)
-    friend_requests = [
-        FriendRequestRead(
-            uid=friend_request.uid,
-            join_date=friend_request.join_date,
-            profile_picture=friend_request.profile_picture,
-            username=friend_request.username,
-            status=link.status,
-            request_date=link.request_date,
-        )
-        for friend_request, link in zip(friend_requests, friend_request_links, strict=False)
-    ]
-    return friend_requests
+    rows = await get_incoming_friend_requests(session, current_user, page)
+    friend_requests = [FriendRequestRead.model_construct(**row._mapping) for row in rows]
+    return paginate(response, page, friend_requests, "request_date")
 
 
 # Friend management
 @router.get("/friends/", response_model=List[FriendRead])
 async def read_friends(
     *,
-    current_user: Annotated[User, Depends(get_current_active_user)],
+    session: AsyncSession = Depends(get_session),
+    response: Response,
+    current_user: Annotated[User, Depends(get_current_principal)],
+    page: Annotated[Page, Depends(get_page)],
 ):
-    friend_links = get_friend_links(current_user)
-    friends = get_friends(current_user)
-    friends = [
-        FriendRead(
-            uid=friend.uid,
-            join_date=friend.join_date,
-            profile_picture=friend.profile_picture,
-            username=friend.username,
-            friendship_date=link.friendship_date,
-        )
-        for friend, link in zip(friends, friend_links, strict=False)
-    ]
-    return friends
+    rows = await get_friends(session, current_user, page)
+    friends = [FriendRead.model_construct(**row._mapping) for row in rows]
+    return paginate(response, page, friends, "friendship_date")
+
+
+@router.get("/friends/suggestions", response_model=List[FriendSuggestionRead])
+async def read_friend_suggestions(
+    *,
+    session: AsyncSession = Depends(get_session),
+    current_user: Annotated[User, Depends(get_current_principal)],
+    limit: int = Query(default=FRIEND_SUGGESTIONS_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    """Suggest friends of friends, most mutual friends first.
+
+    Parameters
+    ----------
+    limit : int
+        Suggestions
+
+    Returns
+    -------
+    List[FriendSuggestionRead]
+        Suggestions, cached per user until their friendships change
+    """
+    rows = await get_cached_friend_suggestions(session, current_user, limit)
+    return [FriendSuggestionRead.model_construct(**row._mapping) for row in rows]
 
 
 @router.post("/friends/delete", response_model=UserRead)
 async def delete_friend(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     current_user: Annotated[User, Depends(get_current_active_user)],
     friend: UserReference,
 ):
@@ -943,19 +1018,94 @@ async def delete_friend(
     if current_user.username == db_friend.username:
         raise HTTPException(status_code=400, detail="Cannot delete yourself as a friend")
 
-    friend = get_user(session, disabled=False, username=db_friend.username)
+    friend = await get_user(session, disabled=False, username=db_friend.username)
     if friend:
-        friend_links = get_friend_links(current_user)
-        friends = get_friends(current_user)
-        if friend not in friends:
+        if await get_relationship(session, current_user, friend) != RELATIONSHIP_FRIENDS:
             raise HTTPException(status_code=400, detail="Friend not added")
 
-        for delete_friend, delete_friend_link in zip(friends, friend_links, strict=False):
-            if delete_friend.username == friend.username:
-                delete_friend_link.status = "deleted"
-                session.add(current_user)
-                session.commit()
-                session.refresh(current_user)
-                return UserRead.model_validate(current_user)
+        low_uid, high_uid = get_friend_edge(current_user.uid, friend.uid)
+        await session.exec(
+            update(Friend)
+            .where(Friend.user_uid == low_uid)
+            .where(Friend.friend_uid == high_uid)
+            .where(Friend.status == "confirmed")
+            .values(status="deleted")
+        )
+        await invalidate_friend_suggestions(session, current_user.uid, friend.uid)
+        await session.commit()
+        return UserRead.model_validate(current_user)
     else:
         raise HTTPException(status_code=404, detail="Friend not found")
+
+
+@router.post("/friends/bulk", response_model=List[FriendBulkResult])
+async def bulk_friend_action(
+    *,
+    session: AsyncSession = Depends(get_session),
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    bulk: FriendBulkAction,
+):
+    """Apply one friend action to many users in a single transaction.
+
+    Parameters
+    ----------
+    session : AsyncSession
+        Session
+    current_user : User
+        Current user
+    bulk : FriendBulkAction
+        Action and usernames
+
+    Returns
+    -------
+    List[FriendBulkResult]
+        Result per username, in request order
+
+    Raises
+    ------
+    HTTPException
+        If there are no usernames or too many
+    """
+    usernames = list(dict.fromkeys(bulk.usernames))
+    if not usernames:
+        raise HTTPException(status_code=400, detail="Usernames are empty")
+    if len(usernames) > MAX_BULK_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_SIZE} usernames per request")
+
+    # One query resolves every target and one more reads every relationship, however many usernames there are
+    friends = {
+        row.username: row.uid
+        for row in (
+            await session.exec(
+                select(User.username, User.uid).where(User.username.in_(usernames)).where(User.disabled.is_(False))
+            )
+        ).all()
+    }
+    relationships = await get_relationships(session, current_user, list(friends.values()))
+
+    results, uids = [], []
+    for username in usernames:
+        if username == current_user.username:
+            results.append(FriendBulkResult(username=username, status_code=400, detail="Cannot do this to yourself"))
+        elif username not in friends:
+            results.append(FriendBulkResult(username=username, status_code=404, detail="Friend not found"))
+        elif error := check_friend_action(bulk.action, relationships[friends[username]]):
+            results.append(FriendBulkResult(username=username, status_code=400, detail=error))
+        else:
+            results.append(
+                FriendBulkResult(username=username, status_code=200, detail=FRIEND_ACTION_MESSAGES[bulk.action])
+            )
+            uids.append(friends[username])
+    if not uids:
+        return results
+
+    try:
+        await apply_friend_action(session, current_user, bulk.action, uids)
+        await invalidate_friend_suggestions(session, current_user.uid, *uids)
+        await session.commit()
+    except IntegrityError:
+        # A concurrent accept confirmed one of the edges after the relationships were read, so start over: that user
+        # now gets "Friend already added" and the rest are applied
+        await session.rollback()
+        return await bulk_friend_action(session=session, current_user=current_user, bulk=bulk)
+    return results
@@ -0,0 +1,93 @@
+"""Measure bytes of user row transferred per authenticated request, full row vs. deferred columns.
+
+Run from the backend directory, e.g. `python benchmarks/auth_bytes.py --email <your email here>` against the configured
+database, or `python benchmarks/auth_bytes.py --seed` against a throwaway SQLite database with a sample user.
+"""
+
+import argparse
+import asyncio
+import base64
+import os
+from datetime import datetime
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.database import engine as app_engine
+from app.dependencies.passwords import hash_password
+from app.dependencies.users import PRINCIPAL_COLUMNS, USER_READ_COLUMNS
+from app.models.users import User
+
+
+def get_value_size(value) -> int:
+    # Approximate the Postgres wire size of each value, as sent in asyncpg's binary format
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, UUID):
+        return 16
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float, datetime)):
+        return 8
+    return len(str(value).encode())
+
+
+async def seed(engine, picture_bytes: int) -> str:
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    picture = "data:image/jpeg;base64," + base64.b64encode(os.urandom(picture_bytes)).decode()
+    async with AsyncSession(engine) as session:
+        session.add(
+            User(
+                username="benchmark",
+                email="benchmark@example.com",
+                fullname="Benchmark User",
+                profile_picture=picture,
+                hashed_password=hash_password("benchmark"),
+            )
+        )
+        await session.commit()
+    return "benchmark@example.com"
+
+
+async def measure(engine, email: str, columns: tuple) -> int:
+    async with engine.connect() as conn:
+        row = (await conn.execute(select(*columns).where(User.email == email))).one()
+    return sum(get_value_size(value) for value in row)
+
+
+async def run(args):
+    engine = app_engine
+    email = args.email
+    if args.seed:
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        email = await seed(engine, args.picture_bytes)
+
+    full = await measure(engine, email, tuple(User.__table__.columns))
+    user_read = await measure(engine, email, USER_READ_COLUMNS)
+    principal = await measure(engine, email, PRINCIPAL_COLUMNS)
+    await engine.dispose()
+
+    print(f"full row:     {full} bytes")
+    print(f"user read:    {user_read} bytes ({user_read / full:.1%})")
+    print(f"principal:    {principal} bytes ({principal / full:.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--email")
+    parser.add_argument("--seed", action="store_true")
+    parser.add_argument("--picture-bytes", type=int, default=64 * 1024)
+    args = parser.parse_args()
+    if not args.email and not args.seed:
+        parser.error("one of --email or --seed is required")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Benchmark requests per second for a single API worker under concurrent load.
+
+Start one worker (e.g. `gunicorn app.main:app --workers 1 --worker-class uvicorn.workers.UvicornWorker`)
+against a seeded database, then run this script once per build to compare:
+
+    python benchmarks/concurrency.py --api-key $API_KEY --email bench@example.com --password secret
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def worker(client: httpx.AsyncClient, route: str, n_requests: int, latencies: list[float]) -> int:
+    errors = 0
+    for _ in range(n_requests):
+        start = time.perf_counter()
+        response = await client.get(route)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            errors += 1
+    return errors
+
+
+async def run(args: argparse.Namespace) -> None:
+    headers = {"X-API-Key": args.api_key}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, headers=headers, limits=limits) as client:
+        response = await client.post("/token/login", json={"email": args.email, "password": args.password})
+        response.raise_for_status()
+        client.cookies.set("access_token", response.cookies["access_token"])
+        client.cookies.set("provider", response.cookies["provider"])
+
+        per_worker = args.requests // args.concurrency
+        latencies: list[float] = []
+        start = time.perf_counter()
+        errors = await asyncio.gather(
+            *(worker(client, args.route, per_worker, latencies) for _ in range(args.concurrency))
+        )
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    total = per_worker * args.concurrency
+    print(f"route:        {args.route}")
+    print(f"concurrency:  {args.concurrency}")
+    print(f"requests:     {total} ({sum(errors)} errors)")
+    print(f"rps/worker:   {total / elapsed:.1f}")
+    print(f"p50 latency:  {statistics.median(latencies) * 1000:.1f} ms")
+    print(f"p99 latency:  {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--api-key", required=True)
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--route", default="/user/")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=6400)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Benchmark email throughput against a local SMTP sink.
+
+Compares the pooled transport sending precompiled templates with the old approach of rendering Markdown and opening a
+new connection per email. Run from the backend directory, e.g. `python benchmarks/emails.py --emails 500 --latency 5`.
+"""
+
+import argparse
+import asyncio
+import smtplib
+import socket
+import time
+
+from aiosmtpd.controller import Controller
+from markdown import markdown
+
+from app.dependencies.emails import TEMPLATES
+from app.dependencies.outbox import SMTPPool, build_message
+
+BODY = """
+**You've requested a password reset.**
+
+Head back to the website and enter the following code to continue:
+
+**{code}**
+
+If you did not request this code, please ignore this email.
+"""
+
+
+class Sink:
+    """SMTP handler that accepts every message after a fixed delay."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):  # noqa: N802
+        await asyncio.sleep(self.latency)
+        self.received += 1
+        return "250 OK"
+
+
+def start_sink(latency: float) -> tuple[Controller, Sink]:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    sink = Sink(latency)
+    controller = Controller(sink, hostname="127.0.0.1", port=port)
+    controller.start()
+    return controller, sink
+
+
+def unpooled_send(host: str, port: int, email: str, code: str) -> None:
+    body = BODY.format(code=code)
+    with smtplib.SMTP(host, port) as smtp:
+        smtp.ehlo()
+        smtp.send_message(build_message(email, "Password Recovery", body, markdown(body)), from_addr="")
+
+
+async def run_unpooled(host: str, port: int, emails: int) -> None:
+    for i in range(emails):
+        await asyncio.to_thread(unpooled_send, host, port, f"user{i}@example.com", f"{i:06x}")
+
+
+async def run_pooled(pool: SMTPPool, emails: int) -> None:
+    template = TEMPLATES["recovery"]
+
+    def send(i: int) -> None:
+        text, html = template.render(f"{i:06x}")
+        pool.send(build_message(f"user{i}@example.com", template.subject, text, html))
+
+    await asyncio.gather(*(asyncio.to_thread(send, i) for i in range(emails)))
+
+
+async def main_async(args):
+    controller, sink = start_sink(args.latency / 1000)
+    host, port = controller.hostname, controller.port
+    pool = SMTPPool(size=args.pool_size, host=host, port=port, starttls=False, password="")
+    runs = [
+        ("unpooled, rendered per email", lambda: run_unpooled(host, port, args.emails)),
+        (f"pooled ({args.pool_size}), precompiled", lambda: run_pooled(pool, args.emails)),
+    ]
+    for name, run in runs:
+        received = sink.received
+        start = time.perf_counter()
+        await run()
+        elapsed = time.perf_counter() - start
+        print(f"{name}:")
+        print(f"  throughput:   {args.emails / elapsed:.1f} emails/s")
+        print(f"  delivered:    {sink.received - received}")
+    print(f"  connections:  {pool.get_connects()}")
+    pool.close()
+    controller.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--emails", type=int, default=500)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=5, help="sink latency per email in milliseconds")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Benchmark memory and latency of listing friends, ORM objects vs. a single column projection.
+
+Seeds a throwaway SQLite database with one user and their friends, then lists them the old way (full User and Friend
+ORM objects from two queries, zipped into FriendRead) and through the projection the routes use, both for the whole
+list and for one page. Run from the backend directory, e.g. `python benchmarks/friends.py --friends 10000`.
+"""
+
+import argparse
+import asyncio
+import base64
+import os
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, and_, insert, or_, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.dependencies.users import get_friend_edge, get_friends
+from app.models.users import Friend, FriendRead, Page, User
+
+
+async def seed(engine, friends: int, picture_bytes: int) -> User:
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    user = User(username="benchmark", email="benchmark@example.com")
+    # Every user carries a picture and a password hash, as full rows would in production
+    picture = "data:image/jpeg;base64," + base64.b64encode(os.urandom(picture_bytes)).decode()
+    others = [
+        User(username=f"friend{i}", email=f"friend{i}@example.com", profile_picture=picture, hashed_password="x" * 60)
+        for i in range(friends)
+    ]
+    start = datetime(2024, 1, 1)
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        session.add(user)
+        session.add_all(others)
+        await session.commit()
+        await session.exec(
+            insert(Friend),
+            params=[
+                dict(zip(("user_uid", "friend_uid"), get_friend_edge(user.uid, other.uid), strict=True))
+                | {"friendship_date": start + timedelta(minutes=i), "status": "confirmed"}
+                for i, other in enumerate(others)
+            ],
+        )
+        await session.commit()
+    return user
+
+
+async def list_orm(engine, user: User) -> list[FriendRead]:
+    async with AsyncSession(engine) as session:
+        links = (
+            await session.exec(
+                select(Friend)
+                .where(or_(Friend.user_uid == user.uid, Friend.friend_uid == user.uid))
+                .where(Friend.status == "confirmed")
+                .order_by(Friend.id)
+            )
+        ).all()
+        friends = (
+            await session.exec(
+                select(User)
+                .join(
+                    Friend,
+                    or_(
+                        and_(Friend.user_uid == user.uid, Friend.friend_uid == User.uid),
+                        and_(Friend.friend_uid == user.uid, Friend.user_uid == User.uid),
+                    ),
+                )
+                .where(Friend.status == "confirmed")
+                .order_by(Friend.id)
+            )
+        ).all()
+        return [
+            FriendRead(
+                uid=friend.uid,
+                join_date=friend.join_date,
+                profile_picture=friend.profile_picture,
+                username=friend.username,
+                friendship_date=link.friendship_date,
+            )
+            for friend, link in zip(friends, links, strict=True)
+        ]
+
+
+async def list_projection(engine, user: User, limit: int) -> list[FriendRead]:
+    async with AsyncSession(engine) as session:
+        rows = await get_friends(session, user, Page(limit=limit))
+        return [FriendRead.model_construct(**row._mapping) for row in rows]
+
+
+async def measure(name: str, run, repeats: int):
+    await run()  # warm up
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        await run()
+        latencies.append(time.perf_counter() - start)
+    tracemalloc.start()
+    result = await run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name}:")
+    print(f"  rows:         {len(result)}")
+    print(f"  p50 latency:  {statistics.median(latencies) * 1000:.1f} ms")
+    print(f"  peak memory:  {peak / 2**20:.1f} MiB")
+
+
+async def run(args):
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    user = await seed(engine, args.friends, args.picture_bytes)
+    await measure("ORM objects, two queries", lambda: list_orm(engine, user), args.repeats)
+    await measure("projection, whole list", lambda: list_projection(engine, user, args.friends), args.repeats)
+    await measure(f"projection, page of {args.page}", lambda: list_projection(engine, user, args.page), args.repeats)
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--friends", type=int, default=10_000)
+    parser.add_argument("--page", type=int, default=100)
+    parser.add_argument("--picture-bytes", type=int, default=256, help="size of each friend's picture reference")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
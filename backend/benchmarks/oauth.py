@@ -0,0 +1,82 @@
+"""Benchmark concurrent OAuth token exchanges against a local stand-in provider.
+
+Compares the shared pooled client with the old approach of a blocking call and a new connection per exchange.
+Run from the backend directory, e.g. `python benchmarks/oauth.py --logins 200 --rate 100 --latency 50`.
+"""
+
+import argparse
+import asyncio
+import socket
+import statistics
+import threading
+import time
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from app.dependencies.http import close_http_client, http_request
+
+
+def start_provider(latency: float) -> str:
+    async def token(request):
+        await asyncio.sleep(latency)
+        return JSONResponse({"access_token": "access", "refresh_token": "refresh", "id_token": "id"})
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    app = Starlette(routes=[Route("/token", token, methods=["POST"])])
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning", backlog=4096))
+    threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{sock.getsockname()[1]}/token"
+
+
+async def blocking_exchange(url: str) -> None:
+    httpx.post(url, data={"code": "code"}).raise_for_status()
+
+
+async def pooled_exchange(url: str) -> None:
+    (await http_request("POST", url, data={"code": "code"})).raise_for_status()
+
+
+async def run(exchange, url: str, logins: int, rate: float) -> tuple[list[float], float]:
+    # Logins arrive at a fixed rate whether or not earlier ones finished, and latency counts from arrival,
+    # so time spent queued behind a blocked event loop or a busy pool is included
+    start = time.perf_counter()
+
+    async def login(arrival: float) -> float:
+        await asyncio.sleep(max(arrival - time.perf_counter(), 0))
+        await exchange(url)
+        return time.perf_counter() - arrival
+
+    latencies = sorted(await asyncio.gather(*(login(start + i / rate) for i in range(logins))))
+    return latencies, time.perf_counter() - start
+
+
+async def main_async(args):
+    url = start_provider(args.latency / 1000)
+    for name, exchange in [("blocking, unpooled", blocking_exchange), ("async, pooled", pooled_exchange)]:
+        await exchange(url)  # warm up
+        latencies, elapsed = await run(exchange, url, args.logins, args.rate)
+        print(f"{name}:")
+        print(f"  p50 latency:  {statistics.median(latencies) * 1000:.1f} ms")
+        print(f"  p99 latency:  {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms")
+        print(f"  throughput:   {args.logins / elapsed:.1f} logins/s")
+    await close_http_client()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=100, help="logins per second")
+    parser.add_argument("--latency", type=float, default=50, help="provider latency in milliseconds")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Benchmark picture processing latency and throughput for a given process pool size.
+
+Run from the backend directory, e.g. `python benchmarks/pictures.py --workers 2 --images 64 --resolution 2048`.
+"""
+
+import argparse
+import io
+import multiprocessing
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from app.dependencies.pictures import PICTURE_FORMATS, PICTURE_MAX_PIXELS, PICTURE_SIZES, process_picture
+
+
+def make_picture(resolution: int, fmt: str) -> bytes:
+    # Noise defeats run-length tricks in the encoders, like a real photo
+    width, height = resolution, resolution * 3 // 4
+    image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, quality=90)
+    return buffer.getvalue()
+
+
+def timed_process_picture(data: bytes) -> float:
+    start = time.perf_counter()
+    process_picture(data, PICTURE_SIZES, PICTURE_FORMATS, PICTURE_MAX_PIXELS)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--resolution", type=int, default=2048)
+    parser.add_argument("--format", default="JPEG")
+    args = parser.parse_args()
+
+    pictures = [make_picture(args.resolution, args.format) for _ in range(args.images)]
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context) as pool:
+        # Warm up so process start-up is not counted
+        list(pool.map(timed_process_picture, pictures[: args.workers]))
+        start = time.perf_counter()
+        latencies = sorted(pool.map(timed_process_picture, pictures))
+        elapsed = time.perf_counter() - start
+
+    print(f"workers:      {args.workers}")
+    print(f"images:       {args.images} x {args.resolution}px {args.format} -> {PICTURE_SIZES} {PICTURE_FORMATS}")
+    print(f"p50 latency:  {statistics.median(latencies) * 1000:.1f} ms")
+    print(f"p99 latency:  {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms")
+    print(f"throughput:   {args.images / elapsed:.1f} images/s")
+
+
+if __name__ == "__main__":
+    main()
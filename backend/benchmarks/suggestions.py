@@ -0,0 +1,140 @@
+"""Benchmark friend suggestions on a synthetic power-law friendship graph, Python loops vs. one SQL aggregation.
+
+Seeds a throwaway SQLite database with a preferential attachment graph, so a few users have most of the friendships,
+then suggests friends of friends for the best connected user and a median one. The loop follows each friend's links
+in Python, the aggregation is what the route runs, and the cached lookup is what repeat requests cost. Run from the
+backend directory, e.g. `python benchmarks/suggestions.py --users 20000 --edges-per-user 5`.
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, insert, or_, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.dependencies.users import (
+    FRIEND_SUGGESTIONS_CACHE,
+    get_cached_friend_suggestions,
+    get_friend_edge,
+    get_friend_suggestions,
+)
+from app.models.users import Friend, User
+
+
+def generate_edges(users: int, edges_per_user: int, seed: int) -> set[tuple[int, int]]:
+    # Barabasi-Albert: each new user befriends existing ones with probability proportional to their degree
+    rng = random.Random(seed)
+    edges = set()
+    endpoints = list(range(edges_per_user))
+    for user in range(edges_per_user, users):
+        targets = set()
+        while len(targets) < edges_per_user:
+            targets.add(rng.choice(endpoints))
+        for target in targets:
+            edges.add((target, user))
+            endpoints += [target, user]
+    return edges
+
+
+async def seed(engine, users: int, edges_per_user: int, seed: int) -> tuple[list[User], Counter]:
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    others = [User(username=f"user{i}", email=f"user{i}@example.com") for i in range(users)]
+    edges = generate_edges(users, edges_per_user, seed)
+    degrees = Counter(user for edge in edges for user in edge)
+    now = datetime.utcnow()
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        session.add_all(others)
+        await session.commit()
+        await session.exec(
+            insert(Friend),
+            params=[
+                dict(zip(("user_uid", "friend_uid"), get_friend_edge(others[a].uid, others[b].uid), strict=True))
+                | {"friendship_date": now, "status": "confirmed"}
+                for a, b in edges
+            ],
+        )
+        await session.commit()
+    return others, degrees
+
+
+async def suggest_loop(engine, user: User, limit: int) -> list:
+    # The naive way: read each friend's links one friend at a time and count in Python
+    async with AsyncSession(engine) as session:
+
+        async def get_friend_uids(uid):
+            links = (
+                await session.exec(
+                    select(Friend.user_uid, Friend.friend_uid)
+                    .where(or_(Friend.user_uid == uid, Friend.friend_uid == uid))
+                    .where(Friend.status == "confirmed")
+                )
+            ).all()
+            return {low if high == uid else high for low, high in links}
+
+        mine = await get_friend_uids(user.uid)
+        counts = Counter()
+        for friend_uid in mine:
+            counts.update(await get_friend_uids(friend_uid) - mine - {user.uid})
+        return sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+async def suggest_sql(engine, user: User, limit: int) -> list:
+    async with AsyncSession(engine) as session:
+        return await get_friend_suggestions(session, user, limit)
+
+
+async def suggest_cached(engine, user: User, limit: int) -> list:
+    async with AsyncSession(engine) as session:
+        return await get_cached_friend_suggestions(session, user, limit)
+
+
+async def measure(name: str, run, repeats: int):
+    result = await run()  # warm up
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        await run()
+        latencies.append(time.perf_counter() - start)
+    print(f"  {name}:")
+    print(f"    suggestions:  {len(result)}")
+    print(f"    p50 latency:  {statistics.median(latencies) * 1000:.2f} ms")
+
+
+async def run(args):
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    users, degrees = await seed(engine, args.users, args.edges_per_user, args.seed)
+    ranked = [user for user, _ in degrees.most_common()]
+    print(f"{args.users} users, {sum(degrees.values()) // 2} friendships, max degree {degrees[ranked[0]]}")
+    for label, index in [("best connected", ranked[0]), ("median", ranked[len(ranked) // 2])]:
+        user = users[index]
+        print(f"{label} user, {degrees[index]} friends:")
+        await measure(
+            "Python loop over friends", lambda user=user: suggest_loop(engine, user, args.limit), args.repeats
+        )
+        await measure("one SQL aggregation", lambda user=user: suggest_sql(engine, user, args.limit), args.repeats)
+        FRIEND_SUGGESTIONS_CACHE.clear()
+        await measure("cached", lambda user=user: suggest_cached(engine, user, args.limit), args.repeats)
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--edges-per-user", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
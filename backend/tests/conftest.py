@@ -0,0 +1,108 @@
+"""Shared fixtures for the API tests."""
+
+import asyncio
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+os.environ.setdefault("FRONTEND_URL", "https://localhost:3000")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "15")
+os.environ.setdefault("REFRESH_TOKEN_EXPIRE_MINUTES", "60")
+os.environ.setdefault("VERIFY_CODE_EXPIRE_MINUTES", "15")
+os.environ.setdefault("RECOVERY_CODE_EXPIRE_MINUTES", "15")
+os.environ.setdefault("PICTURE_STORAGE_PATH", tempfile.mkdtemp())
+os.environ.setdefault("PASSWORD_BCRYPT_ROUNDS", "4")
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.database import get_session
+from app.dependencies.cache import CACHES
+from app.dependencies.revocation import REVOCATIONS
+from app.dependencies.security import API_KEY
+from app.dependencies.users import ACCESS_TOKEN_EXPIRES, create_token
+from app.main import app
+from app.models.users import AuthCode, User
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # Caches and the revocation filter live in the process, so they would leak between tests' databases
+    for cache in CACHES.values():
+        cache.clear()
+    REVOCATIONS.clear()
+
+
+@pytest.fixture(name="engine")
+def engine_fixture():
+    engine = create_async_engine("sqlite+aiosqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+    async def create_all():
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+
+    asyncio.run(create_all())
+    yield engine
+    asyncio.run(engine.dispose())
+
+
+@pytest.fixture(name="client")
+def client_fixture(engine):
+    async def get_session_override():
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            yield session
+
+    app.dependency_overrides[get_session] = get_session_override
+    # Entering the client runs the lifespan, so shared resources like the HTTP client are closed between tests
+    with TestClient(app, headers={"X-API-Key": API_KEY}) as client:
+        yield client
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture(name="create_user")
+def create_user_fixture(engine):
+    def create_user(username: str, **kwargs) -> User:
+        user = User(username=username, email=f"{username}@example.com", **kwargs)
+
+        async def add():
+            async with AsyncSession(engine, expire_on_commit=False) as session:
+                session.add(user)
+                await session.commit()
+                await session.refresh(user)
+
+        asyncio.run(add())
+        return user
+
+    return create_user
+
+
+@pytest.fixture(name="login")
+def login_fixture(client: TestClient):
+    def login(user: User) -> TestClient:
+        client.cookies.set("access_token", create_token({"email": user.email}, ACCESS_TOKEN_EXPIRES))
+        client.cookies.set("provider", user.provider)
+        return client
+
+    return login
+
+
+@pytest.fixture(name="create_code")
+def create_code_fixture(engine):
+    def create_code(email: str, request_type: str = "recovery", minutes: int = 5, **kwargs) -> AuthCode:
+        auth_code = AuthCode(
+            email=email, request_type=request_type, expire_date=datetime.utcnow() + timedelta(minutes=minutes), **kwargs
+        )
+
+        async def add():
+            async with AsyncSession(engine, expire_on_commit=False) as session:
+                session.add(auth_code)
+                await session.commit()
+
+        asyncio.run(add())
+        return auth_code
+
+    return create_code
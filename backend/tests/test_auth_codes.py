@@ -0,0 +1,128 @@
+"""Test issuing and verifying auth codes in every store."""
+
+import asyncio
+import time
+from datetime import timedelta
+from typing import Callable
+
+import fakeredis
+import pytest
+from fastapi import HTTPException
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.dependencies import authcodes
+from app.dependencies.authcodes import MemoryAuthCodeStore, RedisAuthCodeStore, SQLAuthCodeStore
+from app.dependencies.users import create_code, verify_code
+from app.models.users import AuthCode
+
+EMAIL = "alice@example.com"
+
+
+@pytest.fixture(name="store", params=["sql", "memory", "redis"])
+def store_fixture(request: pytest.FixtureRequest) -> str:
+    return request.param
+
+
+@pytest.fixture(name="use_store")
+def use_store_fixture(store: str, monkeypatch: pytest.MonkeyPatch) -> Callable:
+    server = fakeredis.FakeServer()
+    stores = {"sql": SQLAuthCodeStore(), "memory": MemoryAuthCodeStore()}
+
+    def use_store():
+        # Redis clients are bound to the event loop they connect in, and each call runs in its own loop
+        if store == "redis":
+            stores["redis"] = RedisAuthCodeStore(fakeredis.FakeAsyncRedis(server=server))
+        monkeypatch.setattr(authcodes, "STORE", stores[store])
+
+    return use_store
+
+
+@pytest.fixture(name="issue")
+def issue_fixture(engine, use_store: Callable):
+    def issue(expires: timedelta = timedelta(minutes=5)) -> str:
+        async def run():
+            use_store()
+            async with AsyncSession(engine, expire_on_commit=False) as session:
+                code = await create_code(session, EMAIL, "recovery", expires)
+                await session.commit()
+                return code
+
+        return asyncio.run(run())
+
+    return issue
+
+
+@pytest.fixture(name="verify")
+def verify_fixture(engine, use_store: Callable):
+    def verify(code: str) -> tuple[int, str]:
+        async def run():
+            use_store()
+            async with AsyncSession(engine, expire_on_commit=False) as session:
+                try:
+                    await verify_code(session, code, EMAIL, "recovery")
+                except HTTPException as exception:
+                    return exception.status_code, exception.detail
+                return 200, "Code is valid"
+
+        return asyncio.run(run())
+
+    return verify
+
+
+def test_code_used_once(issue, verify):
+    code = issue()
+
+    assert verify(code) == (200, "Code is valid")
+    assert verify(code)[0] == 404
+
+
+def test_only_latest_code_valid(issue, verify):
+    older = issue()
+    latest = issue()
+
+    assert verify(older) == (400, "Code is invalid")
+    assert verify(latest)[0] == 200
+
+
+def test_expired_code(issue, verify, store: str):
+    code = issue(timedelta(milliseconds=1))
+    time.sleep(0.01)
+
+    # Stores with native expiry forget expired codes, while the database can say why
+    if store == "sql":
+        assert verify(code) == (400, "Code is expired, request new code")
+    else:
+        assert verify(code) == (404, "Previous code not found, request new code")
+
+
+def test_missing_code(verify):
+    assert verify("") == (400, "Code is empty")
+    assert verify("abcdef") == (404, "Previous code not found, request new code")
+
+
+def test_sql_store_keeps_only_latest_code(engine, issue, store: str):
+    if store != "sql":
+        pytest.skip("Only the SQL store keeps rows")
+    for _ in range(3):
+        issue()
+
+    async def count():
+        async with AsyncSession(engine) as session:
+            return len((await session.exec(select(AuthCode))).all())
+
+    assert asyncio.run(count()) == 1
+
+
+def test_memory_store_prunes_expired_codes():
+    now = [0.0]
+    store = MemoryAuthCodeStore(clock=lambda: now[0])
+
+    async def run():
+        for i in range(10):
+            await store.issue(None, f"user{i}@example.com", "verify", timedelta(seconds=60))
+        now[0] += 60
+        await store.issue(None, EMAIL, "verify", timedelta(seconds=60))
+
+    asyncio.run(run())
+    assert list(store.codes) == [(EMAIL, "verify")]
@@ -0,0 +1,276 @@
+"""Test the friend routes."""
+
+import asyncio
+from typing import Callable
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import delete, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.dependencies.users import (
+    RELATIONSHIP_FRIENDS,
+    RELATIONSHIP_NONE,
+    RELATIONSHIP_PENDING_IN,
+    RELATIONSHIP_PENDING_OUT,
+    get_friend_edge,
+    get_relationship,
+    get_relationships,
+)
+from app.models.users import Friend, User
+from app.routers import users as user_routes
+
+
+def test_friend_request_flow(create_user: Callable, login: Callable):
+    alice = create_user("alice")
+    bob = create_user("bob")
+
+    client = login(alice)
+    response = client.post("/friends/send-request", json={"username": "bob"})
+    assert response.status_code == 200
+    response = client.post("/friends/send-request", json={"username": "bob"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Friend request already sent"
+
+    sent = client.get("/friends/requests/sent").json()
+    assert [request["username"] for request in sent] == ["bob"]
+
+    client = login(bob)
+    incoming = client.get("/friends/requests/incoming").json()
+    assert [request["username"] for request in incoming] == ["alice"]
+
+    response = client.post("/friends/accept-request", json={"username": "alice"})
+    assert response.status_code == 200
+    assert [friend["username"] for friend in client.get("/friends/").json()] == ["alice"]
+    assert client.get("/friends/requests/incoming").json() == []
+
+    client = login(alice)
+    assert [friend["username"] for friend in client.get("/friends/").json()] == ["bob"]
+    response = client.post("/friends/delete", json={"username": "bob"})
+    assert response.status_code == 200
+    assert client.get("/friends/").json() == []
+
+
+def test_decline_and_revert_friend_request(create_user: Callable, login: Callable):
+    create_user("alice")
+    bob = create_user("bob")
+    carol = create_user("carol")
+
+    client = login(bob)
+    assert client.post("/friends/send-request", json={"username": "alice"}).status_code == 200
+    assert client.post("/friends/revert-request", json={"username": "alice"}).status_code == 200
+    assert client.get("/friends/requests/sent").json() == []
+
+    client = login(carol)
+    assert client.post("/friends/send-request", json={"username": "bob"}).status_code == 200
+    client = login(bob)
+    assert client.post("/friends/decline-request", json={"username": "carol"}).status_code == 200
+    assert client.get("/friends/requests/incoming").json() == []
+    assert client.get("/friends/").json() == []
+
+
+def test_read_user(create_user: Callable, login: Callable, client: TestClient):
+    alice = create_user("alice", fullname="Alice")
+    response = login(alice).get("/user/")
+    assert response.status_code == 200
+    assert response.json()["fullname"] == "Alice"
+    client.cookies.set("access_token", "invalid")
+    assert client.get("/user/").status_code == 401
+
+
+def test_relationship_states(engine, create_user: Callable, login: Callable):
+    alice = create_user("alice")
+    bob = create_user("bob")
+
+    async def relationships():
+        async with AsyncSession(engine) as session:
+            return await get_relationship(session, alice, bob), await get_relationship(session, bob, alice)
+
+    assert asyncio.run(relationships()) == (RELATIONSHIP_NONE, RELATIONSHIP_NONE)
+
+    client = login(bob)
+    assert client.post("/friends/send-request", json={"username": "alice"}).status_code == 200
+    assert asyncio.run(relationships()) == (RELATIONSHIP_PENDING_IN, RELATIONSHIP_PENDING_OUT)
+
+    client = login(alice)
+    response = client.post("/friends/send-request", json={"username": "bob"})
+    assert response.json()["detail"] == "Friend request already received"
+    assert client.post("/friends/accept-request", json={"username": "bob"}).status_code == 200
+    assert asyncio.run(relationships()) == (RELATIONSHIP_FRIENDS, RELATIONSHIP_FRIENDS)
+
+    async def edges():
+        async with AsyncSession(engine) as session:
+            return (await session.exec(select(Friend))).all()
+
+    (edge,) = asyncio.run(edges())
+    assert (edge.user_uid, edge.friend_uid) == get_friend_edge(bob.uid, alice.uid)
+    assert edge.user_uid < edge.friend_uid
+
+
+def test_bulk_friend_actions(create_user: Callable, login: Callable):
+    alice = create_user("alice")
+    senders = ["bob", "carol", "dave"]
+    for username in senders:
+        client = login(create_user(username))
+        assert client.post("/friends/send-request", json={"username": "alice"}).status_code == 200
+    create_user("erin", disabled=True)
+
+    client = login(alice)
+    response = client.post(
+        "/friends/bulk",
+        json={"action": "accept", "usernames": ["bob", "carol", "bob", "alice", "erin", "nobody"]},
+    )
+    assert response.status_code == 200
+    assert [(result["username"], result["status_code"]) for result in response.json()] == [
+        ("bob", 200),
+        ("carol", 200),
+        ("alice", 400),
+        ("erin", 404),
+        ("nobody", 404),
+    ]
+    assert sorted(friend["username"] for friend in client.get("/friends/").json()) == ["bob", "carol"]
+
+    response = client.post("/friends/bulk", json={"action": "decline", "usernames": ["bob", "dave"]})
+    assert [result["detail"] for result in response.json()] == ["Friend already added", "Friend request declined"]
+    assert client.get("/friends/requests/incoming").json() == []
+
+    response = client.post("/friends/bulk", json={"action": "delete", "usernames": ["bob", "carol", "dave"]})
+    assert [result["status_code"] for result in response.json()] == [200, 200, 400]
+    assert client.get("/friends/").json() == []
+
+
+def test_bulk_friend_action_limits(create_user: Callable, login: Callable):
+    client = login(create_user("alice"))
+
+    assert client.post("/friends/bulk", json={"action": "accept", "usernames": []}).status_code == 400
+    response = client.post("/friends/bulk", json={"action": "accept", "usernames": [f"u{i}" for i in range(101)]})
+    assert response.status_code == 400
+    assert client.post("/friends/bulk", json={"action": "befriend", "usernames": ["bob"]}).status_code == 422
+
+
+def befriend(engine, *pairs):
+    async def add():
+        async with AsyncSession(engine) as session:
+            for user, other in pairs:
+                low_uid, high_uid = get_friend_edge(user.uid, other.uid)
+                session.add(Friend(user_uid=low_uid, friend_uid=high_uid))
+            await session.commit()
+
+    asyncio.run(add())
+
+
+def test_friends_have_mutual_friend_counts(engine, create_user: Callable, login: Callable):
+    alice, bob, carol, dave = (create_user(name) for name in ["alice", "bob", "carol", "dave"])
+    befriend(engine, (alice, bob), (alice, carol), (bob, carol), (bob, dave), (carol, dave))
+
+    friends = login(alice).get("/friends/").json()
+    assert {friend["username"]: friend["mutual_friends"] for friend in friends} == {"bob": 1, "carol": 1}
+
+
+def test_friend_suggestions(engine, create_user: Callable, login: Callable):
+    alice, bob, carol, dave, erin, frank, gina = (
+        create_user(name) for name in ["alice", "bob", "carol", "dave", "erin", "frank", "gina"]
+    )
+    disabled = create_user("henry", disabled=True)
+    befriend(
+        engine,
+        (alice, bob),
+        (alice, carol),
+        (bob, dave),
+        (carol, dave),
+        (bob, erin),
+        (carol, frank),
+        (frank, gina),
+        (bob, disabled),
+    )
+    client = login(alice)
+
+    suggestions = client.get("/friends/suggestions").json()
+    # Enabled friends of friends only, most mutual friends first, then by uid
+    assert [(s["username"], s["mutual_friends"]) for s in suggestions] == [("dave", 2)] + sorted(
+        [("erin", 1), ("frank", 1)], key=lambda s: {"erin": erin.uid, "frank": frank.uid}[s[0]]
+    )
+    assert [s["username"] for s in client.get("/friends/suggestions", params={"limit": 1}).json()] == ["dave"]
+
+    # A pending request hides the suggestion, and the cached suggestions are invalidated
+    assert client.post("/friends/send-request", json={"username": "dave"}).status_code == 200
+    assert "dave" not in [s["username"] for s in client.get("/friends/suggestions").json()]
+
+    client = login(dave)
+    assert client.post("/friends/accept-request", json={"username": "alice"}).status_code == 200
+    client = login(alice)
+    friends = {friend["username"]: friend["mutual_friends"] for friend in client.get("/friends/").json()}
+    assert friends == {"bob": 1, "carol": 1, "dave": 2}
+
+
+def test_friend_suggestions_cached_until_friendships_change(engine, create_user: Callable, login: Callable):
+    alice, bob, carol = (create_user(name) for name in ["alice", "bob", "carol"])
+    befriend(engine, (alice, bob), (bob, carol))
+    client = login(alice)
+    assert [s["username"] for s in client.get("/friends/suggestions").json()] == ["carol"]
+
+    # Friendships changed behind the cache's back are only seen once it expires
+    befriend(engine, (alice, carol))
+    assert [s["username"] for s in client.get("/friends/suggestions").json()] == ["carol"]
+    assert client.post("/friends/delete", json={"username": "bob"}).status_code == 200
+    assert [s["username"] for s in client.get("/friends/suggestions").json()] == ["bob"]
+
+    # Another worker's change bumps the version in the database, so this worker's cached suggestions are skipped
+    async def delete_elsewhere():
+        async with AsyncSession(engine) as session:
+            await session.exec(delete(Friend).where(Friend.user_uid.in_([alice.uid, carol.uid])))
+            await session.exec(
+                update(User).where(User.uid == alice.uid).values(friends_version=User.friends_version + 1)
+            )
+            await session.commit()
+
+    asyncio.run(delete_elsewhere())
+    assert client.get("/friends/suggestions").json() == []
+
+
+def test_accept_raced_by_another_accept(
+    engine, create_user: Callable, login: Callable, monkeypatch: pytest.MonkeyPatch
+):
+    alice, bob = create_user("alice"), create_user("bob")
+    assert login(bob).post("/friends/send-request", json={"username": "alice"}).status_code == 200
+    # Another request confirms the edge after this one read the relationship
+    befriend(engine, (alice, bob))
+
+    async def stale_relationship(*args):
+        return RELATIONSHIP_PENDING_IN
+
+    monkeypatch.setattr(user_routes, "get_relationship", stale_relationship)
+
+    response = login(alice).post("/friends/accept-request", json={"username": "bob"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Friend already added"
+
+
+def test_bulk_accept_raced_by_another_accept(
+    engine, create_user: Callable, login: Callable, monkeypatch: pytest.MonkeyPatch
+):
+    alice, bob, carol = create_user("alice"), create_user("bob"), create_user("carol")
+    for user in [bob, carol]:
+        assert login(user).post("/friends/send-request", json={"username": "alice"}).status_code == 200
+    # Another request confirms one edge after this one read the relationships
+    befriend(engine, (alice, bob))
+
+    reads = []
+
+    async def stale_relationships(session, current_user, uids):
+        # Only the first read misses the confirmed edge
+        reads.append(uids)
+        if len(reads) == 1:
+            return dict.fromkeys(uids, RELATIONSHIP_PENDING_IN)
+        return await get_relationships(session, current_user, uids)
+
+    monkeypatch.setattr(user_routes, "get_relationships", stale_relationships)
+
+    client = login(alice)
+    response = client.post("/friends/bulk", json={"action": "accept", "usernames": ["bob", "carol"]})
+    assert response.status_code == 200
+    assert [(result["username"], result["status_code"]) for result in response.json()] == [
+        ("bob", 400),
+        ("carol", 200),
+    ]
+    assert sorted(friend["username"] for friend in client.get("/friends/").json()) == ["bob", "carol"]
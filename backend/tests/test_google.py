@@ -0,0 +1,138 @@
+"""Test Google sign in against a local JWKS stand-in."""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi.testclient import TestClient
+from jose import jwk, jwt
+
+from app.dependencies import users as user_dependencies
+from app.dependencies.users import GOOGLE_JWKS
+from app.routers import users as user_routes
+
+CLIENT_ID = "client-id"
+GOOGLE_ACCESS_TOKEN = "google-access-token"
+
+
+def get_cookies(response) -> dict[str, str]:
+    # The cookie jar drops secure cookies over plain HTTP, so read them from the headers
+    return dict(header.split(";")[0].split("=", 1) for header in response.headers.get_list("set-cookie"))
+
+
+@pytest.fixture(name="signing_key", scope="module")
+def signing_key_fixture() -> str:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+
+
+@pytest.fixture(name="jwks_server")
+def jwks_server_fixture(signing_key: str, monkeypatch: pytest.MonkeyPatch):
+    public_key = jwk.construct(signing_key, "RS256").public_key().to_dict()
+    body = json.dumps({"keys": [{**public_key, "kid": "key-1", "use": "sig"}]}).encode()
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(self.path)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Cache-Control", "public, max-age=3600")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(GOOGLE_JWKS, "url", f"http://127.0.0.1:{server.server_port}/certs")
+    monkeypatch.setattr(GOOGLE_JWKS, "keys", {})
+    monkeypatch.setattr(GOOGLE_JWKS, "refreshed", float("-inf"))
+    monkeypatch.setattr(user_dependencies, "GOOGLE_CLIENT_ID", CLIENT_ID)
+    yield requests
+    server.shutdown()
+
+
+@pytest.fixture(name="google_tokens")
+def google_tokens_fixture(signing_key: str, monkeypatch: pytest.MonkeyPatch) -> Callable:
+    def google_tokens(kid: str = "key-1", **claims):
+        now = int(time.time())
+        id_claims = {
+            "iss": "https://accounts.google.com",
+            "aud": CLIENT_ID,
+            "sub": "1234",
+            "email": "alice@gmail.com",
+            "email_verified": True,
+            "name": "Alice",
+            "picture": "https://example.com/alice.png",
+            "iat": now,
+            "exp": now + 3600,
+            **claims,
+        }
+        id_token = jwt.encode(
+            id_claims, signing_key, algorithm="RS256", headers={"kid": kid}, access_token=GOOGLE_ACCESS_TOKEN
+        )
+        tokens = {"access_token": GOOGLE_ACCESS_TOKEN, "refresh_token": "google-refresh-token", "id_token": id_token}
+
+        async def get_tokens(code: str) -> dict[str, str]:
+            return tokens
+
+        monkeypatch.setattr(user_routes, "google_get_tokens_from_code", get_tokens)
+        monkeypatch.setattr(user_routes, "google_get_tokens_from_refresh_token", get_tokens)
+
+    return google_tokens
+
+
+def test_google_session_verified_locally(client: TestClient, jwks_server: list[str], google_tokens: Callable):
+    google_tokens()
+
+    response = client.post("/token/google", json={"code": "code", "state": "signup"})
+    cookies = get_cookies(response)
+
+    assert response.status_code == 200
+    assert response.json()["email"] == "alice@gmail.com"
+    assert jwt.get_unverified_claims(cookies["access_token"])["provider"] == "google"
+    client.cookies.update(cookies)
+    for _ in range(3):
+        assert client.get("/user/").json()["fullname"] == "Alice"
+    assert jwks_server == ["/certs"]
+
+    client.cookies.delete("access_token")
+    response = client.post("/token/refresh")
+    assert response.status_code == 200
+    client.cookies.update(get_cookies(response))
+    assert client.get("/user/").status_code == 200
+    assert jwks_server == ["/certs"]
+
+
+@pytest.mark.parametrize(
+    "claims",
+    [
+        {"aud": "other-client-id"},
+        {"iss": "https://example.com"},
+        {"exp": int(time.time()) - 60},
+        {"email_verified": False},
+        {"kid": "unknown-key"},
+    ],
+)
+def test_google_invalid_id_token(client: TestClient, jwks_server: list[str], google_tokens: Callable, claims: dict):
+    google_tokens(**claims)
+
+    response = client.post("/token/google", json={"code": "code", "state": "signup"})
+
+    assert response.status_code == 401
+    assert len(jwks_server) == 1
+
+
+def test_template_token_rejected_for_google(client: TestClient, create_user: Callable, login: Callable):
+    client = login(create_user("alice", provider="google"))
+
+    assert client.get("/user/").status_code == 401
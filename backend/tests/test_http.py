@@ -0,0 +1,73 @@
+"""Test retries in the shared HTTP client."""
+
+import asyncio
+
+import httpx
+import pytest
+
+from app.dependencies import http
+from app.dependencies.http import HTTP_RETRIES, http_request
+
+
+@pytest.fixture(name="transport")
+def transport_fixture(monkeypatch: pytest.MonkeyPatch):
+    def transport(*outcomes) -> list[httpx.Request]:
+        requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            outcome = outcomes[min(len(requests), len(outcomes)) - 1]
+            if isinstance(outcome, Exception):
+                raise outcome
+            return httpx.Response(outcome)
+
+        monkeypatch.setattr(http, "HTTP_CLIENT", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        monkeypatch.setattr(http, "HTTP_RETRY_BACKOFF", 0)
+        return requests
+
+    return transport
+
+
+def test_retries_unavailable(transport):
+    requests = transport(503, 200)
+
+    response = asyncio.run(http_request("POST", "https://example.com/token"))
+
+    assert response.status_code == 200
+    assert len(requests) == 2
+
+
+def test_retries_run_out(transport):
+    requests = transport(503)
+
+    response = asyncio.run(http_request("GET", "https://example.com/certs"))
+
+    assert response.status_code == 503
+    assert len(requests) == HTTP_RETRIES + 1
+
+
+def test_retries_read_timeout_if_idempotent(transport):
+    requests = transport(httpx.ReadTimeout("timed out"), 200)
+
+    response = asyncio.run(http_request("GET", "https://example.com/certs"))
+
+    assert response.status_code == 200
+    assert len(requests) == 2
+
+
+def test_no_retry_read_timeout_if_not_idempotent(transport):
+    # The provider may have acted on the request, e.g. consumed a single-use code
+    requests = transport(httpx.ReadTimeout("timed out"), 200)
+
+    with pytest.raises(httpx.ReadTimeout):
+        asyncio.run(http_request("POST", "https://example.com/token"))
+    assert len(requests) == 1
+
+
+def test_retries_connect_error(transport):
+    requests = transport(httpx.ConnectError("refused"), 200)
+
+    response = asyncio.run(http_request("POST", "https://example.com/token"))
+
+    assert response.status_code == 200
+    assert len(requests) == 2
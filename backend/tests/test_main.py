@@ -1,6 +1,14 @@
 """Test the main.py file."""
+import asyncio
+
+import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import exc
+from sqlalchemy.ext.asyncio import create_async_engine
 
+from app import database
+from app.database import MeteredQueuePool
+from app.dependencies.security import API_KEY
 from app.main import app
 
 client = TestClient(app)
@@ -11,3 +19,55 @@ def test_read_main() -> None:
     response = client.get("/")
     assert response.status_code == 200
     assert response.json() == {"message": "API"}
+
+
+def test_read_database_metrics() -> None:
+    """Test the database metrics endpoint."""
+    response = client.get("/metrics/database", headers={"X-API-Key": API_KEY})
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data["checked_out"] == 0
+    assert data["max_connections"] == data["size"] + data["max_overflow"]
+    assert client.get("/metrics/database").status_code == 403
+
+
+def test_read_cache_metrics() -> None:
+    """Test the cache metrics endpoint."""
+    response = client.get("/metrics/cache", headers={"X-API-Key": API_KEY})
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data["principal"]["maxsize"] > 0
+    assert client.get("/metrics/cache").status_code == 403
+
+
+def test_database_metrics_unbounded_overflow(monkeypatch) -> None:
+    """Test max connections is null when the overflow is unbounded."""
+    monkeypatch.setattr(database.SETTINGS, "db_max_overflow", -1)
+    response = client.get("/metrics/database", headers={"X-API-Key": API_KEY})
+
+    assert response.json()["max_connections"] is None
+
+
+def test_pool_records_queue_wait() -> None:
+    """Test the pool records waiting for a free connection, not opening one."""
+    engine = create_async_engine(
+        "sqlite+aiosqlite://", poolclass=MeteredQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.2
+    )
+
+    pool = engine.pool
+
+    async def run():
+        async with engine.connect():
+            assert pool.max_wait_seconds == 0
+            with pytest.raises(exc.TimeoutError):
+                async with engine.connect():
+                    pass
+        await engine.dispose()
+
+    asyncio.run(run())
+    # Disposing replaces the pool, so its own counters are checked
+    assert pool.checkouts == 2
+    assert pool.timeouts == 1
+    assert pool.max_wait_seconds >= 0.2
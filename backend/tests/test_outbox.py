@@ -0,0 +1,212 @@
+"""Test queueing emails and sending them from the outbox."""
+
+import asyncio
+import socket
+from datetime import datetime, timedelta
+
+import pytest
+from aiosmtpd.controller import Controller
+from fastapi.testclient import TestClient
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.dependencies.emails import TEMPLATES
+from app.dependencies.outbox import OutboxWorker, SMTPPool, build_message, queue_email
+from app.models.users import AuthCode, EmailOutbox
+
+
+class Sink:
+    """SMTP handler keeping every message it receives."""
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):  # noqa: N802
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(name="sink")
+def sink_fixture():
+    sink = Sink()
+    controller = Controller(sink, hostname="127.0.0.1", port=get_free_port())
+    controller.start()
+    yield sink.messages, controller.hostname, controller.port
+    controller.stop()
+
+
+def queue(engine, count: int):
+    async def run():
+        async with AsyncSession(engine) as session:
+            for i in range(count):
+                queue_email(session, f"user{i}@example.com", "welcome", f"{i:06x}")
+            await session.commit()
+
+    asyncio.run(run())
+
+
+def get_outbox(engine) -> list[EmailOutbox]:
+    async def run():
+        async with AsyncSession(engine) as session:
+            return (await session.exec(select(EmailOutbox).order_by(EmailOutbox.id))).all()
+
+    return asyncio.run(run())
+
+
+def test_verify_email_queues_without_sending(client: TestClient, engine, sink):
+    messages = sink[0]
+    response = client.post(
+        "/verify-email",
+        json={"email": "alice@example.com", "password": "password", "confirm_password": "password"},
+    )
+    assert response.status_code == 200
+    assert messages == []
+
+    (email,) = get_outbox(engine)
+    assert email.recipient == "alice@example.com"
+    assert email.subject == "Verify Email"
+    assert email.status == "pending"
+
+    async def get_code():
+        async with AsyncSession(engine) as session:
+            return (await session.exec(select(AuthCode))).one()
+
+    # The code and the email carrying it are committed together
+    assert email.code == asyncio.run(get_code()).code
+
+
+def test_template_substitutes_code():
+    text, html = TEMPLATES["recovery"].render("a1b2c3")
+
+    assert "**a1b2c3**" in text
+    assert "<strong>a1b2c3</strong>" in html
+    assert "<strong>You've requested a password reset.</strong>" in html
+
+
+def test_worker_sends_batches_over_pool(engine, sink):
+    messages, host, port = sink
+    queue(engine, 20)
+    pool = SMTPPool(size=2, host=host, port=port, starttls=False, password="")
+    worker = OutboxWorker(engine, pool, batch_size=10)
+
+    assert asyncio.run(worker.send_batch()) == 10
+    assert asyncio.run(worker.send_batch()) == 10
+    # Connections are reused across batches rather than opened per email
+    assert pool.get_connects() <= 2
+    pool.close()
+
+    assert sorted(message.rcpt_tos[0] for message in messages) == sorted(f"user{i}@example.com" for i in range(20))
+    assert b"<strong>00000f</strong>" in next(
+        message.content for message in messages if "user15@" in message.rcpt_tos[0]
+    )
+    assert all(email.status == "sent" and email.sent_date for email in get_outbox(engine))
+    # Sent emails are not claimed again
+    assert asyncio.run(worker.send_batch()) == 0
+
+
+def test_pool_checks_and_expires_idle_connections(sink):
+    _, host, port = sink
+    pool = SMTPPool(size=1, idle_timeout=60, check_seconds=10, host=host, port=port, starttls=False, password="")
+    pool.send(build_message("alice@example.com", "Subject", "text", "<p>html</p>"))
+    (connection,) = pool.idle
+
+    # Past the check interval, a connection the relay dropped is replaced instead of failing the send
+    connection.last_used -= 30
+    connection.smtp.sock.shutdown(socket.SHUT_RDWR)
+    pool.send(build_message("alice@example.com", "Subject", "text", "<p>html</p>"))
+    assert pool.idle[0] is not connection
+
+    # Past the idle timeout, a connection is closed without being checked
+    (connection,) = pool.idle
+    connection.last_used -= 120
+    pool.send(build_message("alice@example.com", "Subject", "text", "<p>html</p>"))
+    assert pool.idle[0] is not connection
+    assert connection.smtp is None
+    assert pool.get_connects() == 3
+    pool.close()
+
+
+def test_worker_retries_then_fails_when_relay_down(engine):
+    queue(engine, 3)
+    # Nothing listens on a port that was just free
+    pool = SMTPPool(host="127.0.0.1", port=get_free_port(), starttls=False, password="", timeout=1)
+    worker = OutboxWorker(engine, pool, max_attempts=2)
+
+    asyncio.run(worker.send_batch())
+    first = get_outbox(engine)[0]
+    assert first.status == "pending"
+    assert first.attempts == 1
+    assert first.last_error
+    assert first.next_attempt_date > first.created_date
+
+    async def make_due():
+        async with AsyncSession(engine) as session:
+            email = await session.get(EmailOutbox, first.id)
+            email.next_attempt_date = datetime(2000, 1, 1)
+            session.add(email)
+            await session.commit()
+
+    asyncio.run(make_due())
+    asyncio.run(worker.send_batch())
+    assert get_outbox(engine)[0].status == "failed"
+
+
+def test_worker_isolates_a_broken_email(engine, sink):
+    messages, host, port = sink
+    queue(engine, 3)
+
+    async def break_template():
+        async with AsyncSession(engine) as session:
+            email = await session.get(EmailOutbox, 2)
+            email.template = "missing"
+            session.add(email)
+            await session.commit()
+
+    asyncio.run(break_template())
+    pool = SMTPPool(host=host, port=port, starttls=False, password="")
+    worker = OutboxWorker(engine, pool, max_attempts=1)
+
+    assert asyncio.run(worker.send_batch()) == 3
+    pool.close()
+
+    # The others are delivered and marked sent once, and the broken one fails on its own
+    assert sorted(message.rcpt_tos[0] for message in messages) == ["user0@example.com", "user2@example.com"]
+    assert [email.status for email in get_outbox(engine)] == ["sent", "failed", "sent"]
+    assert "KeyError" in get_outbox(engine)[1].last_error
+    assert asyncio.run(worker.send_batch()) == 0
+
+
+def test_worker_clears_codes_and_prunes_finished_emails(engine, sink):
+    _, host, port = sink
+    queue(engine, 2)
+    pool = SMTPPool(host=host, port=port, starttls=False, password="")
+    worker = OutboxWorker(engine, pool, retention=timedelta(hours=1))
+    asyncio.run(worker.send_batch())
+    pool.close()
+    queue(engine, 1)
+
+    assert [(email.status, email.code) for email in get_outbox(engine)] == [
+        ("sent", None),
+        ("sent", None),
+        ("pending", "000000"),
+    ]
+    assert asyncio.run(worker.prune()) == 0
+
+    async def age(email_id: int):
+        async with AsyncSession(engine) as session:
+            email = await session.get(EmailOutbox, email_id)
+            email.created_date = datetime.utcnow() - timedelta(hours=2)
+            session.add(email)
+            await session.commit()
+
+    asyncio.run(age(1))
+    asyncio.run(age(3))
+    # Only finished emails past the retention are deleted, however old a pending one is
+    assert asyncio.run(worker.prune()) == 1
+    assert [email.id for email in get_outbox(engine)] == [2, 3]
@@ -0,0 +1,99 @@
+"""Test keyset pagination of the friend lists."""
+
+import asyncio
+from datetime import datetime, timedelta
+from typing import Callable
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.dependencies.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+from app.dependencies.users import get_friend_edge
+from app.models.users import Friend, FriendRequest, User
+
+
+@pytest.fixture(name="add_links")
+def add_links_fixture(engine):
+    def add_links(links: list):
+        async def add():
+            async with AsyncSession(engine) as session:
+                session.add_all(links)
+                await session.commit()
+
+        asyncio.run(add())
+
+    return add_links
+
+
+def read_all(client: TestClient, url: str, **params) -> list[list[str]]:
+    pages = []
+    while True:
+        response = client.get(url, params=params)
+        assert response.status_code == 200
+        pages.append([row["username"] for row in response.json()])
+        if NEXT_CURSOR_HEADER not in response.headers:
+            return pages
+        params["cursor"] = response.headers[NEXT_CURSOR_HEADER]
+
+
+def test_friends_paged_by_date_and_username(create_user: Callable, login: Callable, add_links: Callable):
+    alice = create_user("alice")
+    # Either side of alice's uid, so both directions of the stored edge are paged, and some dates tie
+    friends = [create_user(f"friend{i:02d}") for i in range(7)]
+    start = datetime(2024, 1, 1)
+    dates = [start + timedelta(days=i // 2) for i in range(7)]
+    add_links(
+        [
+            Friend(user_uid=low, friend_uid=high, friendship_date=date)
+            for friend, date in zip(friends, dates, strict=True)
+            for low, high in [get_friend_edge(alice.uid, friend.uid)]
+        ]
+    )
+    client = login(alice)
+
+    by_date = [
+        friend.username for _, friend in sorted(zip(dates, friends, strict=True), key=lambda x: (x[0], x[1].uid))
+    ]
+    pages = read_all(client, "/friends/", limit=3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert sum(pages, []) == by_date
+
+    pages = read_all(client, "/friends/", limit=3, sort="username")
+    assert sum(pages, []) == sorted(friend.username for friend in friends)
+
+
+def test_friend_requests_paged(create_user: Callable, login: Callable, add_links: Callable):
+    alice = create_user("alice")
+    senders = [create_user(f"sender{i}") for i in range(5)]
+    add_links([FriendRequest(user_uid=sender.uid, friend_uid=alice.uid) for sender in senders])
+    add_links(
+        [
+            FriendRequest(user_uid=alice.uid, friend_uid=sender.uid, request_date=datetime(2024, 1, 3 - i))
+            for i, sender in enumerate(senders[:3])
+        ]
+    )
+    client = login(alice)
+
+    pages = read_all(client, "/friends/requests/incoming", limit=2, sort="username")
+    assert pages == [["sender0", "sender1"], ["sender2", "sender3"], ["sender4"]]
+    assert read_all(client, "/friends/requests/sent", limit=2) == [["sender2", "sender1"], ["sender0"]]
+
+
+def test_invalid_cursor(create_user: Callable, login: Callable):
+    client = login(create_user("alice"))
+    cursor = encode_cursor("date", datetime(2024, 1, 1), create_user("bob").uid)
+
+    assert client.get("/friends/", params={"cursor": cursor}).status_code == 200
+    # A cursor only points into the sort it was issued for
+    response = client.get("/friends/", params={"cursor": cursor, "sort": "username"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Cursor is invalid"
+    assert client.get("/friends/", params={"cursor": "not a cursor"}).status_code == 400
+    assert client.get("/friends/", params={"limit": 0}).status_code == 422
+
+
+def test_cursor_round_trip():
+    user = User(username="alice")
+
+    assert decode_cursor(encode_cursor("username", "alice", user.uid), "username") == ("alice", user.uid)
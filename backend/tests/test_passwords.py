@@ -0,0 +1,66 @@
+"""Test password hashing in the password process pool."""
+
+import asyncio
+from typing import Callable
+
+import pytest
+from fastapi.testclient import TestClient
+from passlib.context import CryptContext
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.dependencies import passwords
+from app.dependencies.passwords import MIN_BCRYPT_ROUNDS, PASSWORD_BCRYPT_ROUNDS, calibrate_bcrypt_rounds, hash_password
+from app.models.users import User
+
+PASSWORD = "correct horse battery staple"
+
+
+@pytest.fixture(name="alice")
+def alice_fixture(create_user: Callable):
+    return create_user("alice", hashed_password=hash_password(PASSWORD))
+
+
+def test_login_hashes_in_pool(client: TestClient, alice):
+    hashes = passwords.PasswordStats.hashes
+
+    assert client.post("/token/login", json={"email": alice.email, "password": "wrong"}).status_code == 401
+    assert client.post("/token/login", json={"email": alice.email, "password": PASSWORD}).status_code == 200
+
+    metrics = client.get("/metrics/passwords").json()
+    assert metrics["hashes"] == hashes + 2
+    assert metrics["pending"] == 0
+    assert metrics["max_hash_ms"] > 0
+
+
+def test_login_rejected_when_saturated(client: TestClient, alice, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(passwords, "PASSWORD_MAX_PENDING", 0)
+    rejected = passwords.PasswordStats.rejected
+
+    response = client.post("/token/login", json={"email": alice.email, "password": PASSWORD})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert client.get("/metrics/passwords").json()["rejected"] == rejected + 1
+
+
+def test_login_rehashes_outdated_hash(engine, client: TestClient, create_user: Callable):
+    outdated = CryptContext(schemes=["bcrypt"], bcrypt__rounds=PASSWORD_BCRYPT_ROUNDS + 1).hash(PASSWORD)
+    alice = create_user("alice", hashed_password=outdated)
+
+    assert client.post("/token/login", json={"email": alice.email, "password": PASSWORD}).status_code == 200
+
+    async def get_hash() -> str:
+        async with AsyncSession(engine) as session:
+            return (await session.get(User, alice.id)).hashed_password
+
+    hashed_password = asyncio.run(get_hash())
+    assert hashed_password != outdated
+    assert hashed_password.startswith(f"$2b${PASSWORD_BCRYPT_ROUNDS:02d}$")
+    assert client.post("/token/login", json={"email": alice.email, "password": PASSWORD}).status_code == 200
+
+
+def test_calibrate_bcrypt_rounds_floor():
+    rounds, seconds = calibrate_bcrypt_rounds(target_seconds=0, samples=1)
+
+    assert rounds == MIN_BCRYPT_ROUNDS
+    assert seconds > 0
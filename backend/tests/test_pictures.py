@@ -0,0 +1,87 @@
+"""Test the picture routes."""
+
+import base64
+import hashlib
+import io
+from typing import Callable
+
+import pytest
+from PIL import Image
+
+from app.dependencies import pictures
+from app.dependencies.pictures import PICTURE_FORMATS, PICTURE_SIZES, process_picture, shutdown_picture_pool
+
+
+def make_picture(width: int = 300, height: int = 200, fmt: str = "PNG") -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "teal").save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+@pytest.fixture(name="picture", scope="module")
+def picture_fixture():
+    yield make_picture()
+    shutdown_picture_pool()
+
+
+def test_process_picture():
+    pictures = process_picture(make_picture(fmt="JPEG"), [48, 96], ["webp"], 1_000_000)
+
+    assert set(pictures) == {(48, "webp"), (96, "webp")}
+    with Image.open(io.BytesIO(pictures[(48, "webp")])) as image:
+        assert image.format == "WEBP"
+        assert image.size == (48, 48)
+    with pytest.raises(ValueError):
+        process_picture(make_picture(), [48], ["webp"], 100)
+
+
+def test_upload_and_read_picture(create_user: Callable, login: Callable, picture: bytes):
+    client = login(create_user("alice"))
+    response = client.post("/user/picture", files={"picture": ("avatar.png", picture, "image/png")})
+    assert response.status_code == 200
+
+    digest = hashlib.sha256(picture).hexdigest()
+    url = response.json()["profile_picture"]
+    assert url == f"/pictures/{digest}_96.{PICTURE_FORMATS[0]}"
+    assert client.get("/user/").json()["profile_picture"] == url
+
+    response = client.get(url, headers={"X-API-Key": ""})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == f"image/{PICTURE_FORMATS[0]}"
+    assert response.headers["etag"] == f'"{url.split("/")[-1]}"'
+    assert "immutable" in response.headers["cache-control"]
+
+    response = client.get(url, headers={"If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
+
+    for size in PICTURE_SIZES:
+        for fmt in PICTURE_FORMATS:
+            assert client.get(f"/pictures/{digest}_{size}.{fmt}").status_code == 200
+
+
+def test_data_url_picture_is_stored(create_user: Callable, login: Callable, picture: bytes):
+    client = login(create_user("alice"))
+    data_url = f"data:image/png;base64,{base64.b64encode(picture).decode()}"
+    response = client.patch("/user/update", json={"profile_picture": data_url})
+
+    assert response.status_code == 200
+    assert response.json()["profile_picture"].startswith(f"/pictures/{hashlib.sha256(picture).hexdigest()}_")
+
+
+def test_invalid_picture(create_user: Callable, login: Callable):
+    client = login(create_user("alice"))
+    response = client.post("/user/picture", files={"picture": ("avatar.gif", b"GIF89a", "image/gif")})
+    assert response.status_code == 400
+    response = client.post("/user/picture", files={"picture": ("avatar.png", b"\x89PNG\r\n\x1a\n", "image/png")})
+    assert response.status_code == 400
+    assert client.get("/pictures/missing.png").status_code == 404
+    assert client.get(f"/pictures/{'0' * 64}_96.webp").status_code == 404
+
+
+def test_picture_rejected_when_saturated(create_user: Callable, login: Callable, monkeypatch: pytest.MonkeyPatch):
+    client = login(create_user("alice"))
+    monkeypatch.setattr(pictures.PictureStats, "pending", pictures.PICTURE_MAX_PENDING + pictures.PICTURE_MAX_WAITING)
+    response = client.post("/user/picture", files={"picture": ("avatar.png", make_picture(301), "image/png")})
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
@@ -0,0 +1,28 @@
+"""Test running functions in a process pool."""
+
+import asyncio
+import os
+
+import pytest
+from fastapi import HTTPException
+
+from app.dependencies.processes import ProcessPool
+
+
+def test_pool_replaced_after_a_process_dies():
+    pool = ProcessPool(1, "Work is unavailable")
+
+    async def run():
+        assert await pool.run(pow, 2, 10) == 1024
+        with pytest.raises(HTTPException) as info:
+            await pool.run(os._exit, 1)
+        assert info.value.status_code == 503
+        assert info.value.detail == "Work is unavailable"
+        assert pool.executor is None
+        # The next run starts a new pool
+        assert await pool.run(pow, 2, 3) == 8
+
+    try:
+        asyncio.run(run())
+    finally:
+        pool.shutdown()
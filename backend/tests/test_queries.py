@@ -0,0 +1,285 @@
+"""Test the number of statements issued per route."""
+
+import asyncio
+import time
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Callable
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.dependencies.users import (
+    PRINCIPAL_CACHE,
+    create_token,
+    get_friend_suggestions,
+    get_friends,
+    get_incoming_friend_requests,
+    get_relationship,
+    get_sent_friend_requests,
+    verify_code,
+)
+from app.models.users import Page, User
+
+
+@pytest.fixture(name="statements")
+def statements_fixture(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.fixture(name="explain")
+def explain_fixture(engine):
+    def explain(helper: Callable, *args) -> list[str]:
+        captured = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            captured.append((statement, parameters))
+
+        async def run():
+            event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+            async with AsyncSession(engine) as session:
+                await helper(session, *args)
+            event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+            assert len(captured) == 1
+            statement, parameters = captured[0]
+            async with engine.connect() as conn:
+                return (await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)).all()
+
+        return [row[-1] for row in asyncio.run(run())]
+
+    return explain
+
+
+def test_read_user_single_statement(create_user: Callable, login: Callable, statements: list[str]):
+    alice = create_user("alice")
+    bob = create_user("bob")
+    client = login(bob)
+    assert client.post("/friends/send-request", json={"username": "alice"}).status_code == 200
+    client = login(alice)
+    assert client.post("/friends/accept-request", json={"username": "bob"}).status_code == 200
+
+    PRINCIPAL_CACHE.clear()
+    statements.clear()
+    response = client.get("/user/")
+
+    assert response.status_code == 200
+    assert len(statements) == 1
+    assert "hashed_password" not in statements[0]
+    assert "refresh_token" not in statements[0]
+
+
+def test_read_user_cached(create_user: Callable, login: Callable, statements: list[str]):
+    client = login(create_user("alice"))
+    assert client.get("/user/").status_code == 200
+
+    statements.clear()
+    response = client.get("/user/")
+
+    assert response.status_code == 200
+    assert statements == []
+    assert PRINCIPAL_CACHE.get_metrics().hits == 1
+
+
+def test_read_friends_single_statement(create_user: Callable, login: Callable, statements: list[str]):
+    alice = create_user("alice")
+    bob = create_user("bob")
+    client = login(bob)
+    assert client.post("/friends/send-request", json={"username": "alice"}).status_code == 200
+    client = login(alice)
+    assert client.post("/friends/accept-request", json={"username": "bob"}).status_code == 200
+    # Caches the principal
+    assert client.get("/friends/").status_code == 200
+
+    for url in ["/friends/", "/friends/requests/incoming"]:
+        statements.clear()
+        response = client.get(url)
+
+        assert response.status_code == 200
+        assert len(statements) == 1
+        assert "hashed_password" not in statements[0]
+        assert "email" not in statements[0]
+    assert [friend["username"] for friend in client.get("/friends/").json()] == ["bob"]
+    assert set(client.get("/friends/").json()[0]) == {
+        "uid",
+        "join_date",
+        "profile_picture",
+        "username",
+        "friendship_date",
+        "mutual_friends",
+    }
+
+
+def test_bulk_friend_action_statements(create_user: Callable, login: Callable, statements: list[str]):
+    alice = create_user("alice")
+    usernames = [f"user{i}" for i in range(10)]
+    for username in usernames:
+        assert login(create_user(username)).post("/friends/send-request", json={"username": "alice"}).status_code == 200
+    client = login(alice)
+    assert client.get("/friends/").status_code == 200
+
+    statements.clear()
+    response = client.post("/friends/bulk", json={"action": "accept", "usernames": usernames})
+
+    assert [result["status_code"] for result in response.json()] == [200] * 10
+    # The user, targets, relationships, the request update, one batched insert of the new edges and one version bump
+    assert len(statements) == 6
+
+
+def test_principal_cache_invalidation(create_user: Callable, login: Callable):
+    client = login(create_user("alice"))
+    assert client.get("/user/").json()["fullname"] is None
+
+    assert client.patch("/user/update", json={"fullname": "Alice"}).status_code == 200
+    assert client.get("/user/").json()["fullname"] == "Alice"
+
+    assert client.delete("/user/delete").status_code == 200
+    assert client.get("/user/").status_code == 401
+
+
+def test_principal_cache_expires_with_token(create_user: Callable, client: TestClient):
+    alice = create_user("alice")
+    client.cookies.set("access_token", create_token({"email": alice.email}, timedelta(seconds=1)))
+    client.cookies.set("provider", alice.provider)
+    assert client.get("/user/").status_code == 200
+
+    # The cached principal does not outlive the token, which is checked to the second
+    time.sleep(2.1)
+    assert client.get("/user/").status_code == 401
+
+
+def test_disabling_user_invalidates_principal(engine, create_user: Callable, login: Callable):
+    alice = create_user("alice")
+    client = login(alice)
+    assert client.get("/user/").status_code == 200
+
+    async def disable():
+        async with AsyncSession(engine) as session:
+            user = await session.get(User, alice.id)
+            user.disabled = True
+            await session.commit()
+
+    asyncio.run(disable())
+
+    assert client.get("/user/").status_code == 401
+
+
+def test_update_keeps_other_writers_changes(engine, create_user: Callable, login: Callable):
+    alice = create_user("alice")
+    client = login(alice)
+    assert client.get("/user/").status_code == 200
+
+    async def update_elsewhere():
+        # Another worker's write does not reach this worker's cached principal
+        async with AsyncSession(engine) as session:
+            await session.exec(update(User).where(User.id == alice.id).values(fullname="Alice", is_sidebar_open=False))
+            await session.commit()
+
+    asyncio.run(update_elsewhere())
+
+    # Only the requested field is written over the stored row, not the whole cached principal
+    response = client.patch("/user/update", json={"account_view": "friends"})
+    assert response.status_code == 200
+    assert response.json()["fullname"] == "Alice"
+    assert response.json()["is_sidebar_open"] is False
+
+
+def test_principal_defers_heavy_columns(create_user: Callable, login: Callable, statements: list[str]):
+    client = login(create_user("alice"))
+
+    statements.clear()
+    response = client.get("/friends/")
+
+    # The first request in a worker also builds the revocation filter
+    principal = [statement for statement in statements if "revoked_token" not in statement][0]
+    assert response.status_code == 200
+    assert "hashed_password" not in principal
+    assert "profile_picture" not in principal
+
+
+def test_refresh_with_valid_token_defers_heavy_columns(create_user: Callable, login: Callable, statements: list[str]):
+    client = login(create_user("alice"))
+
+    statements.clear()
+    response = client.post("/token/refresh")
+
+    users = [statement for statement in statements if "revoked_token" not in statement]
+    assert response.status_code == 200
+    assert len(users) == 1
+    assert "hashed_password" not in users[0]
+    assert "refresh_token" not in users[0]
+
+
+def test_delete_user_removes_links(create_user: Callable, login: Callable):
+    alice = create_user("alice")
+    bob = create_user("bob")
+    create_user("carol")
+    client = login(bob)
+    assert client.post("/friends/send-request", json={"username": "alice"}).status_code == 200
+    assert client.post("/friends/send-request", json={"username": "carol"}).status_code == 200
+    client = login(alice)
+    assert client.post("/friends/accept-request", json={"username": "bob"}).status_code == 200
+
+    assert login(bob).delete("/user/delete").status_code == 200
+    assert login(alice).get("/friends/").json() == []
+
+
+@pytest.mark.parametrize("helper", [get_sent_friend_requests, get_incoming_friend_requests, get_friends])
+def test_friend_helpers_use_indexes(create_user: Callable, explain: Callable, helper: Callable):
+    plan = explain(partial(helper, page=Page(limit=10)), create_user("alice"))
+
+    # The list indexes hold the link date and the other user's uid, so link rows are never read
+    assert any("COVERING INDEX ix_friend" in step for step in plan)
+    assert not any("INTEGER PRIMARY KEY" in step for step in plan)
+    assert not any(step.startswith("SCAN friend") or step.startswith("SCAN user") for step in plan)
+
+
+@pytest.mark.parametrize("helper", [get_sent_friend_requests, get_incoming_friend_requests, get_friends])
+def test_friend_pages_read_indexes_in_order(create_user: Callable, explain: Callable, helper: Callable):
+    page = Page(limit=10, after=(datetime(2024, 1, 1), uuid4()))
+    plan = explain(partial(helper, page=page), create_user("alice"))
+
+    # The index seeks straight to the cursor and is read in order, so only the page itself is sorted
+    # Every direction paged seeks to the cursor, while friends' mutual friends are looked up without one
+    searches = [step for step in plan if "INDEX ix_friend" in step and ")>(?,?)" in step]
+    assert len(searches) == (2 if helper is get_friends else 1)
+    assert plan.count("USE TEMP B-TREE FOR ORDER BY") == 1
+    assert not any(step.startswith("SCAN friend") or step.startswith("SCAN user") for step in plan)
+
+
+def test_friend_suggestions_use_indexes(create_user: Callable, explain: Callable):
+    plan = explain(partial(get_friend_suggestions, limit=10), create_user("alice"))
+
+    # Friends and their friends are both looked up by uid in the list indexes, never by scanning edges
+    assert any("COVERING INDEX ix_friend_user_uid_status_friendship_date" in step for step in plan)
+    assert any("COVERING INDEX ix_friend_friend_uid_status_friendship_date" in step for step in plan)
+    assert not any(step.startswith("SCAN friend ") or step == "SCAN friend" for step in plan)
+
+
+def test_relationship_uses_indexes(create_user: Callable, explain: Callable):
+    plan = explain(get_relationship, create_user("alice"), create_user("bob"))
+
+    assert any("uq_friend_edge" in step for step in plan)
+    assert any("uq_friendrequest_pending_pair" in step for step in plan)
+    assert not any(step.startswith("SCAN") for step in plan)
+
+
+def test_verify_code_single_statement(create_code: Callable, explain: Callable):
+    for _ in range(3):
+        create_code("alice@example.com")
+    auth_code = create_code("alice@example.com")
+
+    plan = explain(verify_code, auth_code.code, auth_code.email, "recovery")
+
+    assert any("ix_authcode_email_request_type_status_request_date" in step for step in plan)
+    assert not any(step.startswith("SCAN") for step in plan)
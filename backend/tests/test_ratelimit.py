@@ -0,0 +1,143 @@
+"""Test token bucket rate limiting."""
+
+import asyncio
+import ipaddress
+
+import fakeredis
+import pytest
+from fastapi import Request
+from fastapi.testclient import TestClient
+
+from app.dependencies import ratelimit
+from app.dependencies.ratelimit import (
+    RATE_LIMITERS,
+    MemoryRateLimitBackend,
+    RateLimitBackend,
+    RedisRateLimitBackend,
+    get_client_ip,
+    parse_rate,
+)
+
+BUCKETS = {"ip": (2, 1.0), "account": (1, 0.1)}
+
+
+class FailingRateLimitBackend(RateLimitBackend):
+    """Backend that is unreachable."""
+
+    async def take(self, buckets):
+        raise ConnectionError("backend down")
+
+    async def close(self):
+        pass
+
+
+def test_parse_rate():
+    assert parse_rate("10/minute") == (10, 10 / 60)
+    assert parse_rate("3/hour") == (3, 3 / 3600)
+    # A bucket that never refills has no Retry-After
+    for rate in ["0/minute", "-1/minute", "10/week"]:
+        with pytest.raises(ValueError):
+            parse_rate(rate)
+
+
+def test_memory_backend_refills():
+    now = [0.0]
+    backend = MemoryRateLimitBackend(clock=lambda: now[0])
+
+    async def run():
+        results = [await backend.take(BUCKETS) for _ in range(2)]
+        now[0] += 10
+        results.append(await backend.take(BUCKETS))
+        return results
+
+    assert asyncio.run(run()) == [0, 10, 0]
+
+
+def test_memory_backend_takes_all_or_none():
+    backend = MemoryRateLimitBackend(clock=lambda: 0.0)
+
+    async def run():
+        assert await backend.take({"a": (1, 1.0)}) == 0
+        assert await backend.take({"a": (1, 1.0), "b": (1, 1.0)}) == 1
+        # b was not spent by the rejected request
+        return await backend.take({"b": (1, 1.0)})
+
+    assert asyncio.run(run()) == 0
+
+
+def test_redis_backend_shared_between_workers():
+    server = fakeredis.FakeServer()
+    workers = [RedisRateLimitBackend(fakeredis.FakeAsyncRedis(server=server)) for _ in range(2)]
+
+    async def run():
+        results = [await worker.take(BUCKETS) for worker in workers]
+        for worker in workers:
+            await worker.close()
+        return results
+
+    allowed, rejected = asyncio.run(run())
+    assert allowed == 0
+    assert rejected == pytest.approx(10, abs=0.1)
+
+
+def test_login_rate_limited_by_email(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    limiter = RATE_LIMITERS["login"]
+    monkeypatch.setitem(limiter.budgets, "account", (2, 2 / 60))
+    rejected = limiter.rejected
+
+    for _ in range(2):
+        assert client.post("/token/login", json={"email": "alice@example.com", "password": "x"}).status_code == 401
+    response = client.post("/token/login", json={"email": "Alice@example.com ", "password": "x"})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "30"
+    assert client.post("/token/login", json={"email": "bob@example.com", "password": "x"}).status_code == 401
+    assert client.get("/metrics/rate-limits").json()["login"]["rejected"] == rejected + 1
+
+
+def test_login_rate_limited_by_username(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setitem(RATE_LIMITERS["login"].budgets, "account", (1, 1 / 60))
+
+    assert client.post("/token/login", json={"username": "alice", "password": "x"}).status_code == 401
+    assert client.post("/token/login", json={"username": " Alice", "password": "x"}).status_code == 429
+    assert client.post("/token/login", json={"username": "bob", "password": "x"}).status_code == 401
+
+
+def test_rate_limit_allows_when_backend_down(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(ratelimit, "BACKEND", FailingRateLimitBackend())
+    errors = RATE_LIMITERS["login"].errors
+
+    response = client.post("/token/login", json={"email": "alice@example.com", "password": "x"})
+
+    assert response.status_code == 401
+    assert client.get("/metrics/rate-limits").json()["login"]["errors"] == errors + 1
+
+
+def make_request(host: str, forwarded_for: str = None) -> Request:
+    headers = [(b"x-forwarded-for", forwarded_for.encode())] if forwarded_for else []
+    return Request({"type": "http", "client": (host, 1234), "headers": headers})
+
+
+def test_client_ip_from_trusted_proxies(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(ratelimit, "TRUSTED_PROXIES", [ipaddress.ip_network("10.0.0.0/8")])
+
+    assert get_client_ip(make_request("10.0.0.2", "203.0.113.9")) == "203.0.113.9"
+    # Addresses left of the client were sent by the client, so they cannot be trusted
+    assert get_client_ip(make_request("10.0.0.2", "198.51.100.1, 203.0.113.9, 10.0.0.3")) == "203.0.113.9"
+    assert get_client_ip(make_request("10.0.0.2")) == "10.0.0.2"
+    # Anyone else's header is ignored
+    assert get_client_ip(make_request("192.0.2.7", "203.0.113.9")) == "192.0.2.7"
+
+
+def test_login_rate_limited_by_forwarded_ip(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    # The test client's address is not an IP, so trust every proxy and send the frontend's header
+    monkeypatch.setattr(ratelimit, "get_client_ip", lambda request: request.headers.get("X-Forwarded-For"))
+    monkeypatch.setitem(RATE_LIMITERS["login"].budgets, "ip", (1, 1 / 60))
+
+    def login(ip: str, email: str) -> int:
+        headers = {"X-Forwarded-For": ip}
+        return client.post("/token/login", json={"email": email, "password": "x"}, headers=headers).status_code
+
+    assert login("203.0.113.9", "alice@example.com") == 401
+    assert login("203.0.113.9", "bob@example.com") == 429
+    assert login("203.0.113.10", "carol@example.com") == 401
@@ -0,0 +1,135 @@
+"""Test token revocation through the bloom filter and revoked token table."""
+
+import asyncio
+from datetime import datetime, timedelta
+from typing import Callable
+
+import pytest
+from fastapi.testclient import TestClient
+from jose import jwt
+from sqlalchemy import event
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.dependencies.revocation import REVOCATIONS, BloomFilter, RevocationList
+from app.dependencies.users import ACCESS_TOKEN_EXPIRES, create_token
+from app.models.users import RevokedToken
+
+
+@pytest.fixture(name="clock")
+def clock_fixture(monkeypatch: pytest.MonkeyPatch):
+    now = [0.0]
+    monkeypatch.setattr(REVOCATIONS, "clock", lambda: now[0])
+    return now
+
+
+def test_bloom_filter_error_rate():
+    bloom_filter = BloomFilter(capacity=10_000, error_rate=0.01)
+    members = [f"member-{i}" for i in range(10_000)]
+    for member in members:
+        bloom_filter.add(member)
+
+    assert all(member in bloom_filter for member in members)
+    false_positives = sum(f"other-{i}" in bloom_filter for i in range(10_000))
+    assert false_positives < 10_000 * 0.01 * 2
+    assert bloom_filter.count > 10_000 * 0.99
+
+
+def test_tokens_are_unique():
+    assert create_token({"email": "alice@example.com"}, ACCESS_TOKEN_EXPIRES) != create_token(
+        {"email": "alice@example.com"}, ACCESS_TOKEN_EXPIRES
+    )
+
+
+def test_logout_revokes_access_token(client: TestClient, create_user: Callable, login: Callable):
+    client = login(create_user("alice"))
+    access_token = client.cookies["access_token"]
+    assert client.get("/user/").status_code == 200
+
+    assert client.post("/token/logout").status_code == 200
+    client.cookies.set("access_token", access_token)
+
+    assert client.get("/user/").status_code == 401
+    metrics = client.get("/metrics/revocations").json()
+    assert metrics["size"] == 1
+    assert metrics["possible_positives"] >= 1
+
+
+def test_unrevoked_check_skips_database(
+    engine, client: TestClient, create_user: Callable, login: Callable, clock: list[float]
+):
+    client = login(create_user("alice"))
+    assert client.get("/user/").status_code == 200
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    client.cookies.set("access_token", create_token({"email": "alice@example.com"}, ACCESS_TOKEN_EXPIRES))
+    assert client.get("/user/").status_code == 200
+    event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+    assert [statement for statement in statements if "revoked_token" in statement] == []
+
+
+def test_revocation_from_other_worker(
+    engine, client: TestClient, create_user: Callable, login: Callable, clock: list[float]
+):
+    client = login(create_user("alice"))
+    jti = jwt.get_unverified_claims(client.cookies["access_token"])["jti"]
+    assert client.get("/user/").status_code == 200
+
+    async def revoke_elsewhere():
+        # Another worker revoking the token only writes the table, not this worker's filter
+        async with AsyncSession(engine) as session:
+            session.add(RevokedToken(jti=jti, expire_date=datetime.utcnow() + timedelta(minutes=15)))
+            await session.commit()
+
+    asyncio.run(revoke_elsewhere())
+    assert client.get("/user/").status_code == 200
+
+    clock[0] += REVOCATIONS.refresh_seconds
+    assert client.get("/user/").status_code == 401
+
+
+def test_logout_raced_by_another_logout(engine, client: TestClient, create_user: Callable, login: Callable):
+    client = login(create_user("alice"))
+    access_token = client.cookies["access_token"]
+    jti = jwt.get_unverified_claims(access_token)["jti"]
+    assert client.get("/user/").status_code == 200
+
+    async def revoke_elsewhere():
+        # A concurrent logout with the same token commits first, before this worker's filter has it
+        async with AsyncSession(engine) as session:
+            session.add(RevokedToken(jti=jti, expire_date=datetime.utcnow() + timedelta(minutes=15)))
+            await session.commit()
+
+    asyncio.run(revoke_elsewhere())
+    assert client.post("/token/logout").status_code == 200
+
+    client.cookies.set("access_token", access_token)
+    assert client.get("/user/").status_code == 401
+
+    async def count():
+        async with AsyncSession(engine) as session:
+            return len((await session.exec(select(RevokedToken).where(RevokedToken.jti == jti))).all())
+
+    assert asyncio.run(count()) == 1
+
+
+def test_concurrent_checks_wait_for_first_build(engine):
+    revocations = RevocationList(capacity=100, error_rate=0.01, refresh_seconds=60)
+
+    async def run():
+        async with AsyncSession(engine) as session:
+            session.add(RevokedToken(jti="revoked", expire_date=datetime.utcnow() + timedelta(minutes=15)))
+            await session.commit()
+        async with AsyncSession(engine) as first, AsyncSession(engine) as second:
+            # The second check must not see the empty filter while the first builds it
+            return await asyncio.gather(
+                revocations.is_revoked(first, "revoked"), revocations.is_revoked(second, "revoked")
+            )
+
+    assert asyncio.run(run()) == [True, True]
+    assert revocations.refreshes == 1
@@ -0,0 +1,151 @@
+"""Test typeahead user search with both backends."""
+
+import asyncio
+from typing import Callable
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.dependencies import search
+from app.dependencies.pagination import NEXT_CURSOR_HEADER
+from app.dependencies.search import MemoryUserSearch, SortedKeys, SQLUserSearch
+from app.models.users import Page
+
+
+@pytest.fixture(name="backend", params=["sql", "memory"])
+def backend_fixture(request, monkeypatch, engine):
+    backend = {"sql": SQLUserSearch, "memory": MemoryUserSearch}[request.param]()
+    if isinstance(backend, MemoryUserSearch):
+        # Loaded up front, so searches are served from memory rather than by SQL while it loads
+        asyncio.run(backend.load(engine))
+    monkeypatch.setattr(search, "SEARCH", backend)
+    return backend
+
+
+def search_usernames(client: TestClient, q: str, **params) -> list[str]:
+    response = client.get("/users/search", params={"q": q, **params})
+    assert response.status_code == 200
+    return [user["username"] for user in response.json()]
+
+
+def test_search_ranks_usernames_before_fullnames(backend, create_user: Callable, login: Callable, client: TestClient):
+    alice = create_user("alice")
+    create_user("bobby", fullname="Zed Bobson")
+    create_user("zed", fullname="Bob Marley")
+    create_user("Bob_2")
+    create_user("carol", fullname="Carol Bo")
+    login(alice)
+
+    assert search_usernames(client, "BOB") == ["Bob_2", "bobby", "zed"]
+    assert search_usernames(client, "bob_") == ["Bob_2"]
+
+
+def test_search_fuzzy_matches_only_with_sql(backend, create_user: Callable, login: Callable, client: TestClient):
+    alice = create_user("alice")
+    create_user("carol", fullname="Carol Bobson")
+    login(alice)
+
+    # Substrings stand in for trigrams outside Postgres
+    expected = ["carol"] if isinstance(backend, SQLUserSearch) else []
+    assert search_usernames(client, "bobs") == expected
+    # Too short to match anywhere but at the start
+    assert search_usernames(client, "ob") == []
+
+
+def test_search_excludes_disabled(backend, create_user: Callable, login: Callable, client: TestClient):
+    alice = create_user("alice")
+    create_user("dave")
+    create_user("dana", disabled=True)
+    login(alice)
+
+    assert search_usernames(client, "da") == ["dave"]
+
+
+def test_search_paged(backend, create_user: Callable, login: Callable, client: TestClient):
+    alice = create_user("alice")
+    for i in range(5):
+        create_user(f"erin{i}", fullname=f"Erin {i}")
+    create_user("frank", fullname="Erin Frank")
+    login(alice)
+
+    pages = []
+    params = {"limit": 2}
+    while True:
+        response = client.get("/users/search", params={"q": "erin", **params})
+        assert response.status_code == 200
+        pages.append([user["username"] for user in response.json()])
+        if NEXT_CURSOR_HEADER not in response.headers:
+            break
+        params["cursor"] = response.headers[NEXT_CURSOR_HEADER]
+
+    # Each user appears once, under their username if both match
+    assert pages == [["erin0", "erin1"], ["erin2", "erin3"], ["erin4", "frank"]]
+
+
+def test_search_rejects_invalid_queries(create_user: Callable, login: Callable, client: TestClient):
+    login(create_user("alice"))
+
+    assert client.get("/users/search", params={"q": ""}).status_code == 422
+    assert client.get("/users/search", params={"q": "a" * 65}).status_code == 422
+    response = client.get("/users/search", params={"q": "a", "cursor": "bad"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Cursor is invalid"
+
+
+def test_memory_follows_signups_and_renames(
+    create_user: Callable, login: Callable, client: TestClient, engine, monkeypatch
+):
+    backend = MemoryUserSearch()
+    monkeypatch.setattr(search, "SEARCH", backend)
+    alice = create_user("alice")
+    asyncio.run(backend.load(engine))
+    login(alice)
+    assert search_usernames(client, "gina") == []
+
+    # Updated as users commit
+    create_user("gina")
+    assert search_usernames(client, "gina") == ["gina"]
+
+    assert client.patch("/user/update", json={"fullname": "Harriet"}).status_code == 200
+    assert search_usernames(client, "harr") == ["alice"]
+    assert client.patch("/user/update", json={"fullname": "Ivy"}).status_code == 200
+    assert search_usernames(client, "harr") == []
+    assert search_usernames(client, "ivy") == ["alice"]
+
+
+def test_memory_loads_in_background(create_user: Callable, engine):
+    create_user("carol", fullname="Carol Bobson")
+    backend = MemoryUserSearch()
+
+    async def run():
+        async with AsyncSession(engine) as session:
+            # SQL serves searches until the index is loaded, fuzzy matches included
+            rows = await backend.search(session, "bobs", Page(limit=10))
+            assert [row.username for row in rows] == ["carol"]
+            assert not backend.loaded
+            # Changes committed while loading are applied on top of what the load read
+            uid = uuid4()
+            backend.update({uid: {"username": "Dora"}})
+            await backend.loading
+            assert backend.loaded
+            assert await backend.search(session, "bobs", Page(limit=10)) == []
+            assert [row.name for row in await backend.search(session, "carol", Page(limit=10))] == ["carol"]
+            assert list(backend.usernames.iter_prefix("dora")) == [("dora", uid)]
+        await backend.close()
+
+    asyncio.run(run())
+
+
+def test_sorted_keys_iterates_prefixes_after_cursor():
+    first, second = sorted([uuid4(), uuid4()])
+    keys = SortedKeys([("abd", first), ("abc", second), ("ab", first), ("b", first)])
+    keys.add("abc", first)
+
+    assert list(keys.iter_prefix("ab")) == [("ab", first), ("abc", first), ("abc", second), ("abd", first)]
+    assert list(keys.iter_prefix("ab", ("abc", first))) == [("abc", second), ("abd", first)]
+    assert list(keys.iter_prefix("c")) == []
+    keys.remove("abc", second)
+    keys.remove("abc", second)
+    assert list(keys.iter_prefix("abc")) == [("abc", first)]
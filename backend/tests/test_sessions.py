@@ -0,0 +1,114 @@
+"""Test per-device refresh token sessions."""
+
+import asyncio
+from typing import Callable
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.dependencies.passwords import hash_password
+from app.dependencies.users import hash_refresh_token
+from app.models.users import UserSession
+
+PASSWORD = "correct horse battery staple"
+
+
+def get_cookies(response) -> dict[str, str]:
+    # The cookie jar drops secure cookies over plain HTTP, so read them from the headers
+    return dict(header.split(";")[0].split("=", 1) for header in response.headers.get_list("set-cookie"))
+
+
+@pytest.fixture(name="alice")
+def alice_fixture(create_user: Callable):
+    return create_user("alice", hashed_password=hash_password(PASSWORD))
+
+
+@pytest.fixture(name="device_login")
+def device_login_fixture(client: TestClient, alice):
+    def device_login(user_agent: str) -> str:
+        client.cookies.clear()
+        response = client.post(
+            "/token/login", json={"email": alice.email, "password": PASSWORD}, headers={"User-Agent": user_agent}
+        )
+        assert response.status_code == 200
+        return get_cookies(response)["refresh_token"]
+
+    return device_login
+
+
+def refresh(client: TestClient, refresh_token: str):
+    client.cookies.clear()
+    client.cookies.set("refresh_token", refresh_token)
+    client.cookies.set("provider", "template")
+    return client.post("/token/refresh")
+
+
+def get_sessions(engine) -> list[UserSession]:
+    async def get():
+        async with AsyncSession(engine) as session:
+            return (await session.exec(select(UserSession))).all()
+
+    return asyncio.run(get())
+
+
+def test_sessions_per_device(engine, client: TestClient, device_login: Callable):
+    laptop = device_login("laptop")
+    phone = device_login("phone")
+
+    sessions = get_sessions(engine)
+    assert sorted(user_session.user_agent for user_session in sessions) == ["laptop", "phone"]
+    assert {user_session.token_hash for user_session in sessions} == {
+        hash_refresh_token(laptop),
+        hash_refresh_token(phone),
+    }
+
+    client.cookies.clear()
+    client.cookies.set("refresh_token", laptop)
+    assert client.post("/token/logout").status_code == 200
+
+    assert refresh(client, laptop).status_code == 401
+    assert refresh(client, phone).status_code == 200
+
+
+def test_refresh_rotates_token(client: TestClient, device_login: Callable):
+    old = device_login("laptop")
+
+    response = refresh(client, old)
+    assert response.status_code == 200
+    new = get_cookies(response)["refresh_token"]
+
+    assert new != old
+    assert refresh(client, old).status_code == 401
+    assert refresh(client, new).status_code == 200
+
+
+def test_refresh_leaves_user_row(engine, client: TestClient, device_login: Callable):
+    refresh_token = device_login("laptop")
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    response = refresh(client, refresh_token)
+    event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+    assert response.status_code == 200
+    assert len([statement for statement in statements if statement.startswith("SELECT")]) == 1
+    assert [statement.split()[1] for statement in statements if statement.startswith("UPDATE")] == ["session"]
+
+
+def test_disabled_user_cannot_refresh(engine, client: TestClient, alice, device_login: Callable):
+    refresh_token = device_login("laptop")
+
+    async def disable():
+        async with AsyncSession(engine) as session:
+            alice.disabled = True
+            session.add(alice)
+            await session.commit()
+
+    asyncio.run(disable())
+    assert refresh(client, refresh_token).status_code == 401
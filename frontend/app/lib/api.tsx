@@ -1,6 +1,6 @@
 "use server";
 
-import { cookies } from "next/headers";
+import { cookies, headers } from "next/headers";
 
 const removeTrailingSlash = (url: string | undefined) =>
   url ? url.replace(/\/$/, "") : "";
@@ -11,12 +11,16 @@ const apiUrlPort = process.env.API_PORT ? `:${process.env.API_PORT}` : "";
 const apiUrl = `${apiUrlBase}${apiUrlPort}`;
 
 const sendRequest = async (route: string, method: string, data: any = null) => {
+  // Every call comes from this server, so pass on who it is calling for, for per-client rate limits. Only the
+  // right-most address was added by the proxy in front of this server, anything left of it is up to the client.
+  const forwardedFor = headers().get("x-forwarded-for")?.split(",").pop()?.trim();
   let request: RequestInit = {
     method: method,
     headers: {
       "Content-Type": "application/json",
       "X-API-Key": process.env.API_KEY || "",
       Cookie: cookies().toString(),
+      ...(forwardedFor ? { "X-Forwarded-For": forwardedFor } : {}),
     },
     credentials: "include",
   };
@@ -1,4 +1,6 @@
 /** @type {import('next').NextConfig} */
+const apiUrl = process.env.API_URL ? new URL(process.env.API_URL) : null;
+
 const nextConfig = {
     images: {
         remotePatterns: [
@@ -8,8 +10,17 @@ const nextConfig = {
                 port: '',
                 pathname: '/**/*',
             },
+            // Profile pictures stored by the backend
+            ...(apiUrl ? [
+                {
+                    protocol: apiUrl.protocol.replace(':', ''),
+                    hostname: apiUrl.hostname,
+                    port: process.env.API_PORT || apiUrl.port,
+                    pathname: '/pictures/**',
+                },
+            ] : []),
         ],
     },
 }
 
-module.exports = nextConfig
\ No newline at end of file
+module.exports = nextConfig